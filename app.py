@@ -1,19 +1,30 @@
 """
 Realt Assistant — Персональный ассистент риэлтора
 """
-from fastapi import FastAPI, Request
+import hmac
+import asyncio
+import time
+from fastapi import FastAPI, HTTPException, Request
 from typing import Dict, Any
 
-from config import TELEGRAM_BOT_TOKEN
-from db.database import init_db, get_user_state, clear_user_state
+from config import TELEGRAM_BOT_TOKEN, STREAM_ANSWERS, STATS_TOKEN
+from db.database import init_db, get_user_state, clear_user_state, count_ingest_jobs
 from bot.states import States, is_exit_command
 from services.telegram import send_message, answer_callback, get_file_type
 
 from bot.handlers.start import handle_start, handle_help, handle_menu, handle_my_properties
-from db.database import save_message, get_chat_history
-from services.llm import universal_respond, generate_html_document
+from db.database import (
+    save_message, get_chat_history, search_apartments, count_apartments_by_property, get_user_properties
+)
+from services.llm import universal_respond, universal_respond_stream, generate_html_document
 from services.html_to_pdf import html_to_pdf, wrap_html
-from services.rag import search as rag_search
+from services.rag import search as rag_search, search_many as rag_search_many, fuse_results
+from services.lexical import backfill_lexical_index
+from services.extraction_cache import get_stats as extraction_cache_stats
+from services.embedding_cache import get_stats as embedding_cache_stats
+from services.search_cache import get_stats as search_cache_stats
+from services import answer_cache, llm_gateway, stream_message
+from services.ingest import set_completion_callback, start_workers
 from services.calculators import (
     calc_installment, calc_mortgage, calc_roi,
     format_installment_result, format_mortgage_result, format_roi_result
@@ -21,7 +32,8 @@ from services.calculators import (
 
 from bot.handlers.add_property import (
     handle_add_property_start, handle_property_name, handle_file_upload,
-    handle_files_done, handle_confirm_property, handle_property_correction, handle_cancel
+    handle_files_done, handle_confirm_property, handle_property_correction, handle_cancel,
+    handle_ingest_finished, handle_update_materials_start
 )
 from bot.handlers.query import (
     handle_open_property, handle_download_file, handle_all_files, handle_property_summary,
@@ -46,6 +58,9 @@ app = FastAPI(title="Realt Assistant", version="0.5.0")
 @app.on_event("startup")
 async def startup():
     init_db()
+    await asyncio.to_thread(backfill_lexical_index)
+    set_completion_callback(handle_ingest_finished)
+    start_workers()
     print("[APP] Started v0.5.0 — Calculators")
 
 
@@ -54,6 +69,35 @@ async def health():
     return {"ok": True, "service": "realt-assistant", "version": "0.3.0"}
 
 
+LOCAL_HOSTS = ("127.0.0.1", "::1", "localhost")
+# Туннель (cloudflared) и прокси подключаются с localhost — запрос снаружи выдают эти заголовки
+PROXY_HEADERS = ("x-forwarded-for", "forwarded", "x-real-ip", "cf-connecting-ip")
+
+
+def _stats_allowed(request: Request) -> bool:
+    """Статистика кэшей, задач и моделей — не для чужих глаз"""
+    if STATS_TOKEN:
+        return hmac.compare_digest(request.headers.get("x-stats-token", ""), STATS_TOKEN)
+    if any(header in request.headers for header in PROXY_HEADERS):
+        return False
+    return request.client is not None and request.client.host in LOCAL_HOSTS
+
+
+@app.get("/stats")
+async def stats(request: Request):
+    if not _stats_allowed(request):
+        raise HTTPException(status_code=403, detail="forbidden")
+    return {
+        "extraction_cache": extraction_cache_stats(),
+        "embedding_cache": embedding_cache_stats(),
+        "search_cache": search_cache_stats(),
+        "answer_cache": answer_cache.get_stats(),
+        "llm": llm_gateway.get_stats(),
+        "streaming": stream_message.get_stats(),
+        "ingest_jobs": count_ingest_jobs()
+    }
+
+
 @app.post("/webhook")
 async def webhook(request: Request):
     try:
@@ -140,6 +184,9 @@ async def process_callback(callback: Dict[str, Any]):
     elif data.startswith("open_property_"):
         property_id = int(data.replace("open_property_", ""))
         await handle_open_property(chat_id, property_id)
+    elif data.startswith("update_materials_"):
+        property_id = int(data.replace("update_materials_", ""))
+        await handle_update_materials_start(chat_id, property_id)
     elif data.startswith("download_"):
         file_id = int(data.replace("download_", ""))
         await handle_download_file(chat_id, file_id)
@@ -209,7 +256,7 @@ async def process_message(message: Dict[str, Any]):
         else:
             await send_message(chat_id, "✏️ Введи название ЖК")
         return
-    if state == States.ADD_PROPERTY_FILES:
+    if state in (States.ADD_PROPERTY_FILES, States.UPDATE_PROPERTY_FILES):
         if file_id:
             await handle_file_upload(chat_id, message)
             return
@@ -218,6 +265,10 @@ async def process_message(message: Dict[str, Any]):
             return
         await send_message(chat_id, "📁 Отправь файлы или нажми «Готово»")
         return
+    if state == States.ADD_PROPERTY_PROCESSING and file_id:
+        # Пока идёт обработка, можно общаться как обычно — только файлы уже не принимаем
+        await send_message(chat_id, "⏳ Ещё обрабатываю материалы — пришлю карточку ЖК, как только закончу")
+        return
     if state == States.ADD_PROPERTY_CONFIRM:
         if text:
             await handle_property_correction(chat_id, text)
@@ -269,32 +320,36 @@ def extract_price_range(query: str) -> tuple:
     return None, None
 
 
-def filter_chunks_by_price(chunks: list, min_price: int, max_price: int) -> list:
-    """Фильтрует чанки по диапазону цен и добавляет метку"""
-    import re
-    filtered = []
-    
-    for chunk in chunks:
-        text = chunk['text']
-        
-        # Ищем цену в формате "Цена – 16181278"
-        match = re.search(r'Цена\s*[–-]\s*(\d+)', text)
-        if match:
-            price = int(match.group(1))
-            if min_price <= price <= max_price:
-                chunk["text"] = "PODHODIT " + str(price) + " " + text
-                filtered.insert(0, chunk)
-                filtered.insert(0, chunk)  # В начало
-            else:
-                filtered.append(chunk)
-        else:
-            filtered.append(chunk)
+def apartments_to_chunks(apartments: list, totals: dict) -> list:
+    """
+    Квартиры из инвентаря в формате чанков RAG — один блок на ЖК
+    
+    totals — сколько квартир ЖК в диапазоне на самом деле: если в блок попала
+    только часть, LLM должна видеть настоящее число, а не длину списка.
+    """
+    by_property = {}
+    for apartment in apartments:
+        key = (apartment.property_id, apartment.property_name)
+        by_property.setdefault(key, []).append(apartment.to_line())
     
-    return filtered
+    chunks = []
+    for (prop_id, prop_name), lines in by_property.items():
+        total = max(totals.get(prop_id, 0), len(lines))
+        if total > len(lines):
+            header = f"КВАРТИРЫ В ЗАПРОШЕННОМ ДИАПАЗОНЕ (всего {total} шт., ниже {len(lines)} самых дешёвых, из прайса)"
+        else:
+            header = f"КВАРТИРЫ В ЗАПРОШЕННОМ ДИАПАЗОНЕ ({total} шт., из прайса)"
+        chunks.append({
+            "text": header + ":\n" + "\n".join(lines),
+            "metadata": {"property_id": prop_id, "property_name": prop_name},
+            "distance": 0
+        })
+    return chunks
 
 
 async def handle_universal(chat_id: int, text: str, state_data: dict = None):
     """Универсальный обработчик через RAG + LLM"""
+    received = time.perf_counter()
     
     # Сохраняем сообщение пользователя
     save_message(chat_id, "user", text)
@@ -302,23 +357,97 @@ async def handle_universal(chat_id: int, text: str, state_data: dict = None):
     # Улучшаем запрос для RAG - добавляем ключевые слова для поиска квартир
     search_query = enrich_query_for_rag(text)
     
-    # RAG поиск
     property_id = state_data.get("property_id") if state_data else None
-    chunks = rag_search(chat_id, search_query, property_id=property_id, limit=50)
     
-    # Фильтруем по цене если указан диапазон
+    # Диапазон цен — сначала индексный запрос по инвентарю квартир
     min_price, max_price = extract_price_range(text)
-    if min_price is not None:
-        chunks = filter_chunks_by_price(chunks, min_price, max_price)
     
-    # История диалога
+    # История диалога — последнее в ней только что сохранённый вопрос
     history = get_chat_history(chat_id, limit=6)
     
-    # LLM ответ
-    result = await universal_respond(text, chunks, history)
+    # Вопрос о выбранном ЖК уже задавали — прошлый ответ без RAG и LLM.
+    # Подбор по цене не кэшируем: ответ зависит от инвентаря, а не от чанков.
+    # С предыдущими репликами тоже: «а рассрочка есть?» LLM понимает по истории,
+    # которой нет в ключе кэша
+    cache_property = property_id if min_price is None and len(history) <= 1 else None
+    cached, cache_state = await answer_cache.lookup(cache_property, text, "universal")
+    if cached is not None:
+        await execute_action(chat_id, {"action": "text", "content": cached}, property_id)
+        return
+    started = time.perf_counter()
+    
+    apartments = []
+    if min_price is not None:
+        # Без выбранного ЖК — до 20 квартир на каждый: дешёвые квартиры одного ЖК
+        # не вытесняют остальные
+        apartments = search_apartments(chat_id, property_id, min_price, max_price, limit=60,
+                                       per_property=None if property_id else 20)
+    
+    # Слова пользователя и они же с ключевыми словами карточек квартир — одним поиском,
+    # результаты сливаются
+    queries = list(dict.fromkeys([text, search_query]))
+    
+    if apartments:
+        # Квартиры уже отобраны по цене, RAG — только для контекста (условия, описание)
+        chunks = apartments_to_chunks(
+            apartments, count_apartments_by_property(chat_id, property_id, min_price, max_price)
+        )
+        # ЖК без инвентаря (старые, прайс не разобрался) — для них диапазон цен
+        # по-прежнему фильтрует сам поиск по числам в метаданных чанков
+        stocked = set(count_apartments_by_property(chat_id, property_id))
+        unstocked = not property_id and any(p.id not in stocked for p in get_user_properties(chat_id))
+        searches = [rag_search_many(chat_id, queries, property_id=property_id, limit=10)]
+        if unstocked:
+            searches.append(rag_search_many(chat_id, queries, limit=15, min_price=min_price, max_price=max_price))
+        found = await asyncio.gather(*searches)
+        context = fuse_results(found[0], 10)
+        if unstocked:
+            seen = {c.get("id") for c in context}
+            context += [
+                c for c in fuse_results(found[1], 15)
+                if c["metadata"].get("property_id") not in stocked and c.get("id") not in seen
+            ]
+        chunks += context
+    else:
+        # Инвентарь пуст (старый ЖК, прайс не разобрался) — диапазон цен фильтрует сам поиск
+        # по числам в метаданных чанков; гибридный поиск обходится без широкой выборки
+        chunks = []
+        if min_price is not None:
+            chunks = fuse_results(await rag_search_many(chat_id, queries, property_id=property_id, limit=15,
+                                                        min_price=min_price, max_price=max_price), 15)
+        if not chunks:
+            chunks = fuse_results(await rag_search_many(chat_id, queries, property_id=property_id, limit=15), 15)
+    
+    # LLM ответ — потоком в сообщение-заглушку, пока генерируется
+    reply = None
+    if STREAM_ANSWERS:
+        reply = stream_message.StreamingMessage(chat_id, started=received)
+        reply.start()
+        result = await universal_respond_stream(text, chunks, history, on_text=reply.update)
+    else:
+        result = await universal_respond(text, chunks, history)
+    seconds = time.perf_counter() - started
+    is_text = result.get("action", "text") == "text"
+    
+    answered = False
+    if reply:
+        # Текст уже в заглушке — дописываем окончательный; действие (JSON) — заглушку
+        # убираем, ответ отправит execute_action
+        content = result.get("content", "🤔 Не понял запрос")
+        if is_text and await reply.finish(content):
+            save_message(chat_id, "assistant", content)
+            answered = True
+        else:
+            await reply.cancel()
+    
+    if not answered:
+        # Выполняем действие
+        await execute_action(chat_id, result, property_id)
     
-    # Выполняем действие
-    await execute_action(chat_id, result, property_id)
+    # Ответ уже у пользователя — запись в кэш ответов идёт в фоне
+    if is_text:
+        answer_cache.remember_later(cache_property, text, result.get("content", ""), "universal",
+                                    cache_state, seconds)
 
 
 async def execute_action(chat_id: int, result: dict, property_id: int = None):
@@ -386,6 +515,9 @@ async def generate_kp_universal(chat_id: int, property_id: int = None, query: st
     
     prop = None
     
+    # Один запрос на оба поиска: второй берёт вектор из кэша эмбеддингов
+    kp_query = query or "коммерческое предложение"
+    
     # 1. Если указан property_id
     if property_id:
         prop = get_property(property_id)
@@ -401,7 +533,7 @@ async def generate_kp_universal(chat_id: int, property_id: int = None, query: st
     
     # 3. Ищем в RAG и берём property_id из чанков
     if not prop:
-        chunks = rag_search(chat_id, query or "коммерческое предложение", limit=5)
+        chunks = await rag_search(chat_id, kp_query, limit=5)
         if chunks:
             chunk_prop_id = chunks[0].get("metadata", {}).get("property_id")
             if chunk_prop_id:
@@ -425,7 +557,7 @@ async def generate_kp_universal(chat_id: int, property_id: int = None, query: st
     await send_message(chat_id, "⏳ Генерирую КП...")
     
     # RAG поиск для дополнительных данных
-    chunks = rag_search(chat_id, query or "коммерческое предложение", property_id=property_id, limit=10)
+    chunks = await rag_search(chat_id, kp_query, property_id=property_id, limit=10)
     
     # Генерируем HTML
     html = await generate_html_document(property_data, chunks, query)
@@ -0,0 +1,163 @@
+"""
+Бенчмарк полноты поиска против размера векторов на нашем корпусе
+
+Берёт коллекцию из каталога Chroma (по умолчанию data/chroma, работает
+с копией) с полными векторами OpenAI и для каждой размерности строит
+коллекцию из усечённых векторов — как при EMBEDDING_DIMENSIONS. Запросами
+служат сами чанки: для каждого эталон — точные top-k по полным float32
+векторам (без него самого).
+
+Режимы для каждой размерности:
+    hnsw    — top-k из HNSW по усечённым векторам
+    int8    — top-k × factor кандидатов из HNSW, пересчёт по полным int8
+              (EMBEDDING_RESCORE=int8)
+    float16 — то же по полным float16, для сравнения
+
+Размер: каталог Chroma на диске и байт на чанк — вектор в HNSW плюс
+полный вектор для пересчёта.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_embedding_size --dims 1536,1024,512,256,128 --k 10
+"""
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def load_corpus(chromadb, source: Path, user: str):
+    """Копия каталога Chroma → (ids, матрица полных векторов)"""
+    tmp = Path(tempfile.mkdtemp())
+    shutil.copytree(source, tmp / "chroma")
+    client = chromadb.PersistentClient(path=str(tmp / "chroma"))
+    names = [c if isinstance(c, str) else c.name for c in client.list_collections()]
+    name = user or next((n for n in names if n.startswith("user_")), None)
+    if name is None:
+        sys.exit(f"В {source} нет коллекций user_*")
+    data = client.get_collection(name).get(include=["embeddings"])
+    vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    shutil.rmtree(tmp, ignore_errors=True)
+    return name, data["ids"], vectors
+
+
+def truncate(vectors: np.ndarray, dim: int) -> np.ndarray:
+    part = vectors[:, :dim].copy()
+    part /= np.linalg.norm(part, axis=1, keepdims=True)
+    return part
+
+
+def exact_top(vectors: np.ndarray, queries: list, k: int) -> list:
+    """Эталон: top-k по полным float32 без самого запроса"""
+    scores = vectors[queries] @ vectors.T
+    scores[np.arange(len(queries)), queries] = -np.inf
+    return [set(np.argsort(-row)[:k]) for row in scores]
+
+
+def rescore(candidates: list, query: int, full: np.ndarray, k: int) -> set:
+    scores = full[candidates] @ full[query].astype(np.float32)
+    norms = np.linalg.norm(full[candidates].astype(np.float32), axis=1)
+    order = np.argsort(-(scores / norms))
+    return {candidates[i] for i in order[:k]}
+
+
+def run_dim(chromadb, dim: int, vectors: np.ndarray, queries: list, truth: list, k: int, factor: int):
+    from services.embeddings import quantize_int8, dequantize_int8
+
+    reduced = truncate(vectors, dim)
+    tmp = Path(tempfile.mkdtemp())
+    client = chromadb.PersistentClient(path=str(tmp))
+    collection = client.create_collection("bench", metadata={"hnsw:space": "cosine"})
+    for start in range(0, len(reduced), 1000):
+        collection.add(
+            ids=[str(i) for i in range(start, min(start + 1000, len(reduced)))],
+            embeddings=reduced[start:start + 1000].tolist()
+        )
+    # Полные векторы для пересчёта — как лежат в chunk_vectors и как было бы в float16
+    full_int8 = np.stack([dequantize_int8(*quantize_int8(v)) for v in vectors])
+    full_f16 = vectors.astype(np.float16)
+    # Первый запрос поднимает индекс в память
+    collection.query(query_embeddings=[reduced[0].tolist()], n_results=1)
+
+    hits = {"hnsw": 0, "int8": 0, "float16": 0}
+    times = {"hnsw": [], "int8": []}
+    depth = min(k * factor + 1, len(vectors))
+    for query, expected in zip(queries, truth):
+        t0 = time.perf_counter()
+        found = collection.query(query_embeddings=[reduced[query].tolist()], n_results=min(k + 1, len(vectors)))
+        times["hnsw"].append(time.perf_counter() - t0)
+        top = [int(i) for i in found["ids"][0] if int(i) != query][:k]
+        hits["hnsw"] += len(expected & set(top))
+
+        t0 = time.perf_counter()
+        found = collection.query(query_embeddings=[reduced[query].tolist()], n_results=depth)
+        candidates = [int(i) for i in found["ids"][0] if int(i) != query]
+        hits["int8"] += len(expected & rescore(candidates, query, full_int8, k))
+        times["int8"].append(time.perf_counter() - t0)
+        hits["float16"] += len(expected & rescore(candidates, query, full_f16, k))
+
+    disk = dir_size(tmp)
+    shutil.rmtree(tmp, ignore_errors=True)
+    total = len(queries) * k
+    return {
+        "recall": {mode: count / total for mode, count in hits.items()},
+        "p50_ms": {mode: percentile(values, 0.5) * 1000 for mode, values in times.items()},
+        "disk_mb": disk / 1024 / 1024,
+        "hnsw_bytes": dim * 4,
+        "int8_bytes": vectors.shape[1] + 4,
+        "float16_bytes": vectors.shape[1] * 2
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chroma", default=str(BASE_DIR / "data" / "chroma"), help="каталог Chroma с корпусом")
+    parser.add_argument("--collection", default=None, help="коллекция (по умолчанию первая user_*)")
+    parser.add_argument("--dims", default="1536,1024,512,256,128", help="размерности через запятую")
+    parser.add_argument("--k", type=int, default=10, help="top-k")
+    parser.add_argument("--factor", type=int, default=4, help="кандидатов на результат при пересчёте")
+    parser.add_argument("--queries", type=int, default=200, help="запросов из корпуса")
+    args = parser.parse_args()
+
+    # Конфиг читает каталог данных при импорте — рабочая база не трогается
+    os.environ["REALT_DATA_DIR"] = tempfile.mkdtemp()
+    import chromadb
+
+    name, ids, vectors = load_corpus(chromadb, Path(args.chroma), args.collection)
+    rng = np.random.default_rng(0)
+    queries = sorted(rng.choice(len(ids), size=min(args.queries, len(ids)), replace=False).tolist())
+    k = min(args.k, len(ids) - 1)
+    truth = exact_top(vectors, queries, k)
+    print(f"{name}: {len(ids)} чанков × {vectors.shape[1]}, запросов: {len(queries)}, k={k}, "
+          f"кандидатов при пересчёте: {k}×{args.factor}\n")
+
+    print(f"{'dim':>5} | {'recall hnsw':>11} | {'int8':>6} | {'float16':>7} | {'p50 hnsw':>8} | "
+          f"{'p50 int8':>8} | {'Chroma МБ':>9} | {'байт/чанк hnsw':>14} | {'+ int8':>6}")
+    for dim in [int(d) for d in args.dims.split(",")]:
+        if dim > vectors.shape[1]:
+            continue
+        result = run_dim(chromadb, dim, vectors, queries, truth, k, args.factor)
+        recall, p50 = result["recall"], result["p50_ms"]
+        print(f"{dim:>5} | {recall['hnsw']:>11.3f} | {recall['int8']:>6.3f} | {recall['float16']:>7.3f} | "
+              f"{p50['hnsw']:>8.2f} | {p50['int8']:>8.2f} | {result['disk_mb']:>9.2f} | "
+              f"{result['hnsw_bytes']:>14} | {result['int8_bytes']:>6}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
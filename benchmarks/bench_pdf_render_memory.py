@@ -0,0 +1,127 @@
+"""
+Бенчмарк пиковой памяти при рендеринге PDF для Vision
+
+Сравнивает прежнюю схему (все страницы в 150 DPI рендерятся в список
+до первого вызова API) с ленивым генератором _vision_pages, где в памяти
+живёт не больше concurrency закодированных страниц. Vision API подменяется
+заглушкой. Каждый режим запускается в отдельном процессе, чтобы пиковый RSS
+не смешивался.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_pdf_render_memory --pages 30
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import fitz  # PyMuPDF
+
+from services import parser_v2
+
+
+def make_brochure(path: Path, pages: int):
+    """A3-буклет: полностраничное цветное фото + мелкий текст на каждой странице"""
+    from PIL import Image
+
+    random.seed(1)
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page(width=1191, height=842)  # A3 альбомная
+        # Шум плохо сжимается — как настоящие фотографии интерьеров
+        img = Image.effect_noise((1600, 1130), 60).convert("RGB")
+        buffer = tempfile.SpooledTemporaryFile()
+        img.save(buffer, format="JPEG", quality=90)
+        buffer.seek(0)
+        page.insert_image(page.rect, stream=buffer.read())
+        for row in range(12):
+            page.insert_text((60, 60 + row * 14), f"Стр. {page_num}: лот {row + 1}, 42.5 м2, 15 600 000 руб",
+                             fontsize=7, fontname="helv")
+    doc.save(str(path))
+    doc.close()
+
+
+async def fake_vision_api(image_base64: str) -> str:
+    await asyncio.sleep(0.05)
+    return "ok"
+
+
+def render_eager(pdf_path: str) -> int:
+    """Прежняя схема: всё в список при фиксированных 150 DPI"""
+    images_base64 = []
+    with fitz.open(pdf_path) as doc:
+        for page_num in range(len(doc)):
+            pix = doc[page_num].get_pixmap(dpi=150)
+            images_base64.append((page_num + 1, base64.b64encode(pix.tobytes("jpeg")).decode()))
+
+    async def send_all():
+        for _, img in images_base64:
+            await fake_vision_api(img)
+
+    asyncio.run(send_all())
+    return sum(len(img) for _, img in images_base64)
+
+
+def render_stream(pdf_path: str, concurrency: int) -> int:
+    parser_v2._call_vision_api = fake_vision_api
+    with fitz.open(pdf_path) as doc:
+        page_numbers = list(range(1, len(doc) + 1))
+    pages = asyncio.run(parser_v2._vision_pages(pdf_path, page_numbers, concurrency))
+    return len(pages)
+
+
+def run_mode(mode: str, pdf_path: str, concurrency: int):
+    """Выполняется в дочернем процессе — печатает JSON с замерами"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    if mode == "eager":
+        render_eager(pdf_path)
+    else:
+        render_stream(pdf_path, concurrency)
+    elapsed = time.perf_counter() - start
+    _, py_peak = tracemalloc.get_traced_memory()
+    rss_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "seconds": elapsed, "py_peak_mb": py_peak / 1024 / 1024,
+                      "rss_peak_mb": rss_peak_kb / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PDF render peak memory benchmark")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=["eager", "stream"], help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.pdf, args.concurrency)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / "brochure_a3.pdf"
+        make_brochure(pdf_path, args.pages)
+        print(f"PDF: {args.pages} стр. A3, {pdf_path.stat().st_size / 1024 / 1024:.1f} MB, "
+              f"concurrency={args.concurrency}")
+        print(f"{'режим':>7} | {'время, s':>8} | {'Python peak, MB':>15} | {'RSS peak, MB':>12}")
+
+        for mode in ("eager", "stream"):
+            out = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_pdf_render_memory", "--mode", mode,
+                 "--pdf", str(pdf_path), "--concurrency", str(args.concurrency)],
+                capture_output=True, text=True, check=True
+            ).stdout
+            result = json.loads(out.strip().splitlines()[-1])
+            print(f"{mode:>7} | {result['seconds']:>8.2f} | {result['py_peak_mb']:>15.1f} | "
+                  f"{result['rss_peak_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+"""
+Бенчмарк качества и скорости поиска RAG на синтетическом корпусе
+
+Корпус — несколько ЖК, у каждого прайс (лист Excel с таблицей квартир) и
+буклет (страницы PDF: расстояние до моря, застройщик, рассрочка). Всё
+индексируется через rag.add_document, как при загрузке файлов. Эмбеддер —
+хэширующий (services/embeddings.py): без сети и ключа, результат одинаков
+на любой машине.
+
+Запросы размечены: для каждого известно, какие чанки релевантны (проверка
+по тексту чанка, а не по результатам поиска). Поиск повторяет
+handle_universal: enrich_query_for_rag, диапазон цен из текста, откат
+на поиск без цены. Метрики:
+    recall@k — доля релевантных в top-k (из min(k, всего релевантных))
+    MRR      — 1 / место первого релевантного
+    p50/p95/p99 — время поиска на запрос, кэш поиска сброшен
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_retrieval --output before.json
+    python -m benchmarks.bench_retrieval --chunk-size 1200 --no-enrich --output after.json
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import asyncio
+import functools
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+USER_ID = 1
+
+NAMES = ["Море", "Кипарис", "Лазурный", "Горизонт", "Южный берег", "Солнечный", "Парус", "Магнолия"]
+DEVELOPERS = ["ЮгСтрой", "Черноморская ДК", "Атлас Девелопмент", "Кубань Инвест", "Ривьера Групп"]
+ROOM_NAMES = {0: "студия", 1: "1", 2: "2", 3: "3"}
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def build_corpus(seed: int, properties: int, apartments: int) -> list:
+    """[{id, name, files: {имя: текст}, facts}] — детерминированно от seed"""
+    rng = random.Random(seed)
+    corpus = []
+    for pid in range(1, properties + 1):
+        name = NAMES[(pid - 1) % len(NAMES)] + ("" if pid <= len(NAMES) else f" {pid}")
+        sea = rng.choice([150, 300, 450, 700, 900, 1200, 1800])
+        developer = rng.choice(DEVELOPERS)
+        per_sqm = rng.randint(180, 420) * 1000
+        installment = rng.choice([12, 18, 24, 36])
+
+        rows = ["№ кв | Комнат | Площадь, м2 | Этаж | Цена, руб"]
+        units = []
+        for i in range(apartments):
+            number = pid * 1000 + 100 + i
+            rooms = rng.choice([0, 1, 1, 2, 2, 3])
+            area = round({0: 24, 1: 36, 2: 52, 3: 74}[rooms] + rng.uniform(-4, 8), 1)
+            floor = rng.randint(2, 16)
+            price = int(area * per_sqm * rng.uniform(0.92, 1.08)) // 10000 * 10000
+            units.append({"number": number, "rooms": rooms, "price": price})
+            rows.append(f"{number} | {ROOM_NAMES[rooms]} | {str(area).replace('.', ',')} | {floor} | "
+                        f"{price:,}".replace(",", " "))
+        price_list = f"--- Лист: Прайс ЖК {name} ---\n" + "\n".join(rows)
+
+        brochure = "\n".join([
+            "=== СТРАНИЦА 1 ===",
+            f"ЖК «{name}» — жилой комплекс бизнес-класса на первой линии Черноморского побережья.",
+            f"До моря {sea} м, пешком {max(2, sea // 80)} минут. Рядом набережная, парк и школа.",
+            f"Застройщик: {developer}. Сдача дома — IV квартал 202{rng.randint(5, 8)} года.",
+            "=== СТРАНИЦА 2 ===",
+            "Инфраструктура: закрытая территория, подземный паркинг, детские площадки, фитнес-зал.",
+            "Отделка: white box или чистовая под ключ, панорамное остекление, высота потолков 3 м.",
+            "=== СТРАНИЦА 3 ===",
+            f"Условия покупки: рассрочка 0% на {installment} месяцев, первый взнос от 30%.",
+            f"Ипотека от {rng.choice([5, 6, 8])}% годовых, семейная ипотека, материнский капитал.",
+        ])
+        corpus.append({
+            "id": pid,
+            "name": name,
+            "files": {f"Прайс {name}.xlsx": price_list, f"Буклет {name}.pdf": brochure},
+            "units": units
+        })
+    return corpus
+
+
+def build_queries(corpus: list, seed: int) -> list:
+    """[{id, category, text, relevant(text, metadata) → bool}]"""
+    from services.inventory import parse_text
+
+    rng = random.Random(seed + 1)
+    queries = []
+
+    def add(category: str, text: str, relevant):
+        queries.append({"id": f"{category}-{len(queries)}", "category": category, "text": text, "relevant": relevant})
+
+    for prop in corpus:
+        pid, name = prop["id"], prop["name"]
+        in_property = lambda meta, pid=pid: meta.get("property_id") == pid
+        for unit in rng.sample(prop["units"], 2):
+            number = str(unit["number"])
+            add("apartment", f"квартира {number} в ЖК {name}",
+                lambda text, meta, n=number, p=in_property: p(meta) and f"\n{n} |" in f"\n{text}")
+        add("distance", f"сколько до моря в ЖК {name}?",
+            lambda text, meta, p=in_property: p(meta) and "До моря" in text)
+        add("terms", f"какие условия рассрочки в {name}",
+            lambda text, meta, p=in_property: p(meta) and "рассрочка" in text)
+        add("developer", f"кто застройщик {name}",
+            lambda text, meta, p=in_property: p(meta) and "Застройщик" in text)
+
+    def in_price_range(low, high):
+        def relevant(text, meta):
+            return any(low <= a.price <= high for a in parse_text(text) if a.price)
+        return relevant
+
+    for text, low, high in [
+        ("квартиры до 10 млн", 0, 10_000_000),
+        ("варианты до 15 млн", 0, 15_000_000),
+        ("что есть от 20 до 30 млн", 20_000_000, 30_000_000),
+        ("покажи квартиры от 25 млн", 25_000_000, 999_000_000_000),
+    ]:
+        add("price", text, in_price_range(low, high))
+    return queries
+
+
+async def retrieve(rag, app, text: str, limit: int, enrich: bool) -> list:
+    """Как handle_universal без инвентаря: обогащение, фильтр по цене, откат"""
+    queries = list(dict.fromkeys([text, app.enrich_query_for_rag(text)] if enrich else [text]))
+    min_price, max_price = app.extract_price_range(text)
+    chunks = []
+    if min_price is not None:
+        chunks = rag.fuse_results(await rag.search_many(USER_ID, queries, limit=limit,
+                                                        min_price=min_price, max_price=max_price), limit)
+    if not chunks:
+        chunks = rag.fuse_results(await rag.search_many(USER_ID, queries, limit=limit), limit)
+    return chunks
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def summarize(rows: list, ks: list) -> dict:
+    summary = {"queries": len(rows), "mrr": round(sum(r["rr"] for r in rows) / len(rows), 4)}
+    for k in ks:
+        summary[f"recall@{k}"] = round(sum(r[f"recall@{k}"] for r in rows) / len(rows), 4)
+    return summary
+
+
+async def run(args) -> dict:
+    from services import rag, search_cache, chunker
+    from services.embeddings import HashingProvider, set_provider
+    from db.database import init_db, get_lexical_chunks
+    import app
+
+    init_db()
+    set_provider(HashingProvider(args.dim))
+    if args.chunk_size:
+        rag.chunk_document = functools.partial(chunker.chunk_document, chunk_size=args.chunk_size)
+
+    corpus = build_corpus(args.seed, args.properties, args.apartments)
+    t0 = time.perf_counter()
+    for prop in corpus:
+        for file_name, text in prop["files"].items():
+            await rag.add_document(USER_ID, prop["id"], prop["name"], file_name, text)
+    ingest_seconds = time.perf_counter() - t0
+    all_chunks = [(text, json.loads(meta)) for _, text, meta in get_lexical_chunks(USER_ID)]
+
+    ks = sorted({int(k) for k in args.k.split(",")})
+    limit = max(args.limit, max(ks))
+    rows, latencies = [], []
+    for query in build_queries(corpus, args.seed):
+        relevant_total = sum(1 for text, meta in all_chunks if query["relevant"](text, meta))
+        for _ in range(args.repeats):
+            search_cache.invalidate(USER_ID)
+            t0 = time.perf_counter()
+            found = await retrieve(rag, app, query["text"], limit, not args.no_enrich)
+            latencies.append(time.perf_counter() - t0)
+        marks = [query["relevant"](c["text"], c["metadata"]) for c in found]
+        first = next((i + 1 for i, mark in enumerate(marks) if mark), None)
+        row = {
+            "id": query["id"],
+            "category": query["category"],
+            "query": query["text"],
+            "relevant_total": relevant_total,
+            "first_relevant_rank": first,
+            "rr": round(1 / first, 4) if first else 0.0
+        }
+        for k in ks:
+            row[f"recall@{k}"] = round(sum(marks[:k]) / min(k, relevant_total), 4) if relevant_total else 0.0
+        rows.append(row)
+
+    categories = sorted({r["category"] for r in rows})
+    return {
+        "commit": git_commit(),
+        "config": {
+            "seed": args.seed, "properties": args.properties, "apartments": args.apartments,
+            "chunk_size": args.chunk_size or chunker.CHUNK_SIZE, "limit": limit,
+            "enrich": not args.no_enrich, "embedder": f"hashing/{args.dim}", "repeats": args.repeats
+        },
+        "corpus": {"documents": sum(len(p["files"]) for p in corpus), "chunks": len(all_chunks),
+                   "ingest_seconds": round(ingest_seconds, 2)},
+        "metrics": {
+            "overall": summarize(rows, ks),
+            "by_category": {c: summarize([r for r in rows if r["category"] == c], ks) for c in categories}
+        },
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.5) * 1000, 2),
+            "p95": round(percentile(latencies, 0.95) * 1000, 2),
+            "p99": round(percentile(latencies, 0.99) * 1000, 2),
+            "searches": len(latencies)
+        },
+        "queries": rows
+    }
+
+
+def report(result: dict):
+    ks = [key for key in result["metrics"]["overall"] if key.startswith("recall@")]
+    print(f"Коммит {result['commit']}, корпус: {result['corpus']['documents']} документов, "
+          f"{result['corpus']['chunks']} чанков, конфиг: {result['config']}\n")
+    print(f"{'категория':>10} | {'запросов':>8} | " + " | ".join(f"{k:>9}" for k in ks) + f" | {'MRR':>6}")
+    sections = [*result["metrics"]["by_category"].items(), ("всего", result["metrics"]["overall"])]
+    for name, metrics in sections:
+        print(f"{name:>10} | {metrics['queries']:>8} | " + " | ".join(f"{metrics[k]:>9.3f}" for k in ks)
+              + f" | {metrics['mrr']:>6.3f}")
+    latency = result["latency_ms"]
+    print(f"\nПоиск, мс: p50 {latency['p50']}  p95 {latency['p95']}  p99 {latency['p99']}  "
+          f"({latency['searches']} поисков)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--properties", type=int, default=20, help="ЖК в корпусе")
+    parser.add_argument("--apartments", type=int, default=120, help="квартир в прайсе каждого ЖК")
+    parser.add_argument("--chunk-size", type=int, default=0, help="размер чанка (0 — как в chunker.py)")
+    parser.add_argument("--limit", type=int, default=10, help="limit поиска")
+    parser.add_argument("--k", default="1,5,10", help="k для recall@k через запятую")
+    parser.add_argument("--no-enrich", action="store_true", help="без enrich_query_for_rag")
+    parser.add_argument("--dim", type=int, default=512, help="размерность хэширующего эмбеддера")
+    parser.add_argument("--repeats", type=int, default=3, help="поисков на запрос для латентности")
+    parser.add_argument("--output", help="куда записать JSON с результатами")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Конфиг читает каталог данных при импорте — подменяем до импорта сервисов
+        os.environ["REALT_DATA_DIR"] = tmp
+        os.environ["EMBEDDING_PROVIDER"] = "hashing"
+        result = asyncio.run(run(args))
+
+    report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"\nJSON: {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
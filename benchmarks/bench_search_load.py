@@ -0,0 +1,156 @@
+"""
+Бенчмарк отзывчивости бота под нагрузкой RAG-поиска
+
+Параллельно с N непрерывными поисками идёт «лёгкий апдейт» — корутина, которая
+каждые 20 мс просыпается как обработчик нажатия кнопки меню. Её задержка
+(насколько позже запланированного она получила управление) и есть то, что
+почувствует пользователь, пока другие ищут.
+
+Сравниваются два пути:
+    blocking — как было: синхронный эмбеддинг и Chroma прямо в event loop
+    async    — rag.search: эмбеддинг через async-клиент, Chroma в своём пуле
+
+Эмбеддинги подменяются заглушкой с фиксированной задержкой, данные пишутся
+во временный каталог — ключ OpenAI и рабочая база не нужны.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_search_load --searchers 8 --chunks 5000 --latency 0.15
+"""
+import os
+import sys
+import argparse
+import asyncio
+import random
+import statistics
+import tempfile
+import time
+
+import numpy as np
+
+DIM = 1536
+USER_ID = 1
+TICK = 0.02
+
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def fake_vector(text: str):
+    rng = np.random.default_rng(abs(hash(text)) % (2 ** 32))
+    vector = rng.standard_normal(DIM).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def populate(rag, chunks: int):
+    """Коллекция со случайными векторами — для HNSW содержимое не важно"""
+    collection = rag.get_collection(USER_ID)
+    rng = np.random.default_rng(0)
+    batch = 1000
+    for start in range(0, chunks, batch):
+        size = min(batch, chunks - start)
+        vectors = rng.standard_normal((size, DIM)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        collection.add(
+            ids=[f"c{start + i}" for i in range(size)],
+            embeddings=vectors.tolist(),
+            documents=[f"Чанк {start + i}: квартира, цена, площадь" for i in range(size)],
+            metadatas=[{"property_id": (start + i) % 10, "chunk_index": start + i} for i in range(size)]
+        )
+    # Записали в обход rag — закэшированное число чанков устарело
+    rag.forget_collection(USER_ID)
+    # Первый запрос поднимает индекс в память — в замер это не должно попасть
+    collection.query(query_embeddings=[fake_vector("прогрев")], n_results=1)
+    return collection
+
+
+def install_stub(rag, latency: float):
+    """Подменяем OpenAI: задержка сети, детерминированный вектор"""
+    from services.embeddings import HashingProvider, set_provider
+
+    class SlowProvider(HashingProvider):
+        async def embed(self, texts):
+            await asyncio.sleep(latency * random.uniform(0.8, 1.2))
+            return [fake_vector(t) for t in texts]
+
+    set_provider(SlowProvider(DIM))
+
+
+async def blocking_search(rag, latency: float, query: str, limit: int):
+    """Старый путь: sync-клиент OpenAI и Chroma прямо в корутине"""
+    collection = rag.chroma_client.get_or_create_collection(f"user_{USER_ID}")
+    if collection.count() == 0:
+        return []
+    time.sleep(latency * random.uniform(0.8, 1.2))
+    return collection.query(query_embeddings=[fake_vector(query)], n_results=limit)
+
+
+async def run_mode(rag, mode: str, searchers: int, duration: float, latency: float, limit: int):
+    stop = time.perf_counter() + duration
+    search_times, lags = [], []
+
+    async def searcher(n: int):
+        i = 0
+        while time.perf_counter() < stop:
+            # Уникальный запрос — чтобы не попадать в кэш эмбеддингов
+            query = f"двушка до 15 млн, поиск {mode} {n}-{i}"
+            t0 = time.perf_counter()
+            if mode == "blocking":
+                await blocking_search(rag, latency, query, limit)
+            else:
+                await rag.search(USER_ID, query, limit=limit)
+            search_times.append(time.perf_counter() - t0)
+            i += 1
+            # Между поисками обработчик отдаёт управление (send_message и т.п.)
+            await asyncio.sleep(0)
+
+    async def light_update():
+        while time.perf_counter() < stop:
+            t0 = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - t0 - TICK)
+
+    await asyncio.gather(light_update(), *(searcher(n) for n in range(searchers)))
+    return search_times, lags
+
+
+def report(mode: str, search_times, lags, duration: float):
+    ms = lambda v: f"{v * 1000:8.1f}"
+    # Тиков за замер: при блокирующем поиске их единицы вместо duration / TICK
+    print(f"{mode:>8} | {len(search_times) / duration:7.1f} | {ms(statistics.median(search_times))} | "
+          f"{ms(percentile(lags, 0.5))} | {ms(percentile(lags, 0.95))} | {ms(percentile(lags, 0.99))} | {len(lags):6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--searchers", type=int, default=8, help="одновременных поисков")
+    parser.add_argument("--chunks", type=int, default=5000, help="чанков в коллекции")
+    parser.add_argument("--latency", type=float, default=0.15, help="задержка эмбеддинга, s")
+    parser.add_argument("--duration", type=float, default=5.0, help="длительность замера на режим, s")
+    parser.add_argument("--limit", type=int, default=10, help="n_results для поиска")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Конфиг читает каталог данных при импорте — подменяем до импорта сервисов
+        os.environ["REALT_DATA_DIR"] = tmp
+        from services import rag
+
+        print(f"Чанков: {args.chunks}, поисков одновременно: {args.searchers}, "
+              f"задержка эмбеддинга: {args.latency}s")
+        install_stub(rag, args.latency)
+        t0 = time.perf_counter()
+        populate(rag, args.chunks)
+        print(f"Коллекция заполнена за {time.perf_counter() - t0:.1f}s\n")
+
+        print("Задержка лёгкого апдейта (пока идут поиски), мс")
+        print(f"{'режим':>8} | {'поиск/с':>7} | {'поиск p50':>8} | {'апд p50':>8} | {'апд p95':>8} | {'апд p99':>8} | {'тиков':>6}")
+        for mode in ("blocking", "async"):
+            search_times, lags = asyncio.run(
+                run_mode(rag, mode, args.searchers, args.duration, args.latency, args.limit)
+            )
+            report(mode, search_times, lags, args.duration)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+"""
+Бенчмарк параллельного Vision-распознавания PDF
+
+Клиент OpenAI в шлюзе подменяется заглушкой с фиксированной задержкой (и долей
+ответов 429), поэтому бенчмарк работает без ключа OpenAI и показывает чистый
+эффект от concurrency в extract_pdf_vision — вместе с повторами шлюза. Лимит
+шлюза на gpt-4o поднимается до уровня concurrency, чтобы не срезать замер.
+
+Запуск из корня репозитория:
+    python -m benchmarks.bench_vision_concurrency --pages 30 --latency 0.5
+"""
+import argparse
+import asyncio
+import random
+import tempfile
+import time
+from pathlib import Path
+
+import fitz  # PyMuPDF
+import httpx
+from openai import RateLimitError
+
+from services import parser_v2, llm_gateway
+
+
+def make_sample_pdf(path: Path, pages: int):
+    """Прайс-лист на N страниц — содержимое для заглушки не важно, важен рендеринг"""
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        y = 72
+        for row in range(30):
+            page.insert_text((72, y), f"Page {page_num} | Unit {row + 1} | 42.5 m2 | 15 600 000 RUB")
+            y += 20
+    doc.save(str(path))
+    doc.close()
+
+
+class _Message:
+    def __init__(self, content: str):
+        self.message = type("Message", (), {"content": content})()
+
+
+def install_stub(latency: float, fail_rate: float, concurrency: int):
+    """Подменяем клиент OpenAI в шлюзе: задержка сети + случайные 429"""
+    calls = {"count": 0, "failed": 0}
+
+    async def fake_create(model: str, messages: list, **kwargs):
+        calls["count"] += 1
+        await asyncio.sleep(latency * random.uniform(0.8, 1.2))
+        if random.random() < fail_rate:
+            calls["failed"] += 1
+            response = httpx.Response(429, request=httpx.Request("POST", "https://api.openai.com/v1/chat/completions"))
+            raise RateLimitError("429 Too Many Requests", response=response, body=None)
+        image = messages[0]["content"][1]["image_url"]["url"]
+        return type("Response", (), {"choices": [_Message(f"Распознано {len(image)} байт изображения")], "usage": None})()
+
+    completions = type("Completions", (), {"create": staticmethod(fake_create)})()
+    llm_gateway.client = type("Client", (), {"chat": type("Chat", (), {"completions": completions})()})()
+    llm_gateway._concurrency_limits["gpt-4o"] = concurrency
+    llm_gateway._limiters.clear()
+    parser_v2.VISION_RETRY_DELAY = latency / 5
+    return calls
+
+
+async def run(pages: int, latency: float, fail_rate: float, levels: list):
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_path = Path(tmp) / "sample.pdf"
+        make_sample_pdf(pdf_path, pages)
+
+        print(f"Страниц: {pages}, задержка Vision: {latency}s, доля сбоев: {fail_rate:.0%}")
+        print(f"{'concurrency':>11} | {'время, s':>8} | {'стр/с':>6} | {'вызовов':>7} | {'сбоев':>5}")
+
+        for concurrency in levels:
+            random.seed(42)
+            calls = install_stub(latency, fail_rate, concurrency)
+            start = time.perf_counter()
+            text = await parser_v2.extract_pdf_vision(str(pdf_path), max_pages=pages, concurrency=concurrency)
+            elapsed = time.perf_counter() - start
+
+            assert text.count("=== СТРАНИЦА") == pages
+            print(f"{concurrency:>11} | {elapsed:>8.2f} | {pages / elapsed:>6.2f} | {calls['count']:>7} | {calls['failed']:>5}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vision concurrency benchmark")
+    parser.add_argument("--pages", type=int, default=30)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка одного вызова Vision, сек")
+    parser.add_argument("--fail-rate", type=float, default=0.1, help="доля вызовов, завершающихся 429")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    asyncio.run(run(args.pages, args.latency, args.fail_rate, args.levels))
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,8 @@ from bot.handlers.add_property import (
     handle_files_done,
     handle_confirm_property,
     handle_property_correction,
-    handle_cancel
+    handle_cancel,
+    handle_update_materials_start
 )
 
 from bot.handlers.query import (
@@ -10,22 +10,17 @@ from services.telegram import (
     download_file,
     get_file_type
 )
-from services.parser_v2 import extract_all as extract_text, get_file_info
-from services.llm import extract_property_data
-from services.rag import add_document
+from services.parser_v2 import get_file_info
+from services.ingest import enqueue_ingest
 from db.database import (
     get_user_state,
     update_user_state,
     clear_user_state,
-    create_property,
     update_property,
     get_property,
-    save_property_file,
-    update_file_extracted_text,
-    get_property_files,
-    attach_files_to_property,
-    get_pending_files
+    save_property_file
 )
+from db.models import IngestJob
 from bot.states import States
 
 
@@ -65,7 +60,7 @@ async def handle_property_name(chat_id: int, name: str):
 
 async def handle_file_upload(chat_id: int, message: Dict[str, Any]):
     state, data = get_user_state(chat_id)
-    if state != States.ADD_PROPERTY_FILES:
+    if state not in (States.ADD_PROPERTY_FILES, States.UPDATE_PROPERTY_FILES):
         await send_message(chat_id, "❓ Сначала начни добавление ЖК командой /add")
         return
     file_id, file_name, file_type = get_file_type(message)
@@ -86,7 +81,7 @@ async def handle_file_upload(chat_id: int, message: Dict[str, Any]):
         file_path=file_path
     )
     data["files_count"] = data.get("files_count", 0) + 1
-    update_user_state(chat_id, States.ADD_PROPERTY_FILES, data)
+    update_user_state(chat_id, state, data)
     emoji = "📄"
     if file_type == "photo":
         emoji = "🖼"
@@ -100,8 +95,34 @@ async def handle_file_upload(chat_id: int, message: Dict[str, Any]):
     )
 
 
+async def handle_update_materials_start(chat_id: int, property_id: int):
+    """Обновление материалов ЖК — новый прайс заменяет прежнюю версию файла"""
+    prop = get_property(property_id)
+    if not prop or prop.user_id != chat_id:
+        await send_message(chat_id, "❌ ЖК не найден")
+        return
+    update_user_state(chat_id, States.UPDATE_PROPERTY_FILES, {
+        "name": prop.name, "property_id": property_id, "files_count": 0
+    })
+    text = f"""🔄 <b>Обновление материалов «{prop.name}»</b>
+
+Отправь новые версии файлов — свежий прайс, обновлённую презентацию.
+Файл с тем же названием (или отличающимся только датой) заменит прежний,
+пересчитаю только то, что изменилось.
+
+Когда закончишь — напиши <b>готово</b>"""
+    buttons = [
+        [{"text": "✅ Готово", "callback_data": "files_done"}],
+        [{"text": "❌ Отмена", "callback_data": "cancel"}]
+    ]
+    await send_message_with_buttons(chat_id, text, buttons)
+
+
 async def handle_files_done(chat_id: int):
     state, data = get_user_state(chat_id)
+    if state == States.UPDATE_PROPERTY_FILES:
+        await handle_update_files_done(chat_id, data)
+        return
     if state != States.ADD_PROPERTY_FILES:
         await send_message(chat_id, "❓ Нет активного добавления ЖК")
         return
@@ -110,65 +131,110 @@ async def handle_files_done(chat_id: int):
     if files_count == 0:
         await send_message(chat_id, "⚠️ Ты не загрузил ни одного файла.\nОтправь хотя бы один документ или фото.")
         return
-    await send_message(chat_id, "⏳ Анализирую материалы, это может занять минуту...")
-    pending_files = get_pending_files(chat_id)
-    all_text_parts = []
-    for pf in pending_files:
-        try:
-            text = await extract_text(pf.file_path)
-            update_file_extracted_text(pf.id, text)
-            if text and not text.startswith("["):
-                all_text_parts.append(f"=== Файл: {pf.file_name} ===\n{text}")
-        except Exception as e:
-            print(f"[ADD] Error extracting {pf.file_name}: {e}")
-    if not all_text_parts:
-        await send_message(chat_id, "⚠️ Не удалось извлечь текст из файлов.\nПопробуй загрузить другие материалы.")
+    # Обработка идёт в фоне (services/ingest.py), карточку пришлёт handle_ingest_finished
+    job_id = enqueue_ingest(chat_id, property_name)
+    update_user_state(chat_id, States.ADD_PROPERTY_PROCESSING, {**data, "job_id": job_id})
+    await send_message(chat_id, "⏳ Анализирую материалы, это может занять несколько минут.\nПришлю карточку ЖК, как только закончу.")
+
+
+async def handle_update_files_done(chat_id: int, data: dict):
+    if not data.get("files_count"):
+        await send_message(chat_id, "⚠️ Ты не загрузил ни одного файла.\nОтправь новую версию прайса или презентации.")
+        return
+    job_id = enqueue_ingest(chat_id, data.get("name", ""), property_id=data["property_id"])
+    update_user_state(chat_id, States.ADD_PROPERTY_PROCESSING, {**data, "job_id": job_id})
+    await send_message(chat_id, "⏳ Сравниваю с прежними версиями, пересчитаю только изменения...")
+
+
+def _waiting_for(job: IngestJob) -> bool:
+    """Пользователь всё ещё ждёт именно эту задачу — не ушёл в другой сценарий или чат"""
+    state, data = get_user_state(job.user_id)
+    return state == States.ADD_PROPERTY_PROCESSING and data.get("job_id") == job.id
+
+
+async def handle_ingest_finished(job: IngestJob):
+    """
+    Колбэк очереди: задача обработки завершилась
+    
+    Состояние меняется, только если пользователь всё ещё ждёт эту задачу;
+    иначе результат просто приходит сообщением.
+    """
+    chat_id = job.user_id
+    if job.kind == "update":
+        await send_update_result(job)
+        return
+    waiting = _waiting_for(job)
+    if job.status == "done":
+        if waiting:
+            update_user_state(chat_id, States.ADD_PROPERTY_CONFIRM, {"property_id": job.property_id})
+        await send_property_card(chat_id, job.property_id)
         return
-    combined_text = "\n\n".join(all_text_parts)
-    extracted_data = await extract_property_data(combined_text, property_name)
-    if not extracted_data:
-        await send_message(chat_id, "⚠️ Не удалось проанализировать материалы.\nПопробуй загрузить более детальные документы.")
+
+    if job.error == "no_text":
+        text = "⚠️ Не удалось извлечь текст из файлов.\nПопробуй загрузить другие материалы."
+    elif job.error == "analyze":
+        text = "⚠️ Не удалось проанализировать материалы.\nПопробуй загрузить более детальные документы."
+    elif job.error == "embedding_mismatch":
+        text = "⚠️ База знаний построена другой моделью эмбеддингов — новые материалы в неё не записать.\nОбратись к администратору бота."
+    else:
+        text = "⚠️ Ошибка при обработке материалов. Попробуй нажать «Готово» ещё раз."
+    if not waiting:
+        await send_message(chat_id, f"{text}\n\nЖК «{job.property_name}» не добавлен.")
         return
-    property_id = create_property(chat_id, property_name)
-    attach_files_to_property(chat_id, property_id)
+    # Файлы вернулись в ожидающие — можно догрузить ещё и снова нажать «Готово»
+    update_user_state(chat_id, States.ADD_PROPERTY_FILES, {"name": job.property_name, "files_count": job.files_total})
+    buttons = [
+        [{"text": "✅ Готово", "callback_data": "files_done"}],
+        [{"text": "❌ Отмена", "callback_data": "cancel"}]
+    ]
+    await send_message_with_buttons(chat_id, text, buttons)
+
+
+async def send_update_result(job: IngestJob):
+    chat_id = job.user_id
+    property_id = job.property_id
+    stats = json.loads(job.result) if job.result else {}
     
-    # Индексируем в RAG
-    for pf in pending_files:
-        if pf.extracted_text and not pf.extracted_text.startswith("["):
-            add_document(chat_id, property_id, property_name, pf.file_name, pf.extracted_text)
+    waiting = _waiting_for(job)
     
-    # Сохраняем все данные включая условия рассрочки
-    update_property(
-        property_id,
-        name=extracted_data.get("name") or property_name,
-        address=extracted_data.get("address", ""),
-        developer=extracted_data.get("developer", ""),
-        completion_date=extracted_data.get("completion_date", ""),
-        price_min=extracted_data.get("price_min"),
-        price_max=extracted_data.get("price_max"),
-        price_per_sqm_min=extracted_data.get("price_per_sqm_min"),
-        price_per_sqm_max=extracted_data.get("price_per_sqm_max"),
-        apartment_types=extracted_data.get("apartment_types", ""),
-        area_min=extracted_data.get("area_min"),
-        area_max=extracted_data.get("area_max"),
-        payment_options=extracted_data.get("payment_options", ""),
-        installment_terms=extracted_data.get("installment_terms", ""),
-        mortgage_info=extracted_data.get("mortgage_info", ""),
-        # Новые структурированные поля условий рассрочки
-        installment_min_pv=extracted_data.get("installment_min_pv"),
-        installment_max_months=extracted_data.get("installment_max_months"),
-        installment_markup=extracted_data.get("installment_markup"),
-        commission=extracted_data.get("commission", ""),
-        distance_to_sea=extracted_data.get("distance_to_sea", ""),
-        territory_area=extracted_data.get("territory_area", ""),
-        hotel_operator=extracted_data.get("hotel_operator", ""),
-        description=extracted_data.get("description", ""),
-        features=extracted_data.get("features", ""),
-        raw_data=json.dumps(extracted_data, ensure_ascii=False)
-    )
+    if job.status != "done":
+        if not waiting:
+            await send_message(chat_id, f"⚠️ Не удалось обновить материалы «{job.property_name}».")
+            return
+        update_user_state(chat_id, States.UPDATE_PROPERTY_FILES, {
+            "name": job.property_name, "property_id": property_id, "files_count": 0
+        })
+        text = "⚠️ Не удалось обновить материалы. Отправь файлы ещё раз и нажми «Готово»."
+        buttons = [
+            [{"text": "✅ Готово", "callback_data": "files_done"}],
+            [{"text": "❌ Отмена", "callback_data": "cancel"}]
+        ]
+        await send_message_with_buttons(chat_id, text, buttons)
+        return
     
+    if waiting:
+        update_user_state(chat_id, "working_property", {"property_id": property_id})
+    prop = get_property(property_id)
+    text = f"✅ <b>Материалы «{prop.name}» обновлены</b>\n"
+    if stats.get("changed_files"):
+        text += f"\n🔄 Обновлено файлов: {stats['changed_files']}"
+    if stats.get("new_files"):
+        text += f"\n➕ Новых файлов: {stats['new_files']}"
+    if stats.get("unchanged_files"):
+        text += f"\n♻️ Без изменений: {stats['unchanged_files']}"
+    if stats.get("chunks_added") or stats.get("chunks_removed"):
+        text += f"\n📝 Фрагментов изменилось: +{stats.get('chunks_added', 0)} / −{stats.get('chunks_removed', 0)}"
+    if stats.get("apartments"):
+        text += f"\n🏠 Квартир в прайсе: {stats['apartments']}"
+    if prop.price_min and prop.price_max:
+        text += f"\n💰 {prop.price_min/1_000_000:.1f} – {prop.price_max/1_000_000:.1f} млн ₽"
+    
+    buttons = [[{"text": "📁 Открыть ЖК", "callback_data": f"open_property_{property_id}"}]]
+    await send_message_with_buttons(chat_id, text, buttons)
+
+
+async def send_property_card(chat_id: int, property_id: int):
     prop = get_property(property_id)
-    update_user_state(chat_id, States.ADD_PROPERTY_CONFIRM, {"property_id": property_id})
     
     # Формируем расширенную сводку с условиями рассрочки
     text = f"✅ <b>ЖК добавлен!</b>\n\n{prop.to_full_info()}"
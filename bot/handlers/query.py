@@ -1,10 +1,14 @@
 """
 Обработчик просмотра ЖК и вопросов по базе
 """
+import time
 from typing import Optional
 
+from services import answer_cache
 from services.telegram import send_message, send_message_with_buttons, send_document
-from services.llm import answer_query
+from services.llm import answer_query, property_label
+from services.context_packer import pack_chunks
+from config import CONTEXT_MAX_TOKENS
 from services.rag import search as rag_search
 from db.database import (
     get_user_properties,
@@ -82,6 +86,8 @@ async def handle_open_property(chat_id: int, property_id: int):
         {"text": "📋 Выжимка", "callback_data": f"summary_{property_id}"}
     ])
     
+    buttons.append([{"text": "🔄 Обновить материалы", "callback_data": f"update_materials_{property_id}"}])
+    
     buttons.append([
         {"text": "✏️ Изменить", "callback_data": f"edit_{property_id}"},
         {"text": "🗑", "callback_data": f"delete_{property_id}"}
@@ -190,26 +196,32 @@ async def handle_property_query(chat_id: int, property_id: int, query: str):
         await send_message(chat_id, "❌ ЖК не найден")
         return
     
-    await send_message(chat_id, "🔍 Ищу...")
-    
-    # RAG поиск
-    chunks = rag_search(chat_id, query, property_id=property_id, limit=10)
-    
-    # Формируем контекст
-    context = prop.to_summary() + "\n\n"
-    
-    if chunks:
-        context += "ДЕТАЛЬНЫЕ ДАННЫЕ (из документов):\n\n"
-        for chunk in chunks:
-            context += f"{chunk['text']}\n\n"
-    else:
-        # Fallback на старый метод если RAG пустой
-        files = get_property_files(property_id)
-        for f in files:
-            if f.extracted_text and len(f.extracted_text) > 50:
-                context += f"--- {f.file_name} ---\n{f.extracted_text[:3000]}\n\n"
+    # Тот же вопрос об этом ЖК уже задавали — ответ без RAG и LLM
+    response, state = await answer_cache.lookup(property_id, query, "property_query")
+    fresh = response is None
     
-    response = await answer_query(query, context)
+    if fresh:
+        await send_message(chat_id, "🔍 Ищу...")
+        started = time.perf_counter()
+        
+        # RAG поиск
+        chunks = await rag_search(chat_id, query, property_id=property_id, limit=10)
+        
+        # Формируем контекст
+        context = prop.to_summary() + "\n\n"
+        
+        if chunks:
+            context += "ДЕТАЛЬНЫЕ ДАННЫЕ (из документов):\n\n"
+            context += pack_chunks(chunks, CONTEXT_MAX_TOKENS) + "\n\n"
+        else:
+            # Fallback на старый метод если RAG пустой
+            files = get_property_files(property_id)
+            for f in files:
+                if f.extracted_text and len(f.extracted_text) > 50:
+                    context += f"--- {f.file_name} ---\n{f.extracted_text[:3000]}\n\n"
+        
+        response = await answer_query(query, context)
+        seconds = time.perf_counter() - started
     
     # Определяем нужны ли кнопки
     query_lower = query.lower()
@@ -226,6 +238,10 @@ async def handle_property_query(chat_id: int, property_id: int, query: str):
     buttons.append([{"text": "🔙 К ЖК", "callback_data": f"open_property_{property_id}"}])
     
     await send_message_with_buttons(chat_id, response, buttons)
+    
+    if fresh:
+        # Ответ уже отправлен — запись в кэш ответов идёт в фоне
+        answer_cache.remember_later(property_id, query, response, "property_query", state, seconds)
 
 
 async def handle_search_all(chat_id: int, query: str):
@@ -240,7 +256,7 @@ async def handle_search_all(chat_id: int, query: str):
     await send_message(chat_id, "🔍 Ищу по всей базе...")
     
     # RAG поиск по всем ЖК
-    chunks = rag_search(chat_id, query, property_id=None, limit=15)
+    chunks = await rag_search(chat_id, query, property_id=None, limit=15)
     
     # Формируем контекст
     context_parts = []
@@ -251,10 +267,7 @@ async def handle_search_all(chat_id: int, query: str):
     
     if chunks:
         context += "\n\nДЕТАЛЬНЫЕ ДАННЫЕ (из документов):\n\n"
-        for chunk in chunks:
-            meta = chunk.get('metadata', {})
-            prop_name = meta.get('property_name', '')
-            context += f"[{prop_name}] {chunk['text']}\n\n"
+        context += pack_chunks(chunks, CONTEXT_MAX_TOKENS, label=property_label) + "\n\n"
     
     response = await answer_query(query, context)
     
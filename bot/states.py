@@ -12,10 +12,12 @@ class States:
     # Добавление ЖК
     ADD_PROPERTY_NAME = "add_property:name"        # Ожидаем название
     ADD_PROPERTY_FILES = "add_property:files"      # Ожидаем файлы
+    ADD_PROPERTY_PROCESSING = "add_property:processing"  # Материалы в очереди на обработку
     ADD_PROPERTY_CONFIRM = "add_property:confirm"  # Подтверждение данных
     
     # Редактирование ЖК
     EDIT_PROPERTY = "edit_property"
+    UPDATE_PROPERTY_FILES = "update_property:files"  # Ожидаем новые версии материалов
     
     # Поиск
     SEARCH = "search"
@@ -9,7 +9,7 @@ load_dotenv()
 
 # Пути
 BASE_DIR = Path(__file__).parent
-DATA_DIR = BASE_DIR / "data"
+DATA_DIR = Path(os.getenv("REALT_DATA_DIR", BASE_DIR / "data"))  # переопределяется для бенчмарков
 UPLOADS_DIR = DATA_DIR / "uploads"
 DB_PATH = DATA_DIR / "assistant.db"
 
@@ -20,10 +20,86 @@ UPLOADS_DIR.mkdir(parents=True, exist_ok=True)
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # https://yourdomain.com/webhook
 
+# /stats: с токеном — только с заголовком X-Stats-Token, без токена — только с localhost напрямую (не через прокси)
+STATS_TOKEN = os.getenv("STATS_TOKEN", "")
+
+# Потоковые ответы — сообщение-заглушка правится по мере генерации
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # сек между правками одного сообщения
+
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 
+# Эмбеддинги
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai | local | hashing
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-3-small")
+EMBEDDING_LOCAL_MODEL = os.getenv("EMBEDDING_LOCAL_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+EMBEDDING_HASH_DIM = int(os.getenv("EMBEDDING_HASH_DIM", "512"))  # размерность хэширующего эмбеддера
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "0"))  # векторов в Chroma; 0 — полная размерность модели
+EMBEDDING_RESCORE = os.getenv("EMBEDDING_RESCORE", "int8")  # int8 | none — пересчёт кандидатов по полным векторам
+EMBEDDING_RESCORE_FACTOR = int(os.getenv("EMBEDDING_RESCORE_FACTOR", "4"))  # кандидатов из HNSW на один результат
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "2048"))  # входов в одном запросе (лимит API — 2048)
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "250000"))  # токенов в запросе (лимит API — 300k)
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))  # запросов эмбеддингов одновременно в полёте
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))  # повторов при 429/5xx/таймауте
+EMBED_RETRY_DELAY = float(os.getenv("EMBED_RETRY_DELAY", "1"))  # базовая пауза перед повтором, сек
+EMBED_CACHE_MAX_MB = int(os.getenv("EMBED_CACHE_MAX_MB", "500"))  # кэш векторов на диске (~6 КБ на текст)
+EMBED_CACHE_MEMORY_ITEMS = int(os.getenv("EMBED_CACHE_MEMORY_ITEMS", "2000"))  # горячие векторы в памяти
+
+# ChromaDB — синхронный клиент, вызовы идут в отдельный пул потоков
+CHROMA_WORKERS = int(os.getenv("CHROMA_WORKERS", "4"))
+
+# Бюджет контекста LLM из найденных чанков (services/context_packer.py), токенов
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))  # ответы на вопросы
+CONTEXT_KP_MAX_TOKENS = int(os.getenv("CONTEXT_KP_MAX_TOKENS", "2500"))  # генерация КП
+
+# Кэш результатов rag.search — сбрасывается версией коллекции пользователя
+SEARCH_CACHE_TTL = int(os.getenv("SEARCH_CACHE_TTL", "600"))  # сек
+SEARCH_CACHE_MAX_ITEMS = int(os.getenv("SEARCH_CACHE_MAX_ITEMS", "1000"))
+SEARCH_CACHE_MAX_MB = int(os.getenv("SEARCH_CACHE_MAX_MB", "50"))  # оценка по длине текстов чанков
+
+# Семантический кэш ответов по ЖК — похожий вопрос о том же ЖК без RAG и LLM
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.93"))  # косинусная близость вопросов
+ANSWER_CACHE_TTL = int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))  # сек
+ANSWER_CACHE_MAX_PER_PROPERTY = int(os.getenv("ANSWER_CACHE_MAX_PER_PROPERTY", "200"))
+
+# Шлюз OpenAI — все вызовы чата, Vision и эмбеддингов (services/llm_gateway.py)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # сек на один вызов
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))  # повторов при 429/5xx/таймауте
+LLM_RETRY_DELAY = float(os.getenv("LLM_RETRY_DELAY", "1"))  # базовая пауза перед повтором, сек
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))  # HTTP-соединений в пуле
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))  # вызовов одной модели одновременно
+LLM_MODEL_CONCURRENCY = os.getenv("LLM_MODEL_CONCURRENCY", "")  # по моделям: "gpt-4o=4,gpt-4o-mini=16"
+LLM_MODEL_TPM = os.getenv("LLM_MODEL_TPM", "")  # токенов в минуту: "gpt-4o=30000,gpt-4o-mini=200000"
+
+# Vision API
+VISION_CONCURRENCY = int(os.getenv("VISION_CONCURRENCY", "4"))  # страниц одновременно в полёте
+VISION_MAX_RETRIES = int(os.getenv("VISION_MAX_RETRIES", "2"))  # повторов для упавшей страницы
+VISION_RETRY_DELAY = float(os.getenv("VISION_RETRY_DELAY", "2"))  # базовая пауза перед повтором, сек
+
+# Гибридный парсинг PDF — пороги классификатора страниц
+PDF_TEXT_MIN_CHARS = int(os.getenv("PDF_TEXT_MIN_CHARS", "200"))  # меньше символов в текстовом слое — скан
+PDF_IMAGE_COVERAGE_MAX = float(os.getenv("PDF_IMAGE_COVERAGE_MAX", "0.5"))  # доля площади под картинками
+PDF_BAD_CHARS_MAX = float(os.getenv("PDF_BAD_CHARS_MAX", "0.1"))  # доля нечитаемых символов (битые шрифты)
+
+# Картинки: подготовка для Vision и поиск почти-дубликатов по pHash
+IMAGE_PREP_WORKERS = int(os.getenv("IMAGE_PREP_WORKERS", "2"))  # потоков для декодирования/ресайза
+IMAGE_PHASH_MAX_DISTANCE = int(os.getenv("IMAGE_PHASH_MAX_DISTANCE", "6"))  # из 64 бит — та же картинка
+
+# Кэш извлечённого текста (по SHA-256 файла)
+EXTRACTION_CACHE_MAX_MB = int(os.getenv("EXTRACTION_CACHE_MAX_MB", "200"))
+
+# Фоновая обработка материалов (очередь ingest_jobs)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))  # воркеров в процессе бота; 0 — только отдельный процесс
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", "2"))  # опрос очереди, сек
+INGEST_STALE_SECONDS = int(os.getenv("INGEST_STALE_SECONDS", "300"))  # без отметок дольше — воркер умер
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))  # перезапусков после падений процесса
+INGEST_EXTRACT_PROCESSES = int(os.getenv("INGEST_EXTRACT_PROCESSES", "2"))  # пул процессов для парсинга; 0 — в текущем
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))  # чанков в одном запросе эмбеддингов
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "4"))  # ёмкость очередей между этапами конвейера
+
 # Настройки
 MAX_FILE_SIZE_MB = 20
 SUPPORTED_EXTENSIONS = {
@@ -3,12 +3,12 @@
 """
 import sqlite3
 from datetime import datetime
-from typing import Optional, List
+from typing import Dict, Optional, List, Tuple
 from pathlib import Path
 import json
 
 from config import DB_PATH
-from db.models import Property, PropertyFile, User
+from db.models import Property, PropertyFile, User, Apartment, IngestJob
 
 
 def get_connection() -> sqlite3.Connection:
@@ -17,6 +17,13 @@ def get_connection() -> sqlite3.Connection:
     return conn
 
 
+def _ensure_column(cursor, table: str, column: str, definition: str):
+    """Добавить колонку в уже существующую таблицу — CREATE TABLE IF NOT EXISTS её не добавит"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row["name"] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
 def init_db():
     conn = get_connection()
     cursor = conn.cursor()
@@ -83,6 +90,7 @@ def init_db():
             FOREIGN KEY (user_id) REFERENCES users(telegram_id)
         )
     """)
+    _ensure_column(cursor, "property_files", "job_id", "INTEGER")
 
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS chat_history (
@@ -94,6 +102,149 @@ def init_db():
         )
     """)
 
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS apartments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            property_id INTEGER NOT NULL,
+            file_id INTEGER,
+            unit_number TEXT,
+            rooms INTEGER,
+            area REAL,
+            floor INTEGER,
+            price INTEGER,
+            price_per_sqm INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (property_id) REFERENCES properties(id),
+            FOREIGN KEY (file_id) REFERENCES property_files(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_apartments_price ON apartments(property_id, price)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_apartments_area ON apartments(property_id, area)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS ingest_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            property_name TEXT NOT NULL,
+            property_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT DEFAULT '',
+            files_total INTEGER DEFAULT 0,
+            files_done INTEGER DEFAULT 0,
+            attempts INTEGER DEFAULT 0,
+            error TEXT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users(telegram_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs(status, id)")
+    _ensure_column(cursor, "ingest_jobs", "kind", "TEXT DEFAULT 'create'")
+    _ensure_column(cursor, "ingest_jobs", "result", "TEXT")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS image_hashes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            property_id INTEGER NOT NULL,
+            file_id INTEGER,
+            phash TEXT NOT NULL,
+            created_at TIMESTAMP,
+            FOREIGN KEY (property_id) REFERENCES properties(id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_hashes_property ON image_hashes(property_id)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS extraction_cache (
+            cache_key TEXT PRIMARY KEY,
+            file_hash TEXT NOT NULL,
+            extractor TEXT NOT NULL,
+            extracted_text TEXT NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_extraction_cache_used ON extraction_cache(last_used_at)")
+
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS embedding_cache (
+            cache_key TEXT PRIMARY KEY,
+            model TEXT NOT NULL,
+            vector BLOB NOT NULL,
+            size_bytes INTEGER NOT NULL,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_embedding_cache_used ON embedding_cache(last_used_at)")
+
+    # Семантический кэш ответов по ЖК (services/answer_cache.py): запись годна, пока
+    # не сменились updated_at ЖК и версия RAG-коллекции владельца
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS answer_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            property_id INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            model TEXT NOT NULL,
+            query TEXT NOT NULL,
+            embedding BLOB NOT NULL,
+            answer TEXT NOT NULL,
+            property_updated_at TEXT,
+            rag_version INTEGER NOT NULL,
+            hits INTEGER DEFAULT 0,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_answer_cache_property ON answer_cache(property_id, scope)")
+
+    # Лексический индекс чанков (services/lexical.py): текст и метаданные здесь,
+    # стеммированные термы — в FTS5 с тем же rowid
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lexical_chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            chunk_id TEXT NOT NULL,
+            property_id INTEGER,
+            document TEXT NOT NULL,
+            metadata TEXT,
+            UNIQUE (user_id, chunk_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_lexical_chunks_property ON lexical_chunks(user_id, property_id)")
+    # Версия RAG-коллекции пользователя: растёт при каждой записи/удалении чанков,
+    # по ней кэш поиска понимает, что результат устарел (и в соседнем процессе тоже)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rag_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+
+    # Полные векторы чанков в int8 — для пересчёта близости, когда в Chroma
+    # лежат усечённые (EMBEDDING_DIMENSIONS, services/rag.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunk_vectors (
+            user_id INTEGER NOT NULL,
+            chunk_id TEXT NOT NULL,
+            property_id INTEGER,
+            vector BLOB NOT NULL,
+            scale REAL NOT NULL,
+            PRIMARY KEY (user_id, chunk_id)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunk_vectors_property ON chunk_vectors(user_id, property_id)")
+
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+            terms,
+            tokenize = "unicode61 remove_diacritics 0 tokenchars '.'"
+        )
+    """)
+
     
     conn.commit()
     conn.close()
@@ -215,10 +366,22 @@ def get_user_properties(user_id: int) -> List[Property]:
     return [_row_to_property(row) for row in rows]
 
 
+def get_all_properties() -> List[Property]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM properties ORDER BY id")
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_property(row) for row in rows]
+
+
 def delete_property(property_id: int):
     conn = get_connection()
     cursor = conn.cursor()
+    cursor.execute("DELETE FROM apartments WHERE property_id = ?", (property_id,))
+    cursor.execute("DELETE FROM image_hashes WHERE property_id = ?", (property_id,))
     cursor.execute("DELETE FROM property_files WHERE property_id = ?", (property_id,))
+    cursor.execute("DELETE FROM answer_cache WHERE property_id = ?", (property_id,))
     cursor.execute("DELETE FROM properties WHERE id = ?", (property_id,))
     conn.commit()
     conn.close()
@@ -287,17 +450,7 @@ def get_property_files(property_id: int) -> List[PropertyFile]:
     cursor.execute("SELECT * FROM property_files WHERE property_id = ?", (property_id,))
     rows = cursor.fetchall()
     conn.close()
-    return [PropertyFile(
-        id=row["id"],
-        property_id=row["property_id"],
-        user_id=row["user_id"],
-        file_id=row["file_id"] or "",
-        file_name=row["file_name"] or "",
-        file_type=row["file_type"] or "",
-        file_path=row["file_path"] or "",
-        extracted_text=row["extracted_text"] or "",
-        created_at=row["created_at"]
-    ) for row in rows]
+    return [_row_to_file(row) for row in rows]
 
 
 def get_pending_files(user_id: int) -> List[PropertyFile]:
@@ -305,12 +458,27 @@ def get_pending_files(user_id: int) -> List[PropertyFile]:
     cursor = conn.cursor()
     cursor.execute("""
         SELECT * FROM property_files 
-        WHERE user_id = ? AND property_id IS NULL
+        WHERE user_id = ? AND property_id IS NULL AND job_id IS NULL
         ORDER BY created_at DESC
     """, (user_id,))
     rows = cursor.fetchall()
     conn.close()
-    return [PropertyFile(
+    return [_row_to_file(row) for row in rows]
+
+
+def get_file_by_id(file_id: int) -> Optional[PropertyFile]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM property_files WHERE id = ?", (file_id,))
+    row = cursor.fetchone()
+    conn.close()
+    if row:
+        return _row_to_file(row)
+    return None
+
+
+def _row_to_file(row) -> PropertyFile:
+    return PropertyFile(
         id=row["id"],
         property_id=row["property_id"],
         user_id=row["user_id"],
@@ -319,42 +487,765 @@ def get_pending_files(user_id: int) -> List[PropertyFile]:
         file_type=row["file_type"] or "",
         file_path=row["file_path"] or "",
         extracted_text=row["extracted_text"] or "",
+        job_id=row["job_id"],
         created_at=row["created_at"]
-    ) for row in rows]
+    )
 
 
-def get_file_by_id(file_id: int) -> Optional[PropertyFile]:
+# === Ingest Jobs ===
+
+def create_ingest_job(user_id: int, property_name: str,
+                      property_id: Optional[int] = None, kind: str = "create") -> int:
+    """
+    Создать задачу и закрепить за ней все ожидающие файлы пользователя
+    
+    kind: create — новый ЖК, update — обновление материалов существующего property_id
+    """
     conn = get_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM property_files WHERE id = ?", (file_id,))
+    now = datetime.now().isoformat()
+    cursor.execute("""
+        INSERT INTO ingest_jobs (user_id, property_name, property_id, kind, status, created_at, updated_at)
+        VALUES (?, ?, ?, ?, 'queued', ?, ?)
+    """, (user_id, property_name, property_id, kind, now, now))
+    job_id = cursor.lastrowid
+    cursor.execute("""
+        UPDATE property_files SET job_id = ?
+        WHERE user_id = ? AND property_id IS NULL AND job_id IS NULL
+    """, (job_id, user_id))
+    cursor.execute("UPDATE ingest_jobs SET files_total = ? WHERE id = ?", (cursor.rowcount, job_id))
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def claim_ingest_job() -> Optional[IngestJob]:
+    """Взять самую старую задачу из очереди — атомарно, воркеры могут быть в разных процессах"""
+    conn = get_connection()
+    conn.isolation_level = None
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    cursor.execute("SELECT id FROM ingest_jobs WHERE status = 'queued' ORDER BY id LIMIT 1")
+    row = cursor.fetchone()
+    if row:
+        now = datetime.now().isoformat()
+        cursor.execute("""
+            UPDATE ingest_jobs
+            SET status = 'running', attempts = attempts + 1,
+                started_at = COALESCE(started_at, ?), updated_at = ?
+            WHERE id = ?
+        """, (now, now, row["id"]))
+    cursor.execute("COMMIT")
+    conn.close()
+    return get_ingest_job(row["id"]) if row else None
+
+
+def update_ingest_job(job_id: int, **kwargs):
+    conn = get_connection()
+    cursor = conn.cursor()
+    set_parts = []
+    values = []
+    for key, value in kwargs.items():
+        set_parts.append(f"{key} = ?")
+        values.append(value)
+    set_parts.append("updated_at = ?")
+    values.append(datetime.now().isoformat())
+    values.append(job_id)
+    cursor.execute(f"UPDATE ingest_jobs SET {', '.join(set_parts)} WHERE id = ?", values)
+    conn.commit()
+    conn.close()
+
+
+def get_ingest_job(job_id: int) -> Optional[IngestJob]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM ingest_jobs WHERE id = ?", (job_id,))
     row = cursor.fetchone()
     conn.close()
     if row:
-        return PropertyFile(
+        return IngestJob(
             id=row["id"],
-            property_id=row["property_id"],
             user_id=row["user_id"],
-            file_id=row["file_id"] or "",
-            file_name=row["file_name"] or "",
-            file_type=row["file_type"] or "",
-            file_path=row["file_path"] or "",
-            extracted_text=row["extracted_text"] or "",
-            created_at=row["created_at"]
+            property_name=row["property_name"],
+            property_id=row["property_id"],
+            kind=row["kind"] or "create",
+            status=row["status"],
+            stage=row["stage"] or "",
+            files_total=row["files_total"] or 0,
+            files_done=row["files_done"] or 0,
+            attempts=row["attempts"] or 0,
+            error=row["error"] or "",
+            result=row["result"] or "",
+            created_at=row["created_at"],
+            updated_at=row["updated_at"],
+            started_at=row["started_at"],
+            finished_at=row["finished_at"]
         )
     return None
 
 
-def attach_files_to_property(user_id: int, property_id: int):
+def get_job_files(job_id: int) -> List[PropertyFile]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM property_files WHERE job_id = ? ORDER BY created_at", (job_id,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_file(row) for row in rows]
+
+
+def attach_job_files(job_id: int, property_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE property_files SET property_id = ? WHERE job_id = ?", (property_id, job_id))
+    conn.commit()
+    conn.close()
+
+
+def set_file_property(file_id: int, property_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE property_files SET property_id = ? WHERE id = ?", (property_id, file_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_property_file(file_id: int):
+    """Удалить файл ЖК вместе с его квартирами (файл на диске остаётся)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM apartments WHERE file_id = ?", (file_id,))
+    cursor.execute("DELETE FROM image_hashes WHERE file_id = ?", (file_id,))
+    cursor.execute("DELETE FROM property_files WHERE id = ?", (file_id,))
+    conn.commit()
+    conn.close()
+
+
+def release_job_files(job_id: int, keep_attached: bool = False):
+    """
+    Вернуть файлы неудавшейся задачи в ожидающие — можно догрузить и нажать «Готово» ещё раз
+    
+    keep_attached: не трогать файлы, уже применённые к ЖК (обновление материалов)
+    """
+    conn = get_connection()
+    cursor = conn.cursor()
+    if keep_attached:
+        cursor.execute("UPDATE property_files SET job_id = NULL WHERE job_id = ? AND property_id IS NULL", (job_id,))
+    else:
+        cursor.execute("UPDATE property_files SET job_id = NULL, property_id = NULL WHERE job_id = ?", (job_id,))
+    conn.commit()
+    conn.close()
+
+
+def requeue_stale_jobs(stale_seconds: int, max_attempts: int) -> Tuple[int, List[int]]:
+    """
+    Вернуть в очередь задачи, чей воркер умер (нет отметок дольше stale_seconds)
+    
+    Задачи, которые уже падали вместе с процессом max_attempts раз, помечаются failed —
+    их ID возвращаются вторым элементом: откат и уведомление делает вызывающий.
+    """
     conn = get_connection()
+    conn.isolation_level = None
     cursor = conn.cursor()
+    threshold = datetime.fromtimestamp(datetime.now().timestamp() - stale_seconds).isoformat()
+    now = datetime.now().isoformat()
+    cursor.execute("BEGIN IMMEDIATE")
     cursor.execute("""
-        UPDATE property_files 
-        SET property_id = ? 
-        WHERE user_id = ? AND property_id IS NULL
-    """, (property_id, user_id))
+        SELECT id FROM ingest_jobs
+        WHERE status = 'running' AND updated_at < ? AND attempts >= ?
+    """, (threshold, max_attempts))
+    failed = [row["id"] for row in cursor.fetchall()]
+    if failed:
+        cursor.execute(f"""
+            UPDATE ingest_jobs SET status = 'failed', error = 'crashed', finished_at = ?, updated_at = ?
+            WHERE id IN ({",".join("?" * len(failed))})
+        """, (now, now, *failed))
+    cursor.execute("""
+        UPDATE ingest_jobs SET status = 'queued', updated_at = ?
+        WHERE status = 'running' AND updated_at < ?
+    """, (now, threshold))
+    requeued = cursor.rowcount
+    cursor.execute("COMMIT")
+    conn.close()
+    return requeued, failed
+
+
+def count_ingest_jobs() -> dict:
+    """Количество задач по статусам"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT status, COUNT(*) AS n FROM ingest_jobs GROUP BY status")
+    counts = {row["status"]: row["n"] for row in cursor.fetchall()}
+    conn.close()
+    return counts
+
+
+# === Apartments ===
+
+def save_apartments(property_id: int, file_id: Optional[int], apartments: List[Apartment]) -> int:
+    """Заменить квартиры, извлечённые из файла, новым списком"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    if file_id is None:
+        cursor.execute("DELETE FROM apartments WHERE property_id = ? AND file_id IS NULL", (property_id,))
+    else:
+        cursor.execute("DELETE FROM apartments WHERE property_id = ? AND file_id = ?", (property_id, file_id))
+    cursor.executemany("""
+        INSERT INTO apartments (property_id, file_id, unit_number, rooms, area, floor, price, price_per_sqm)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (property_id, file_id, a.unit_number, a.rooms, a.area, a.floor, a.price, a.price_per_sqm)
+        for a in apartments
+    ])
     conn.commit()
     conn.close()
+    return len(apartments)
+
+
+def _apartment_conditions(user_id: int, property_id: Optional[int],
+                          min_price: Optional[int], max_price: Optional[int],
+                          min_area: Optional[float] = None, max_area: Optional[float] = None,
+                          rooms: Optional[int] = None) -> tuple:
+    conditions = ["p.user_id = ?"]
+    values = [user_id]
+    if property_id:
+        conditions.append("a.property_id = ?")
+        values.append(property_id)
+    if min_price is not None:
+        conditions.append("a.price >= ?")
+        values.append(min_price)
+    if max_price is not None:
+        conditions.append("a.price <= ?")
+        values.append(max_price)
+    if min_area is not None:
+        conditions.append("a.area >= ?")
+        values.append(min_area)
+    if max_area is not None:
+        conditions.append("a.area <= ?")
+        values.append(max_area)
+    if rooms is not None:
+        conditions.append("a.rooms = ?")
+        values.append(rooms)
+    return " AND ".join(conditions), values
+
+
+def search_apartments(user_id: int, property_id: Optional[int] = None,
+                      min_price: Optional[int] = None, max_price: Optional[int] = None,
+                      min_area: Optional[float] = None, max_area: Optional[float] = None,
+                      rooms: Optional[int] = None, limit: int = 100,
+                      per_property: Optional[int] = None) -> List[Apartment]:
+    """
+    Квартиры по диапазонам цены/площади — индексы (property_id, price) и (property_id, area)
+    
+    per_property — не больше стольких самых дешёвых квартир на ЖК; ЖК чередуются
+    по месту в своём списке, так что дешёвый ЖК не вытесняет остальные из limit.
+    """
+    where, values = _apartment_conditions(user_id, property_id, min_price, max_price, min_area, max_area, rooms)
+    
+    conn = get_connection()
+    cursor = conn.cursor()
+    if per_property:
+        cursor.execute(f"""
+            SELECT * FROM (
+                SELECT a.*, p.name AS property_name,
+                       ROW_NUMBER() OVER (PARTITION BY a.property_id ORDER BY a.price) AS place
+                FROM apartments a
+                JOIN properties p ON p.id = a.property_id
+                WHERE {where}
+            )
+            WHERE place <= ?
+            ORDER BY place, price
+            LIMIT ?
+        """, (*values, per_property, limit))
+    else:
+        cursor.execute(f"""
+            SELECT a.*, p.name AS property_name FROM apartments a
+            JOIN properties p ON p.id = a.property_id
+            WHERE {where}
+            ORDER BY a.price
+            LIMIT ?
+        """, (*values, limit))
+    rows = cursor.fetchall()
+    conn.close()
+    return [_row_to_apartment(row) for row in rows]
+
+
+def count_apartments_by_property(user_id: int, property_id: Optional[int] = None,
+                                 min_price: Optional[int] = None, max_price: Optional[int] = None) -> Dict[int, int]:
+    """Сколько квартир в диапазоне цен у каждого ЖК — {property_id: количество}, ЖК без квартир нет"""
+    where, values = _apartment_conditions(user_id, property_id, min_price, max_price)
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT a.property_id, COUNT(*) AS n FROM apartments a
+        JOIN properties p ON p.id = a.property_id
+        WHERE {where}
+        GROUP BY a.property_id
+    """, values)
+    counts = {row["property_id"]: row["n"] for row in cursor.fetchall()}
+    conn.close()
+    return counts
+
+
+def count_apartments(user_id: int, property_id: Optional[int] = None) -> int:
+    conn = get_connection()
+    cursor = conn.cursor()
+    if property_id:
+        cursor.execute("SELECT COUNT(*) FROM apartments WHERE property_id = ?", (property_id,))
+    else:
+        cursor.execute("""
+            SELECT COUNT(*) FROM apartments a JOIN properties p ON p.id = a.property_id
+            WHERE p.user_id = ?
+        """, (user_id,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+def get_apartments_summary(property_id: int) -> dict:
+    """Диапазоны цен и площадей ЖК по инвентарю"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT COUNT(*) AS count,
+               MIN(price) AS price_min, MAX(price) AS price_max,
+               MIN(price_per_sqm) AS price_per_sqm_min, MAX(price_per_sqm) AS price_per_sqm_max,
+               MIN(area) AS area_min, MAX(area) AS area_max
+        FROM apartments WHERE property_id = ?
+    """, (property_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return dict(row)
+
+
+def _row_to_apartment(row) -> Apartment:
+    return Apartment(
+        id=row["id"],
+        property_id=row["property_id"],
+        file_id=row["file_id"],
+        unit_number=row["unit_number"] or "",
+        rooms=row["rooms"],
+        area=row["area"],
+        floor=row["floor"],
+        price=row["price"],
+        price_per_sqm=row["price_per_sqm"],
+        property_name=row["property_name"] if "property_name" in row.keys() else "",
+        created_at=row["created_at"]
+    )
+
+
+# === Image Hashes ===
 
+def save_image_hash(property_id: int, file_id: int, phash: str):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO image_hashes (property_id, file_id, phash, created_at)
+        VALUES (?, ?, ?, ?)
+    """, (property_id, file_id, phash, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def get_image_hashes(property_id: int) -> List[tuple]:
+    """[(phash, file_id), ...] уже распознанных картинок ЖК"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT phash, file_id FROM image_hashes WHERE property_id = ?", (property_id,))
+    rows = cursor.fetchall()
+    conn.close()
+    return [(row["phash"], row["file_id"]) for row in rows]
+
+
+# === Extraction Cache ===
+
+def get_cached_extraction(cache_key: str) -> Optional[str]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT extracted_text FROM extraction_cache WHERE cache_key = ?", (cache_key,))
+    row = cursor.fetchone()
+    if row:
+        cursor.execute("UPDATE extraction_cache SET last_used_at = ? WHERE cache_key = ?",
+                       (datetime.now().isoformat(), cache_key))
+        conn.commit()
+    conn.close()
+    return row["extracted_text"] if row else None
+
+
+def save_cached_extraction(cache_key: str, file_hash: str, extractor: str, text: str):
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    cursor.execute("""
+        INSERT OR REPLACE INTO extraction_cache
+            (cache_key, file_hash, extractor, extracted_text, size_bytes, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (cache_key, file_hash, extractor, text, len(text.encode("utf-8")), now, now))
+    conn.commit()
+    conn.close()
+
+
+def evict_extraction_cache(max_bytes: int) -> int:
+    """Удалить давно не использованные записи, пока кэш не влезет в max_bytes"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COALESCE(SUM(size_bytes), 0) AS total FROM extraction_cache")
+    total = cursor.fetchone()["total"]
+    evicted = []
+    if total > max_bytes:
+        cursor.execute("SELECT cache_key, size_bytes FROM extraction_cache ORDER BY last_used_at ASC")
+        for row in cursor.fetchall():
+            if total <= max_bytes:
+                break
+            evicted.append((row["cache_key"],))
+            total -= row["size_bytes"]
+        cursor.executemany("DELETE FROM extraction_cache WHERE cache_key = ?", evicted)
+        conn.commit()
+    conn.close()
+    return len(evicted)
+
+
+def get_extraction_cache_size() -> tuple[int, int]:
+    """(количество записей, суммарный размер в байтах)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS total FROM extraction_cache")
+    row = cursor.fetchone()
+    conn.close()
+    return row["entries"], row["total"]
+
+
+# === Embedding Cache ===
+
+def get_cached_embeddings(cache_keys: List[str]) -> dict:
+    """{cache_key: vector bytes} для найденных ключей"""
+    if not cache_keys:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    found = {}
+    # SQLite ограничивает число параметров в запросе
+    for i in range(0, len(cache_keys), 500):
+        part = cache_keys[i:i + 500]
+        placeholders = ",".join("?" * len(part))
+        cursor.execute(f"SELECT cache_key, vector FROM embedding_cache WHERE cache_key IN ({placeholders})", part)
+        found.update({row["cache_key"]: row["vector"] for row in cursor.fetchall()})
+    if found:
+        now = datetime.now().isoformat()
+        cursor.executemany("UPDATE embedding_cache SET last_used_at = ? WHERE cache_key = ?",
+                           [(now, key) for key in found])
+        conn.commit()
+    conn.close()
+    return found
+
+
+def save_cached_embeddings(model: str, items: List[tuple]):
+    """items: [(cache_key, vector bytes), ...]"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    now = datetime.now().isoformat()
+    cursor.executemany("""
+        INSERT OR REPLACE INTO embedding_cache (cache_key, model, vector, size_bytes, created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """, [(key, model, vector, len(vector), now, now) for key, vector in items])
+    conn.commit()
+    conn.close()
+
+
+def evict_embedding_cache(max_bytes: int) -> int:
+    """Удалить давно не использованные векторы, пока кэш не влезет в max_bytes"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS total FROM embedding_cache")
+    row = cursor.fetchone()
+    evicted = 0
+    if row["total"] > max_bytes:
+        # Векторы одной модели одного размера — сколько удалить, считаем по среднему;
+        # освобождаем с запасом 10%, чтобы не чистить на каждой записи
+        average = row["total"] / row["entries"]
+        evicted = int((row["total"] - max_bytes * 0.9) / average) + 1
+        cursor.execute("""
+            DELETE FROM embedding_cache WHERE cache_key IN (
+                SELECT cache_key FROM embedding_cache ORDER BY last_used_at ASC LIMIT ?
+            )
+        """, (evicted,))
+        conn.commit()
+    conn.close()
+    return evicted
+
+
+def get_embedding_cache_size() -> tuple[int, int]:
+    """(количество записей, суммарный размер в байтах)"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) AS entries, COALESCE(SUM(size_bytes), 0) AS total FROM embedding_cache")
+    row = cursor.fetchone()
+    conn.close()
+    return row["entries"], row["total"]
+
+
+# === Answer Cache ===
+
+def get_cached_answers(property_id: int, scope: str, model: str) -> List[Dict]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, query, embedding, answer, property_updated_at, rag_version, created_at
+        FROM answer_cache WHERE property_id = ? AND scope = ? AND model = ?
+    """, (property_id, scope, model))
+    rows = [dict(row) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def save_cached_answer(property_id: int, scope: str, model: str, query: str, embedding: bytes,
+                       answer: str, property_updated_at: Optional[str], rag_version: int, keep: int):
+    """Записать ответ; у ЖК остаются keep последних по использованию"""
+    now = datetime.now().isoformat()
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO answer_cache
+            (property_id, scope, model, query, embedding, answer, property_updated_at, rag_version,
+             created_at, last_used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, (property_id, scope, model, query, embedding, answer, property_updated_at, rag_version, now, now))
+    cursor.execute("""
+        DELETE FROM answer_cache WHERE property_id = ? AND scope = ? AND id NOT IN (
+            SELECT id FROM answer_cache WHERE property_id = ? AND scope = ?
+            ORDER BY last_used_at DESC LIMIT ?
+        )
+    """, (property_id, scope, property_id, scope, keep))
+    conn.commit()
+    conn.close()
+
+
+def touch_cached_answer(answer_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE answer_cache SET hits = hits + 1, last_used_at = ? WHERE id = ?",
+                   (datetime.now().isoformat(), answer_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_cached_answers(answer_ids: List[int]):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("DELETE FROM answer_cache WHERE id = ?", [(i,) for i in answer_ids])
+    conn.commit()
+    conn.close()
+
+
+def count_cached_answers() -> int:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM answer_cache")
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+# === Lexical Index ===
+
+def _delete_lexical_rows(cursor, where: str, params: tuple):
+    cursor.execute(f"SELECT id FROM lexical_chunks WHERE {where}", params)
+    row_ids = [(row["id"],) for row in cursor.fetchall()]
+    cursor.executemany("DELETE FROM chunks_fts WHERE rowid = ?", row_ids)
+    cursor.executemany("DELETE FROM lexical_chunks WHERE id = ?", row_ids)
+
+
+def save_lexical_chunks(user_id: int, rows: List[tuple]):
+    """rows: [(chunk_id, property_id, terms, document, metadata json), ...] — прежние записи заменяются"""
+    if not rows:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    for chunk_id, property_id, terms, document, metadata in rows:
+        _delete_lexical_rows(cursor, "user_id = ? AND chunk_id = ?", (user_id, chunk_id))
+        cursor.execute("""
+            INSERT INTO lexical_chunks (user_id, chunk_id, property_id, document, metadata)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, chunk_id, property_id, document, metadata))
+        cursor.execute("INSERT INTO chunks_fts (rowid, terms) VALUES (?, ?)", (cursor.lastrowid, terms))
+    conn.commit()
+    conn.close()
+
+
+def delete_lexical_chunks(user_id: int, chunk_ids: List[str]):
+    conn = get_connection()
+    cursor = conn.cursor()
+    for chunk_id in chunk_ids:
+        _delete_lexical_rows(cursor, "user_id = ? AND chunk_id = ?", (user_id, chunk_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_property_lexical_chunks(user_id: int, property_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    _delete_lexical_rows(cursor, "user_id = ? AND property_id = ?", (user_id, property_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_user_lexical_chunks(user_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    _delete_lexical_rows(cursor, "user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def update_lexical_metadata(user_id: int, items: List[tuple]):
+    """items: [(metadata json, chunk_id), ...]"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("UPDATE lexical_chunks SET metadata = ? WHERE chunk_id = ? AND user_id = ?",
+                       [(metadata, chunk_id, user_id) for metadata, chunk_id in items])
+    conn.commit()
+    conn.close()
+
+
+def search_lexical_chunks(user_id: int, expression: str, property_id: Optional[int] = None,
+                          limit: int = 20) -> List[tuple]:
+    """[(chunk_id, document, metadata json), ...] — лучшие по bm25 первыми"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    query = """
+        SELECT l.chunk_id, l.document, l.metadata
+        FROM chunks_fts f JOIN lexical_chunks l ON l.id = f.rowid
+        WHERE chunks_fts MATCH ? AND l.user_id = ?
+    """
+    params = [expression, user_id]
+    if property_id:
+        query += " AND l.property_id = ?"
+        params.append(property_id)
+    query += " ORDER BY f.rank LIMIT ?"
+    params.append(limit)
+    cursor.execute(query, params)
+    rows = [(row["chunk_id"], row["document"], row["metadata"]) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def count_lexical_chunks(user_id: int) -> int:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM lexical_chunks WHERE user_id = ?", (user_id,))
+    count = cursor.fetchone()[0]
+    conn.close()
+    return count
+
+
+def get_lexical_chunks(user_id: int) -> List[tuple]:
+    """Все чанки пользователя: [(chunk_id, document, metadata json), ...]"""
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT chunk_id, document, metadata FROM lexical_chunks
+        WHERE user_id = ? ORDER BY id
+    """, (user_id,))
+    rows = [(row["chunk_id"], row["document"], row["metadata"]) for row in cursor.fetchall()]
+    conn.close()
+    return rows
+
+
+def get_lexical_user_ids() -> List[int]:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT DISTINCT user_id FROM lexical_chunks")
+    ids = [row["user_id"] for row in cursor.fetchall()]
+    conn.close()
+    return ids
+
+
+# === Chunk Vectors ===
+
+def save_chunk_vectors(user_id: int, rows: List[tuple]):
+    """rows: [(chunk_id, property_id, vector bytes, scale), ...]"""
+    if not rows:
+        return
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany("""
+        INSERT OR REPLACE INTO chunk_vectors (user_id, chunk_id, property_id, vector, scale)
+        VALUES (?, ?, ?, ?, ?)
+    """, [(user_id, *row) for row in rows])
+    conn.commit()
+    conn.close()
+
+
+def get_chunk_vectors(user_id: int, chunk_ids: List[str]) -> Dict[str, tuple]:
+    """chunk_id → (vector bytes, scale) для тех, что есть"""
+    if not chunk_ids:
+        return {}
+    conn = get_connection()
+    cursor = conn.cursor()
+    found = {}
+    # Лимит параметров SQLite — запрашиваем порциями
+    for start in range(0, len(chunk_ids), 500):
+        part = chunk_ids[start:start + 500]
+        placeholders = ",".join("?" * len(part))
+        cursor.execute(
+            f"SELECT chunk_id, vector, scale FROM chunk_vectors WHERE user_id = ? AND chunk_id IN ({placeholders})",
+            (user_id, *part)
+        )
+        for row in cursor.fetchall():
+            found[row["chunk_id"]] = (row["vector"], row["scale"])
+    conn.close()
+    return found
+
+
+def delete_chunk_vectors(user_id: int, chunk_ids: List[str]):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.executemany(
+        "DELETE FROM chunk_vectors WHERE user_id = ? AND chunk_id = ?",
+        [(user_id, chunk_id) for chunk_id in chunk_ids]
+    )
+    conn.commit()
+    conn.close()
+
+
+def delete_property_chunk_vectors(user_id: int, property_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM chunk_vectors WHERE user_id = ? AND property_id = ?", (user_id, property_id))
+    conn.commit()
+    conn.close()
+
+
+def delete_user_chunk_vectors(user_id: int):
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM chunk_vectors WHERE user_id = ?", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+# === RAG Versions ===
+
+def get_rag_version(user_id: int) -> int:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT version FROM rag_versions WHERE user_id = ?", (user_id,))
+    row = cursor.fetchone()
+    conn.close()
+    return row["version"] if row else 0
+
+
+def bump_rag_version(user_id: int) -> int:
+    conn = get_connection()
+    cursor = conn.cursor()
+    cursor.execute("""
+        INSERT INTO rag_versions (user_id, version) VALUES (?, 1)
+        ON CONFLICT(user_id) DO UPDATE SET version = version + 1
+    """, (user_id,))
+    conn.commit()
+    cursor.execute("SELECT version FROM rag_versions WHERE user_id = ?", (user_id,))
+    version = cursor.fetchone()["version"]
+    conn.close()
+    return version
 
 
 # === Chat History ===
@@ -200,10 +200,70 @@ class PropertyFile:
     file_path: str = ""  # локальный путь
     
     extracted_text: str = ""  # извлечённый текст
+    job_id: Optional[int] = None  # задача обработки, за которой закреплён файл
     
     created_at: Optional[datetime] = None
 
 
+@dataclass
+class Apartment:
+    """Квартира из прайс-листа"""
+    id: Optional[int] = None
+    property_id: int = 0
+    file_id: Optional[int] = None  # из какого файла извлечена
+    
+    unit_number: str = ""  # номер помещения / лот
+    rooms: Optional[int] = None  # 0 — студия
+    area: Optional[float] = None  # м²
+    floor: Optional[int] = None
+    price: Optional[int] = None  # рубли
+    price_per_sqm: Optional[int] = None
+    
+    property_name: str = ""  # название ЖК (заполняется при поиске)
+    
+    created_at: Optional[datetime] = None
+    
+    def to_line(self) -> str:
+        """Строка в формате прайс-листа — так же, как её ищет LLM в чанках"""
+        parts = []
+        if self.unit_number:
+            parts.append(f"Номер помещения – {self.unit_number}")
+        if self.rooms is not None:
+            parts.append(f"Комнат – {'студия' if self.rooms == 0 else self.rooms}")
+        if self.area:
+            parts.append(f"Площадь, м2 – {self.area:g}")
+        if self.floor is not None:
+            parts.append(f"Этаж – {self.floor}")
+        if self.price:
+            parts.append(f"Цена – {self.price}")
+        if self.price_per_sqm:
+            parts.append(f"Цена за метр – {self.price_per_sqm}")
+        return " | ".join(parts)
+
+
+@dataclass
+class IngestJob:
+    """Фоновая задача обработки загруженных материалов"""
+    id: Optional[int] = None
+    user_id: int = 0
+    property_name: str = ""
+    property_id: Optional[int] = None  # новый ЖК создаётся в начале обработки
+    kind: str = "create"  # create — новый ЖК, update — обновление материалов
+    
+    status: str = "queued"  # queued, running, done, failed
+    stage: str = ""  # extract, analyze, index
+    files_total: int = 0
+    files_done: int = 0
+    attempts: int = 0
+    error: str = ""  # no_text, analyze, crashed или текст исключения
+    result: str = ""  # JSON с итогами (для update — что изменилось)
+    
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+
 @dataclass 
 class User:
     """Пользователь (риэлтор)"""
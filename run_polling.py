@@ -7,7 +7,10 @@ from config import TELEGRAM_BOT_TOKEN
 
 # Импортируем обработку из app
 from app import process_message, process_callback
+from bot.handlers.add_property import handle_ingest_finished
 from db.database import init_db
+from services.ingest import set_completion_callback, start_workers
+from services.lexical import backfill_lexical_index
 
 
 async def get_updates(offset: int = 0) -> list:
@@ -35,6 +38,9 @@ async def main():
     """Главный цикл polling"""
     print("[POLLING] Starting...")
     init_db()
+    await asyncio.to_thread(backfill_lexical_index)
+    set_completion_callback(handle_ingest_finished)
+    start_workers()
     
     offset = 0
     
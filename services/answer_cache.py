@@ -0,0 +1,184 @@
+"""
+Семантический кэш ответов по ЖК
+
+«Сколько до моря?», «какой срок сдачи?», «есть ли рассрочка?» про один и тот же
+ЖК спрашивают десятки раз в день, и каждый раз это RAG и полный вызов LLM.
+Вопрос эмбеддится (вектор всё равно нужен поиску и дальше берётся из кэша
+эмбеддингов) и сравнивается с прошлыми вопросами об этом ЖК: при близости
+не ниже ANSWER_CACHE_THRESHOLD отдаётся прошлый ответ.
+
+Запись годна, пока у ЖК тот же updated_at, у коллекции владельца та же версия
+(rag_versions растёт при любой записи чанков) и не прошёл ANSWER_CACHE_TTL.
+Числа в вопросах должны совпадать точно: «квартира 1105» и «квартира 1106»
+для эмбеддинга почти одно и то же, а ответы разные.
+"""
+import asyncio
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_ENABLED, ANSWER_CACHE_THRESHOLD, ANSWER_CACHE_TTL, ANSWER_CACHE_MAX_PER_PROPERTY
+)
+from db.database import (
+    get_property,
+    get_rag_version,
+    get_cached_answers,
+    save_cached_answer,
+    touch_cached_answer,
+    delete_cached_answers,
+    count_cached_answers
+)
+from services.embeddings import get_provider
+from services.lexical import tokenize
+from services.rag import embed_texts
+
+# Счётчики за время жизни процесса
+_stats = {"hits": 0, "misses": 0, "stale": 0, "saved_seconds": 0.0}
+# Во что обходится ответ без кэша — по промахам
+_answers = {"seconds": 0.0, "count": 0}
+# Фоновые записи — ссылки держим, пока задачи не завершатся
+_pending: set = set()
+
+
+def _numbers(text: str) -> frozenset:
+    """Номера, цены, площади из вопроса — «15 600 000» и «2-комнатная» уже нормализованы"""
+    return frozenset(token for token in tokenize(text) if token[0].isdigit())
+
+
+def _state(property_id: int) -> Optional[tuple]:
+    """(updated_at ЖК, версия коллекции владельца) или None, если ЖК нет"""
+    prop = get_property(property_id)
+    if not prop:
+        return None
+    return str(prop.updated_at), get_rag_version(prop.user_id)
+
+
+async def _embed(query: str) -> Optional[np.ndarray]:
+    (vector,) = await embed_texts([query])
+    if vector is None:
+        return None
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm else None
+
+
+def _find(property_id: int, scope: str, model: str, vector: np.ndarray, numbers: frozenset) -> tuple:
+    """(состояние ЖК, лучшая запись (близость, строка) или None, число устаревших)"""
+    state = _state(property_id)
+    if state is None:
+        return None, None, 0
+
+    best, stale = None, []
+    now = datetime.now()
+    for row in get_cached_answers(property_id, scope, model):
+        age = (now - datetime.fromisoformat(row["created_at"])).total_seconds()
+        if (row["property_updated_at"], row["rag_version"]) != state or age > ANSWER_CACHE_TTL:
+            stale.append(row["id"])
+            continue
+        if _numbers(row["query"]) != numbers:
+            continue
+        similarity = float(np.frombuffer(row["embedding"], dtype=np.float32) @ vector)
+        if similarity >= ANSWER_CACHE_THRESHOLD and (best is None or similarity > best[0]):
+            best = (similarity, row)
+
+    if stale:
+        delete_cached_answers(stale)
+    if best:
+        touch_cached_answer(best[1]["id"])
+    return state, best, len(stale)
+
+
+async def lookup(property_id: Optional[int], query: str, scope: str) -> Tuple[Optional[str], Optional[tuple]]:
+    """
+    (прошлый ответ на похожий вопрос или None, состояние ЖК для remember)
+
+    scope разделяет ответы разных обработчиков — у них разный формат.
+    """
+    if not ANSWER_CACHE_ENABLED or not property_id:
+        return None, None
+    vector = await _embed(query)
+    if vector is None:
+        return None, None
+
+    state, best, stale = await asyncio.to_thread(
+        _find, property_id, scope, get_provider().cache_model, vector, _numbers(query)
+    )
+    _stats["stale"] += stale
+    if best is None:
+        _stats["misses"] += 1
+        return None, state
+
+    similarity, row = best
+    saved = _answers["seconds"] / _answers["count"] if _answers["count"] else 0.0
+    _stats["hits"] += 1
+    _stats["saved_seconds"] += saved
+    print(f"[ANSWER_CACHE] Hit ЖК {property_id}: «{query[:40]}» ≈ «{row['query'][:40]}» "
+          f"({similarity:.3f}), сэкономлено ~{saved:.1f}s")
+    return row["answer"], state
+
+
+async def remember(
+    property_id: Optional[int],
+    query: str,
+    answer: str,
+    scope: str,
+    state: Optional[tuple],
+    seconds: float
+):
+    """
+    Записать ответ, полученный без кэша за seconds
+
+    state — из lookup до поиска: если чанки ЖК сменились, пока шёл ответ,
+    запись сразу окажется устаревшей, а не выдаст старый ответ за новый.
+    """
+    _answers["seconds"] += seconds
+    _answers["count"] += 1
+    if not ANSWER_CACHE_ENABLED or not property_id or state is None:
+        return
+    if not answer or answer.startswith("❌"):
+        return
+    vector = await _embed(query)
+    if vector is None:
+        return
+    await asyncio.to_thread(
+        save_cached_answer, property_id, scope, get_provider().cache_model, query, vector.tobytes(),
+        answer, state[0], state[1], ANSWER_CACHE_MAX_PER_PROPERTY
+    )
+
+
+async def _remember_safely(*args):
+    try:
+        await remember(*args)
+    except Exception as e:
+        print(f"[ANSWER_CACHE] Save error: {e}")
+
+
+def remember_later(
+    property_id: Optional[int],
+    query: str,
+    answer: str,
+    scope: str,
+    state: Optional[tuple],
+    seconds: float
+):
+    """remember в фоне — вызывать после отправки ответа: эмбеддинг и запись его не задерживают"""
+    task = asyncio.create_task(_remember_safely(property_id, query, answer, scope, state, seconds))
+    _pending.add(task)
+    task.add_done_callback(_pending.discard)
+
+
+def get_stats() -> Dict:
+    """Статистика кэша ответов"""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "stale": _stats["stale"],
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "saved_seconds": round(_stats["saved_seconds"], 1),
+        "avg_answer_seconds": round(_answers["seconds"] / _answers["count"], 2) if _answers["count"] else 0.0,
+        "entries": count_cached_answers(),
+        "threshold": ANSWER_CACHE_THRESHOLD
+    }
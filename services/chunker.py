@@ -0,0 +1,168 @@
+"""
+Нарезка извлечённого текста на чанки с учётом структуры
+
+Парсеры размечают текст страницами («=== СТРАНИЦА N ===»), листами Excel
+(«--- Лист: Прайс ---») и строками таблиц через « | ». Чанк не пересекает
+границу страницы и не разрезает строку: строка прайса с ценой целиком
+попадает в один чанк, а продолжение таблицы получает повтор её заголовка.
+
+К каждому чанку прикладываются числа для фильтрации на стороне Chroma:
+страница/лист и диапазоны цены, площади, комнат и этажа квартир из него.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from services.inventory import parse_text
+
+# Границы страниц/листов, которые ставят парсеры (parser.py, parser_v2.py)
+SECTION_RE = re.compile(r"^(?:---|===) *(?:Страница|СТРАНИЦА|Лист|ЛИСТ)\b.*$", re.MULTILINE)
+PAGE_RE = re.compile(r"(?:Страница|СТРАНИЦА)\s+(\d+)")
+SHEET_RE = re.compile(r"(?:Лист|ЛИСТ):?\s*(.+?)\s*(?:---|===)?\s*$")
+
+CHUNK_SIZE = 800
+
+
+def split_sections(text: str) -> List[str]:
+    """Разрезать текст по страницам/листам — правка на одной странице не сдвигает чанки остальных"""
+    starts = [m.start() for m in SECTION_RE.finditer(text)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    starts.append(len(text))
+    return [text[a:b] for a, b in zip(starts, starts[1:]) if text[a:b].strip()]
+
+
+def _is_table_row(line: str) -> bool:
+    return line.count("|") >= 1 and len([c for c in line.strip().strip("|").split("|") if c.strip()]) >= 2
+
+
+def _split_long(text: str, chunk_size: int, overlap: int = 100) -> List[str]:
+    """Сплошной абзац длиннее чанка — по концам предложений, с перекрытием"""
+    pieces = []
+    start = 0
+    while start < len(text):
+        end = start + chunk_size
+        if end < len(text):
+            for sep in ['. ', '! ', '? ', '; ', ', ']:
+                pos = text.rfind(sep, start + chunk_size // 2, end)
+                if pos > start:
+                    end = pos + len(sep)
+                    break
+        piece = text[start:end].strip()
+        if piece:
+            pieces.append(piece)
+        if end >= len(text):
+            break
+        start = max(end - overlap, start + 1)
+    return pieces
+
+
+def chunk_section(section: str, chunk_size: int = CHUNK_SIZE) -> List[str]:
+    """
+    Раздел (страница/лист) → чанки по целым строкам
+
+    Заголовок раздела повторяется в каждом чанке, заголовок таблицы — в каждом
+    чанке, который начинается с середины этой таблицы.
+    """
+    lines = section.strip().splitlines()
+    title = lines.pop(0).strip() if lines and SECTION_RE.match(lines[0].strip()) else ""
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    table_header: Optional[str] = None
+
+    def flush():
+        nonlocal size
+        body = "\n".join(current).strip()
+        if body:
+            chunks.append(f"{title}\n{body}" if title else body)
+        current.clear()
+        size = 0
+
+    previous_is_table = False
+    for raw in lines:
+        line = raw.rstrip()
+        is_table = _is_table_row(line)
+        if is_table and not previous_is_table:
+            table_header = line
+        elif not is_table and line.strip():
+            table_header = None
+        previous_is_table = is_table if line.strip() else previous_is_table
+
+        units = _split_long(line, chunk_size) if len(line) > chunk_size else [line]
+        for unit in units:
+            if current and size + len(unit) + 1 > chunk_size:
+                flush()
+                # Продолжение таблицы без заголовка — набор чисел без смысла
+                if is_table and table_header and unit != table_header:
+                    current.append(table_header)
+                    size = len(table_header) + 1
+            if not current and not unit.strip():
+                continue
+            current.append(unit)
+            size += len(unit) + 1
+    flush()
+    return chunks
+
+
+def section_info(section: str) -> Dict:
+    """Номер страницы или имя листа из заголовка раздела"""
+    first_line = section.lstrip().split("\n", 1)[0].strip()
+    if not SECTION_RE.match(first_line):
+        return {}
+    match = PAGE_RE.search(first_line)
+    if match:
+        return {"page": int(match.group(1))}
+    match = SHEET_RE.search(first_line)
+    return {"sheet": match.group(1)[:100]} if match else {}
+
+
+def _range(values: List, name: str, cast) -> Dict:
+    values = [v for v in values if v is not None]
+    if not values:
+        return {}
+    return {f"{name}_min": cast(min(values)), f"{name}_max": cast(max(values))}
+
+
+def numeric_metadata(chunk: str) -> Dict:
+    """Диапазоны цены/площади/комнат/этажа квартир, найденных в чанке"""
+    apartments = parse_text(chunk)
+    if not apartments:
+        return {}
+    metadata: Dict = {"apartments": len(apartments)}
+    metadata.update(_range([a.price for a in apartments], "price", int))
+    metadata.update(_range([a.area for a in apartments], "area", float))
+    metadata.update(_range([a.rooms for a in apartments], "rooms", int))
+    metadata.update(_range([a.floor for a in apartments], "floor", int))
+    return metadata
+
+
+def chunk_document(text: str, chunk_size: int = CHUNK_SIZE) -> List[Tuple[str, Dict]]:
+    """Текст документа → [(чанк, метаданные структуры и чисел), ...]"""
+    pieces = []
+    for section in split_sections(text):
+        info = section_info(section)
+        for chunk in chunk_section(section, chunk_size):
+            pieces.append((chunk, {**info, **numeric_metadata(chunk)}))
+    return pieces
+
+
+def price_filter(min_price: Optional[int], max_price: Optional[int]) -> List[Dict]:
+    """Условия where для Chroma: в чанке есть квартира, чья цена попадает в диапазон"""
+    conditions = []
+    if min_price:
+        conditions.append({"price_max": {"$gte": min_price}})
+    if max_price:
+        conditions.append({"price_min": {"$lte": max_price}})
+    return conditions
+
+
+def matches_price(metadata: Dict, min_price: Optional[int], max_price: Optional[int]) -> bool:
+    """То же условие для чанков не из Chroma (лексический индекс)"""
+    if "price_min" not in metadata:
+        return False
+    if min_price and metadata["price_max"] < min_price:
+        return False
+    if max_price and metadata["price_min"] > max_price:
+        return False
+    return True
@@ -4,7 +4,7 @@ Content Composer — LLM создаёт контент документа, а н
 import json
 import re
 from typing import Dict, Any, Optional, List
-from services.llm import client
+from services import llm_gateway
 from config import OPENAI_MODEL
 
 
@@ -133,7 +133,7 @@ async def compose_kp_content(
         Структурированный контент для генерации PDF
     """
     
-    if not client:
+    if not llm_gateway.available():
         return None
     
     # Определяем аудиторию из запроса если не указана
@@ -165,7 +165,7 @@ async def compose_kp_content(
     )
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "Ты создаёшь продающий контент. Отвечай только JSON."},
@@ -214,7 +214,7 @@ async def compose_summary_content(
     LLM создаёт контент для информационной выжимки
     """
     
-    if not client:
+    if not llm_gateway.available():
         return None
     
     prop_str = json.dumps(property_data, ensure_ascii=False, indent=2) if isinstance(property_data, dict) else str(property_data)
@@ -227,7 +227,7 @@ async def compose_summary_content(
     )
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "Ты аналитик недвижимости. Отвечай только JSON."},
@@ -0,0 +1,155 @@
+"""
+Упаковка найденных чанков в контекст LLM под бюджет токенов
+
+Раньше контекст склеивался целиком и обрезался по символам: срез приходился
+на середину чанка, а бюджет уходил на повторы — перекрытия соседних чанков,
+повтор заголовка страницы/таблицы, одни и те же чанки из разных поисков.
+Здесь дубликаты выбрасываются, соседние чанки одного файла склеиваются без
+перекрытия, а бюджет заполняется целыми блоками в порядке релевантности.
+
+Токены считает tiktoken (если установлен), иначе — оценка сверху по символам.
+"""
+from typing import Callable, Dict, List, Optional
+
+from services.llm_gateway import estimate_tokens
+
+MAX_OVERLAP = 400  # символов — перекрытие соседних чанков не бывает длиннее
+
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.get_encoding("o200k_base")
+    except Exception:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    # Нет пакета или словаря (офлайн) — оценка сверху, бюджет не превысим
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if _encoding is None:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def _normalized(text: str) -> str:
+    return " ".join(text.split())
+
+
+def _join(first: str, second: str) -> str:
+    """Склеить соседние чанки, убрав повтор на стыке"""
+    # Перекрытие окна: конец первого совпадает с началом второго
+    limit = min(len(first), len(second), MAX_OVERLAP)
+    for size in range(limit, 19, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+
+    # Заголовок страницы/таблицы, повторённый в начале следующего чанка
+    seen = {line.strip() for line in first.splitlines() if line.strip()}
+    lines = second.splitlines()
+    skip = 0
+    while skip < len(lines) and (not lines[skip].strip() or lines[skip].strip() in seen):
+        skip += 1
+    return first.rstrip() + "\n" + "\n".join(lines[skip:])
+
+
+def _document(chunk: Dict) -> Optional[str]:
+    """Версия файла, из которой чанк: ID вида p{ЖК}_{хэш текста}_{номер} без номера"""
+    chunk_id = chunk.get("id")
+    return chunk_id.rsplit("_", 1)[0] if chunk_id else None
+
+
+def _merge_neighbours(chunks: List[Dict], max_block_tokens: int) -> List[Dict]:
+    """
+    Соседние по chunk_index чанки одного файла → один блок не длиннее max_block_tokens
+
+    Блок стоит на месте самого релевантного из склеенных чанков. Файлы с одним
+    именем (две версии прайса, два одноимённых документа) различаются по ID
+    чанков; чанк, который не склеился, остаётся отдельным блоком.
+    """
+    groups: Dict[tuple, List[tuple]] = {}
+    loose = []
+    for rank, chunk in enumerate(chunks):
+        meta = chunk.get("metadata") or {}
+        if meta.get("file_name") is None or meta.get("chunk_index") is None:
+            loose.append((rank, chunk))
+            continue
+        key = (meta.get("property_id"), meta["file_name"], _document(chunk))
+        groups.setdefault(key, []).append((rank, chunk))
+
+    blocks = list(loose)
+    for members in groups.values():
+        members.sort(key=lambda item: item[1]["metadata"]["chunk_index"])
+        rank, current = members[0]
+        last_index = current["metadata"]["chunk_index"]
+        for next_rank, chunk in members[1:]:
+            index = chunk["metadata"]["chunk_index"]
+            merged = _join(current["text"], chunk["text"]) if index == last_index + 1 else None
+            if merged and count_tokens(merged) <= max_block_tokens:
+                current = {**current, "text": merged}
+                rank = min(rank, next_rank)
+            else:
+                blocks.append((rank, current))
+                rank, current = next_rank, chunk
+            last_index = index
+        blocks.append((rank, current))
+
+    return [chunk for _, chunk in sorted(blocks, key=lambda item: item[0])]
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    """Обрезать по целым строкам — строка прайса не режется посередине"""
+    kept, used = [], 0
+    for line in text.splitlines():
+        cost = count_tokens(line) + 1
+        if used + cost > max_tokens:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def pack_chunks(
+    chunks: List[Dict],
+    max_tokens: int,
+    label: Optional[Callable[[Dict], str]] = None,
+    separator: str = "\n\n"
+) -> str:
+    """
+    Чанки (в порядке релевантности) → текст контекста не длиннее max_tokens
+
+    label — префикс блока, например название ЖК.
+    """
+    if not chunks:
+        return ""
+
+    # Дубликаты: тот же текст того же ЖК — оставляем первый (самый релевантный)
+    unique, seen = [], set()
+    for chunk in chunks:
+        key = ((chunk.get("metadata") or {}).get("property_id"), _normalized(chunk.get("text", "")))
+        if key[1] and key not in seen:
+            seen.add(key)
+            unique.append(chunk)
+
+    # Один огромный блок вытеснил бы из бюджета всё остальное
+    blocks = _merge_neighbours(unique, max_tokens // 4)
+
+    parts, used = [], 0
+    separator_cost = count_tokens(separator)
+    for block in blocks:
+        text = (label(block) if label else "") + block["text"].strip()
+        cost = count_tokens(text) + separator_cost
+        if used + cost <= max_tokens:
+            parts.append(text)
+            used += cost
+        elif not parts:
+            # Самый релевантный блок сам не влезает — берём его начало
+            text = _truncate(text, max_tokens - separator_cost)
+            if text:
+                parts.append(text)
+                used += count_tokens(text) + separator_cost
+        # Не влез — пробуем следующие: блок поменьше может заполнить остаток
+
+    print(f"[CONTEXT] {len(chunks)} чанков → {len(blocks)} блоков, в контекст {len(parts)} "
+          f"({used}/{max_tokens} токенов)")
+    return separator.join(parts)
@@ -0,0 +1,173 @@
+"""
+Кэш эмбеддингов — одинаковые тексты не уходят в OpenAI повторно
+
+Ключ — модель + SHA-256 нормализованного текста. Два уровня: горячий LRU в памяти
+и таблица embedding_cache в SQLite (переживает рестарт, ограничена EMBED_CACHE_MAX_MB).
+Работает и для чанков документов, и для поисковых запросов.
+"""
+import time
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from config import EMBED_CACHE_MAX_MB, EMBED_CACHE_MEMORY_ITEMS
+from db.database import (
+    get_cached_embeddings,
+    save_cached_embeddings,
+    evict_embedding_cache,
+    get_embedding_cache_size
+)
+
+Vector = List[float]
+
+# Горячий уровень: cache_key → float32-вектор (в 4 раза компактнее списка float)
+_memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+# Счётчики за время жизни процесса
+_stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "saved_seconds": 0.0}
+
+# Средняя задержка API на один текст — для оценки сэкономленного времени
+_api = {"seconds": 0.0, "texts": 0, "calls": 0}
+
+
+def normalize(text: str) -> str:
+    """Юникод к одной форме, пробелы и переносы схлопнуты"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def cache_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize(text)}".encode("utf-8")).hexdigest()
+
+
+def _remember(key: str, vector: np.ndarray):
+    _memory[key] = vector
+    _memory.move_to_end(key)
+    while len(_memory) > EMBED_CACHE_MEMORY_ITEMS:
+        _memory.popitem(last=False)
+
+
+def _lookup_memory(keys: List[str]) -> tuple:
+    """(найденные в памяти, ключи для поиска на диске)"""
+    found: Dict[str, Vector] = {}
+    missing = []
+    for key in keys:
+        if key in _memory:
+            _memory.move_to_end(key)
+            found[key] = _memory[key].tolist()
+            _stats["memory_hits"] += 1
+        else:
+            missing.append(key)
+    return found, missing
+
+
+def _remember_disk(found: Dict[str, Vector], blobs: Dict[str, bytes]):
+    for key, blob in blobs.items():
+        vector = np.frombuffer(blob, dtype=np.float32)
+        _remember(key, vector)
+        found[key] = vector.tolist()
+        _stats["disk_hits"] += 1
+
+
+def _save_disk(model: str, rows: List[tuple]):
+    save_cached_embeddings(model, rows)
+    evicted = evict_embedding_cache(EMBED_CACHE_MAX_MB * 1024 * 1024)
+    if evicted:
+        print(f"[EMB_CACHE] Evicted {evicted} vectors")
+
+
+def _keys(model: str, texts: List[str]) -> List[str]:
+    return [cache_key(model, t) if t and t.strip() else "" for t in texts]
+
+
+def _misses(keys: List[str], found: Dict[str, Vector]) -> List[int]:
+    """Индексы промахов — по одному на уникальный текст"""
+    misses, seen = [], set()
+    for i, key in enumerate(keys):
+        if key and key not in found and key not in seen:
+            seen.add(key)
+            misses.append(i)
+    return misses
+
+
+def _account(texts: List[str], keys: List[str], found: Dict[str, Vector],
+             misses: List[int], seconds: float) -> int:
+    """Обновить счётчики; вернуть число попаданий"""
+    hits = sum(1 for k in keys if k in found)
+    if misses:
+        _api["seconds"] += seconds
+        _api["texts"] += len(misses)
+        _api["calls"] += 1
+        _stats["misses"] += len(misses)
+
+    if hits:
+        # Запрос целиком из кэша экономит вызов API, частичный — долю текстов
+        per_call = _api["seconds"] / _api["calls"] if _api["calls"] else 0.0
+        per_text = _api["seconds"] / _api["texts"] if _api["texts"] else 0.0
+        saved = per_call if not misses else hits * per_text
+        _stats["saved_seconds"] += saved
+        print(f"[EMB_CACHE] {hits}/{len(texts)} из кэша, сэкономлено ~{saved:.2f}s "
+              f"(hit rate {_hit_rate():.0%}, всего ~{_stats['saved_seconds']:.1f}s)")
+    return hits
+
+
+async def embed_cached(
+    model: str,
+    texts: List[str],
+    embed_fn: Callable[[List[str]], Awaitable[List[Optional[Vector]]]]
+) -> List[Optional[Vector]]:
+    """
+    Векторы для texts: из кэша, недостающие — через embed_fn одним вызовом
+
+    Память читается прямо в event loop, SQLite — в потоке: поиск не должен
+    стоять за записью кэша соседней индексации.
+    """
+    keys = _keys(model, texts)
+    found, missing = _lookup_memory(sorted({k for k in keys if k}))
+    if missing:
+        _remember_disk(found, await asyncio.to_thread(get_cached_embeddings, missing))
+    misses = _misses(keys, found)
+
+    hits = dict(found)
+    seconds = 0.0
+    if misses:
+        started = time.perf_counter()
+        fresh = await embed_fn([texts[i] for i in misses])
+        seconds = time.perf_counter() - started
+        new_items = {keys[i]: vector for i, vector in zip(misses, fresh) if vector}
+        if new_items:
+            rows = []
+            for key, vector in new_items.items():
+                array = np.asarray(vector, dtype=np.float32)
+                _remember(key, array)
+                rows.append((key, array.tobytes()))
+            await asyncio.to_thread(_save_disk, model, rows)
+        found = {**found, **new_items}
+
+    _account(texts, keys, hits, misses, seconds)
+    return [found.get(k) if k else None for k in keys]
+
+
+def _hit_rate() -> float:
+    hits = _stats["memory_hits"] + _stats["disk_hits"]
+    lookups = hits + _stats["misses"]
+    return hits / lookups if lookups else 0.0
+
+
+def get_stats() -> Dict:
+    """Статистика кэша эмбеддингов"""
+    entries, size_bytes = get_embedding_cache_size()
+    return {
+        "memory_hits": _stats["memory_hits"],
+        "disk_hits": _stats["disk_hits"],
+        "misses": _stats["misses"],
+        "hit_rate": round(_hit_rate(), 3),
+        "saved_seconds": round(_stats["saved_seconds"], 2),
+        "memory_items": len(_memory),
+        "entries": entries,
+        "size_mb": round(size_bytes / 1024 / 1024, 2),
+        "max_size_mb": EMBED_CACHE_MAX_MB
+    }
@@ -0,0 +1,137 @@
+"""
+Перестроить коллекции Chroma под текущий провайдер и EMBEDDING_DIMENSIONS
+
+Коллекция, построенная другой моделью или размерностью, для векторного поиска
+закрыта (rag.check_collection). Миграция переписывает её целиком:
+
+    python -m services.embedding_migrate              # все пользователи
+    python -m services.embedding_migrate --user 123   # один пользователь
+    python -m services.embedding_migrate --dry-run    # только показать, что изменится
+
+Тексты и метаданные берутся из коллекции, а если её нет (прошлая миграция
+прервалась между удалением и записью) — из лексического индекса, где лежат
+те же чанки. Полные векторы той же модели переиспользуются из коллекции,
+остальное считается через embed_texts: сначала кэш эмбеддингов, потом API.
+"""
+import json
+import asyncio
+import argparse
+from typing import Dict, List, Optional
+
+from services.embeddings import get_provider, check_signature
+from services.rag import (
+    chroma_client, LEGACY_SIGNATURE, embed_texts, store_chunks, forget_collection, rescoring
+)
+from db.database import init_db, get_lexical_chunks, get_lexical_user_ids, delete_user_chunk_vectors
+
+STORE_BATCH = 500  # чанков в одном upsert
+
+
+def _user_ids() -> List[int]:
+    """Пользователи с коллекциями в Chroma или чанками в лексическом индексе"""
+    ids = set(get_lexical_user_ids())
+    for collection in chroma_client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        if name.startswith("user_") and name[len("user_"):].isdigit():
+            ids.add(int(name[len("user_"):]))
+    return sorted(ids)
+
+
+def _open(user_id: int):
+    try:
+        return chroma_client.get_collection(f"user_{user_id}")
+    except Exception:
+        return None
+
+
+async def migrate_user(user_id: int, dry_run: bool = False, force: bool = False) -> Dict:
+    """Перестроить коллекцию пользователя; вернуть, что было сделано"""
+    provider = get_provider()
+    collection = _open(user_id)
+    count = collection.count() if collection is not None else 0
+    stored = dict(collection.metadata or {}) if collection is not None else {}
+    if "embedding_provider" not in stored and count:
+        stored = LEGACY_SIGNATURE
+
+    if count and not check_signature(stored, provider) and not force:
+        return {"user_id": user_id, "status": "up_to_date", "chunks": count}
+
+    # Полные векторы той же модели можно усечь, не обращаясь к API
+    reuse = (
+        count
+        and stored.get("embedding_provider") == provider.name
+        and stored.get("embedding_model") == provider.model
+        and stored.get("embedding_dim") == provider.full_dimension
+    )
+    vectors: Optional[List] = None
+    if count:
+        data = collection.get(include=["documents", "metadatas"] + (["embeddings"] if reuse else []))
+        chunks = [
+            {"id": chunk_id, "text": document, "metadata": metadata or {}}
+            for chunk_id, document, metadata in zip(data["ids"], data["documents"], data["metadatas"])
+        ]
+        if reuse:
+            vectors = [[float(x) for x in vector] for vector in data["embeddings"]]
+        source = "collection"
+    else:
+        chunks = [
+            {"id": chunk_id, "text": document, "metadata": json.loads(metadata) if metadata else {}}
+            for chunk_id, document, metadata in get_lexical_chunks(user_id)
+        ]
+        source = "lexical"
+
+    report = {
+        "user_id": user_id,
+        "status": "dry_run" if dry_run else "migrated",
+        "chunks": len(chunks),
+        "source": source,
+        "vectors": "reused" if reuse else "embedded",
+        "from": "/".join(str(stored.get(key)) for key in provider.signature) if stored else None,
+        "to": "/".join(str(value) for value in provider.signature.values()),
+        "rescore": rescoring(provider)
+    }
+    if dry_run or not chunks:
+        return report
+
+    if vectors is None:
+        if not provider.available:
+            return {**report, "status": "skipped", "error": "провайдер недоступен"}
+        vectors = await embed_texts([c["text"] for c in chunks])
+
+    # Векторы готовы — только теперь удаляем старое
+    if collection is not None:
+        chroma_client.delete_collection(f"user_{user_id}")
+    delete_user_chunk_vectors(user_id)
+    forget_collection(user_id)
+
+    stored_vectors = 0
+    for start in range(0, len(chunks), STORE_BATCH):
+        stored_vectors += store_chunks(
+            user_id, chunks[start:start + STORE_BATCH], vectors[start:start + STORE_BATCH]
+        )
+    return {**report, "stored_vectors": stored_vectors}
+
+
+async def migrate_all(user_ids: List[int], dry_run: bool = False, force: bool = False):
+    for user_id in user_ids:
+        try:
+            report = await migrate_user(user_id, dry_run, force)
+        except Exception as e:
+            print(f"[MIGRATE] user_{user_id}: ошибка {e}")
+            continue
+        print(f"[MIGRATE] {json.dumps(report, ensure_ascii=False)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--user", type=int, action="append", help="ID пользователя (можно несколько)")
+    parser.add_argument("--dry-run", action="store_true", help="ничего не менять")
+    parser.add_argument("--force", action="store_true", help="перестроить и совместимые коллекции")
+    args = parser.parse_args()
+
+    init_db()
+    asyncio.run(migrate_all(args.user or _user_ids(), args.dry_run, args.force))
+
+
+if __name__ == "__main__":
+    main()
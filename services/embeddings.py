@@ -0,0 +1,325 @@
+"""
+Провайдеры эмбеддингов
+
+    openai  — OpenAI Embeddings API (по умолчанию)
+    local   — sentence-transformers на CPU, без сети (pip install sentence-transformers)
+    hashing — детерминированный хэширующий эмбеддер для тестов и бенчмарков
+
+Провайдер выбирается EMBEDDING_PROVIDER на весь деплой. Коллекция Chroma
+запоминает, каким провайдером, моделью и размерностью она построена
+(rag.get_collection), и векторы другого провайдера в неё не пишутся и по ней
+не ищутся — сравнение векторов разных моделей даёт мусор, а не ошибку.
+
+EMBEDDING_DIMENSIONS уменьшает векторы в Chroma (и HNSW на диске и в памяти)
+для моделей text-embedding-3: провайдер отдаёт полный вектор, reduce()
+оставляет его начало. Полный вектор в int8 хранится рядом для пересчёта
+близости кандидатов (rag.py).
+"""
+import asyncio
+import hashlib
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from config import (
+    EMBEDDING_PROVIDER, EMBEDDING_MODEL, EMBEDDING_LOCAL_MODEL, EMBEDDING_HASH_DIM,
+    EMBEDDING_DIMENSIONS,
+    EMBED_BATCH_SIZE, EMBED_BATCH_TOKENS, EMBED_MAX_RETRIES, EMBED_RETRY_DELAY
+)
+from services import llm_gateway
+from services.llm_gateway import TRANSIENT_ERRORS, estimate_tokens
+
+Vector = List[float]
+
+EMBED_MAX_CHARS = 8000  # обрезка одного входа — держимся под лимитом 8191 токен
+
+OPENAI_DIMENSIONS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+# Обучены как Matryoshka: начало вектора — само по себе хороший эмбеддинг
+MATRYOSHKA_MODELS = {"text-embedding-3-small", "text-embedding-3-large"}
+
+
+class EmbeddingMismatchError(Exception):
+    """Коллекция построена другим провайдером/моделью/размерностью"""
+    pass
+
+
+class EmbeddingProvider(ABC):
+    """
+    Общий интерфейс: embed() возвращает вектор или None на месте каждого входа
+
+    dimension и embed() обязательны — провайдер без них не создаётся.
+    """
+    name = ""
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    @abstractmethod
+    def dimension(self) -> int:
+        """Размерность векторов в Chroma"""
+
+    @property
+    def full_dimension(self) -> int:
+        """Размерность векторов, которые отдаёт embed()"""
+        return self.dimension
+
+    @property
+    def reduced(self) -> bool:
+        return self.dimension < self.full_dimension
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def reduce(self, vector: Optional[Vector]) -> Optional[Vector]:
+        """Полный вектор → вектор для Chroma: первые dimension координат, заново нормированные"""
+        if vector is None or len(vector) <= self.dimension:
+            return vector
+        part = np.asarray(vector[:self.dimension], dtype=np.float32)
+        norm = np.linalg.norm(part)
+        return (part / norm).tolist() if norm else None
+
+    @property
+    def cache_model(self) -> str:
+        """Модель в ключе кэша эмбеддингов — векторы разных провайдеров не смешиваются"""
+        return f"{self.name}:{self.model}:{self.dimension}"
+
+    @property
+    def signature(self) -> Dict:
+        """Что записывается в метаданные коллекции"""
+        return {
+            "embedding_provider": self.name,
+            "embedding_model": self.model,
+            "embedding_dim": self.dimension
+        }
+
+    @abstractmethod
+    async def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        """Векторы полной размерности (full_dimension) в порядке входов"""
+
+
+class OpenAIProvider(EmbeddingProvider):
+    """Пачками до лимитов API через шлюз — не больше EMBED_CONCURRENCY запросов одновременно"""
+    name = "openai"
+
+    def __init__(self, model: str = EMBEDDING_MODEL, dimensions: int = EMBEDDING_DIMENSIONS):
+        super().__init__(model)
+        # Усечение локально, а не параметром dimensions API: для text-embedding-3
+        # результат тот же, а полный вектор нужен для пересчёта и остаётся в кэше
+        self._dimensions = None
+        if dimensions and dimensions < self.full_dimension:
+            if model in MATRYOSHKA_MODELS:
+                self._dimensions = dimensions
+            else:
+                print(f"[EMBED] {model} не поддерживает усечение — EMBEDDING_DIMENSIONS={dimensions} не применяется")
+
+    @property
+    def full_dimension(self) -> int:
+        return OPENAI_DIMENSIONS.get(self.model, 1536)
+
+    @property
+    def dimension(self) -> int:
+        return self._dimensions or self.full_dimension
+
+    @property
+    def available(self) -> bool:
+        return llm_gateway.available()
+
+    @property
+    def cache_model(self) -> str:
+        # Как до появления провайдеров — накопленный кэш остаётся действительным;
+        # в кэше всегда полные векторы, усечение его не затрагивает
+        return self.model
+
+    async def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        results: List[Optional[Vector]] = [None] * len(texts)
+        if not self.available or not texts:
+            return results
+
+        # Пустые строки API отвергает целиком вместе с пачкой
+        inputs = [(i, t[:EMBED_MAX_CHARS]) for i, t in enumerate(texts) if t and t.strip()]
+        batches = split_batches([t for _, t in inputs])
+        embedded = await asyncio.gather(*(
+            self._embed_batch([inputs[j][1] for j in batch]) for batch in batches
+        ))
+        for batch, vectors in zip(batches, embedded):
+            for j, vector in zip(batch, vectors):
+                results[inputs[j][0]] = vector
+        return results
+
+    async def _embed_batch(self, texts: List[str]) -> List[Optional[Vector]]:
+        """
+        Одна пачка → эмбеддинги; None на месте входа, который так и не удалось получить
+
+        429/5xx/таймауты повторяет шлюз (EMBED_MAX_RETRIES раз). Остальные ошибки (400 на битом
+        входе) — пачка делится пополам, чтобы один плохой вход не утянул за собой остальные.
+        """
+        try:
+            response = await llm_gateway.embeddings(self.model, texts, EMBED_MAX_RETRIES, EMBED_RETRY_DELAY)
+            return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        except TRANSIENT_ERRORS:
+            return [None] * len(texts)
+        except Exception as e:
+            if len(texts) == 1:
+                print(f"[EMBED] Error for text ({len(texts[0])} символов): {e}")
+                return [None]
+            middle = len(texts) // 2
+            left, right = await asyncio.gather(self._embed_batch(texts[:middle]), self._embed_batch(texts[middle:]))
+            return left + right
+
+
+class LocalProvider(EmbeddingProvider):
+    """sentence-transformers на CPU — модель грузится при первом обращении"""
+    name = "local"
+
+    def __init__(self, model: str = EMBEDDING_LOCAL_MODEL):
+        super().__init__(model)
+        self._model = None
+        # Torch сам распараллеливает батч — одного потока достаточно
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="local_embed")
+
+    def _load(self):
+        if self._model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+            except ImportError as e:
+                raise RuntimeError(
+                    "EMBEDDING_PROVIDER=local требует пакет sentence-transformers"
+                ) from e
+            self._model = SentenceTransformer(self.model, device="cpu")
+            print(f"[EMBED] Local model loaded: {self.model}")
+        return self._model
+
+    @property
+    def dimension(self) -> int:
+        return self._load().get_sentence_embedding_dimension()
+
+    def _encode(self, texts: List[str]) -> List[Vector]:
+        vectors = self._load().encode(texts, batch_size=32, normalize_embeddings=True)
+        return [v.tolist() for v in vectors]
+
+    async def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        results: List[Optional[Vector]] = [None] * len(texts)
+        inputs = [(i, t[:EMBED_MAX_CHARS]) for i, t in enumerate(texts) if t and t.strip()]
+        if not inputs:
+            return results
+        loop = asyncio.get_running_loop()
+        vectors = await loop.run_in_executor(self._executor, self._encode, [t for _, t in inputs])
+        for (i, _), vector in zip(inputs, vectors):
+            results[i] = vector
+        return results
+
+
+class HashingProvider(EmbeddingProvider):
+    """
+    Детерминированный эмбеддер без модели и сети
+
+    Термы лексического индекса (стеммированные слова) и их символьные триграммы
+    раскладываются хэшем со знаком по EMBEDDING_HASH_DIM координатам. Близкие по
+    словам тексты получают близкие векторы — для тестов и бенчмарков поиска этого
+    хватает, а результат одинаков на любой машине.
+    """
+    name = "hashing"
+
+    def __init__(self, dimension: int = EMBEDDING_HASH_DIM):
+        super().__init__("hashing-v1")
+        self._dimension = dimension
+
+    @property
+    def dimension(self) -> int:
+        return self._dimension
+
+    def _features(self, text: str) -> List[tuple]:
+        from services.lexical import tokenize
+
+        features = []
+        for token in tokenize(text):
+            features.append((token, 1.0))
+            padded = f"#{token}#"
+            features.extend((padded[i:i + 3], 0.3) for i in range(len(padded) - 2))
+        return features
+
+    def embed_one(self, text: str) -> Optional[Vector]:
+        vector = np.zeros(self._dimension, dtype=np.float32)
+        for feature, weight in self._features(text):
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self._dimension] += weight if digest >> 63 else -weight
+        norm = np.linalg.norm(vector)
+        return (vector / norm).tolist() if norm else None
+
+    async def embed(self, texts: List[str]) -> List[Optional[Vector]]:
+        if len(texts) <= 8:
+            return [self.embed_one(t) if t else None for t in texts]
+        return await asyncio.to_thread(lambda: [self.embed_one(t) if t else None for t in texts])
+
+
+def quantize_int8(vector: Vector) -> Tuple[bytes, float]:
+    """Вектор → int8 с общим масштабом: вчетверо меньше float32"""
+    array = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(array).max()) / 127 or 1.0
+    return np.round(array / scale).astype(np.int8).tobytes(), scale
+
+
+def dequantize_int8(blob: bytes, scale: float) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.int8).astype(np.float32) * scale
+
+
+def split_batches(texts: List[str]) -> List[List[int]]:
+    """Индексы входов, разложенные в пачки по лимитам API на число входов и токенов"""
+    batches, current, tokens = [], [], 0
+    for i, text in enumerate(texts):
+        cost = estimate_tokens(text)
+        if current and (len(current) >= EMBED_BATCH_SIZE or tokens + cost > EMBED_BATCH_TOKENS):
+            batches.append(current)
+            current, tokens = [], 0
+        current.append(i)
+        tokens += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "local": LocalProvider,
+    "hashing": HashingProvider,
+}
+
+_provider: Optional[EmbeddingProvider] = None
+
+
+def get_provider() -> EmbeddingProvider:
+    """Провайдер этого деплоя (EMBEDDING_PROVIDER)"""
+    global _provider
+    if _provider is None:
+        if EMBEDDING_PROVIDER not in PROVIDERS:
+            raise ValueError(f"Неизвестный EMBEDDING_PROVIDER={EMBEDDING_PROVIDER}: {', '.join(PROVIDERS)}")
+        _provider = PROVIDERS[EMBEDDING_PROVIDER]()
+        if not _provider.available:
+            print(f"[EMBED] Провайдер {_provider.name} недоступен (нет ключа) — работает только лексический поиск")
+    return _provider
+
+
+def set_provider(provider: EmbeddingProvider):
+    """Подменить провайдер — для тестов и бенчмарков"""
+    global _provider
+    _provider = provider
+
+
+def check_signature(stored: Dict, provider: EmbeddingProvider) -> Optional[str]:
+    """Описание расхождения или None, если коллекция совместима с провайдером"""
+    expected = provider.signature
+    mismatched = [key for key in expected if stored.get(key) != expected[key]]
+    if not mismatched:
+        return None
+    built = "/".join(str(stored.get(key)) for key in expected)
+    current = "/".join(str(expected[key]) for key in expected)
+    return f"коллекция построена {built}, настроен {current}"
@@ -0,0 +1,81 @@
+"""
+Кэш извлечённого текста — повторная загрузка того же файла не идёт в Vision
+"""
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict
+
+from config import EXTRACTION_CACHE_MAX_MB
+from db.database import (
+    get_cached_extraction,
+    save_cached_extraction,
+    evict_extraction_cache,
+    get_extraction_cache_size
+)
+from services.parser_v2 import Extraction
+
+# Счётчики за время жизни процесса
+_stats = {"hits": 0, "misses": 0}
+
+
+def file_sha256(file_path: str) -> str:
+    """SHA-256 содержимого файла (читаем кусками, файлы бывают по 20 МБ)"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+async def extract_cached(
+    file_path: str,
+    extract_fn: Callable[[str], Awaitable[Extraction]],
+    extractor_version: str
+) -> str:
+    """
+    Извлечь текст через extract_fn или взять из кэша
+    
+    Args:
+        file_path: Путь к файлу
+        extract_fn: parser_v2.extract_all (ingest передаёт в него пул процессов
+            для CPU-работы); результат с failed > 0 не кэшируется
+        extractor_version: EXTRACTOR_VERSION соответствующего парсера — входит в ключ,
+            поэтому после смены парсера старые записи просто перестают находиться
+    """
+    file_hash = await asyncio.to_thread(file_sha256, file_path)
+    cache_key = f"{extractor_version}:{file_hash}"
+    
+    cached = get_cached_extraction(cache_key)
+    if cached is not None:
+        _stats["hits"] += 1
+        print(f"[CACHE] Hit {file_hash[:12]} ({extractor_version}), {len(cached)} символов")
+        return cached
+    
+    _stats["misses"] += 1
+    result = await extract_fn(file_path)
+    text = result.text
+    
+    # Неполный результат не кэшируем — следующая загрузка попробует заново
+    if result.failed:
+        print(f"[CACHE] Skip {file_hash[:12]}: не извлечено частей — {result.failed}")
+    elif text:
+        save_cached_extraction(cache_key, file_hash, extractor_version, text)
+        evicted = evict_extraction_cache(EXTRACTION_CACHE_MAX_MB * 1024 * 1024)
+        if evicted:
+            print(f"[CACHE] Evicted {evicted} entries")
+    
+    return text
+
+
+def get_stats() -> Dict:
+    """Статистика кэша извлечения"""
+    entries, size_bytes = get_extraction_cache_size()
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries": entries,
+        "size_mb": round(size_bytes / 1024 / 1024, 2),
+        "max_size_mb": EXTRACTION_CACHE_MAX_MB
+    }
@@ -0,0 +1,604 @@
+"""
+Фоновая обработка материалов ЖК
+
+Обработчик «Готово» только ставит задачу в очередь (таблица ingest_jobs) и сразу отвечает.
+Воркеры забирают задачи из очереди — в процессе бота (INGEST_WORKERS) или отдельным
+процессом: python -m services.ingest
+
+Внутри задачи — конвейер с ограниченными очередями:
+
+    extract (CPU — пул процессов) → chunk → embed (пачками) → store (Chroma)
+                           ↘ analyze (LLM, когда извлечены все файлы)
+
+Этапы работают одновременно, поэтому общее время близко к самому медленному этапу,
+а не к их сумме. Извлечённый текст сохраняется в property_files после каждого файла,
+поэтому после падения процесса задача продолжает с того же места.
+"""
+import asyncio
+import json
+import multiprocessing
+import time
+from collections import defaultdict
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from config import (
+    INGEST_WORKERS,
+    INGEST_POLL_INTERVAL,
+    INGEST_STALE_SECONDS,
+    INGEST_MAX_ATTEMPTS,
+    INGEST_EXTRACT_PROCESSES,
+    INGEST_EMBED_BATCH,
+    INGEST_QUEUE_SIZE,
+    EMBED_CONCURRENCY,
+    IMAGE_PHASH_MAX_DISTANCE,
+    SUPPORTED_EXTENSIONS
+)
+from db.database import (
+    create_ingest_job,
+    claim_ingest_job,
+    update_ingest_job,
+    get_ingest_job,
+    get_job_files,
+    attach_job_files,
+    release_job_files,
+    requeue_stale_jobs,
+    create_property,
+    update_property,
+    delete_property,
+    update_file_extracted_text,
+    save_apartments,
+    save_image_hash,
+    get_image_hashes,
+    get_property,
+    get_property_files,
+    set_file_property,
+    delete_property_file,
+    get_apartments_summary
+)
+from db.models import IngestJob
+from services.parser_v2 import extract_all as extract_text, EXTRACTOR_VERSION
+from services.extraction_cache import extract_cached
+from services.llm import extract_property_data
+from services.rag import (
+    build_chunks,
+    embed_texts,
+    store_chunks,
+    delete_property_chunks,
+    get_file_chunks,
+    delete_chunks,
+    update_chunks_metadata,
+    run_chroma
+)
+from services.embeddings import EmbeddingMismatchError
+from services.inventory import extract_apartments
+from services.image_prep import image_phash_async, hamming
+
+# Вызывается по завершении задачи (done или failed) — бот отправляет карточку ЖК
+_completion_callback: Optional[Callable[[IngestJob], Awaitable[None]]] = None
+
+# Пул процессов для парсинга — создаётся при первой задаче и живёт до конца процесса
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+# Будит воркеры этого процесса сразу после постановки задачи, не дожидаясь опроса
+_wake_event: Optional[asyncio.Event] = None
+
+
+# Картинки задачи, которые сейчас распознаются: id файла → (будущий pHash, будущий (id, текст))
+ImagesInFlight = Dict[int, Tuple[asyncio.Future, asyncio.Future]]
+
+
+class IngestError(Exception):
+    """Ожидаемая ошибка обработки — повтор не поможет, нужны другие материалы"""
+
+
+def set_completion_callback(callback: Callable[[IngestJob], Awaitable[None]]):
+    global _completion_callback
+    _completion_callback = callback
+
+
+def enqueue_ingest(user_id: int, property_name: str, property_id: Optional[int] = None) -> int:
+    """
+    Поставить в очередь обработку всех ожидающих файлов пользователя
+
+    С property_id — обновление материалов существующего ЖК, иначе новый ЖК.
+    """
+    kind = "update" if property_id else "create"
+    job_id = create_ingest_job(user_id, property_name, property_id, kind)
+    print(f"[INGEST] Job {job_id} queued ({kind}): {property_name} (user {user_id})")
+    if _wake_event:
+        _wake_event.set()
+    return job_id
+
+
+def _is_text(text: str) -> bool:
+    return bool(text) and not text.startswith("[")
+
+
+def _get_process_pool() -> Optional[ProcessPoolExecutor]:
+    global _process_pool
+    if _process_pool is None and INGEST_EXTRACT_PROCESSES > 0:
+        # spawn, а не fork: в родителе уже крутятся потоки Chroma и event loop
+        _process_pool = ProcessPoolExecutor(
+            max_workers=INGEST_EXTRACT_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+async def _extract_file(file_path: str) -> str:
+    """
+    Текст файла: парсинг и рендеринг страниц — в пуле процессов, Vision — здесь
+
+    Сеть остаётся в процессе бота: один клиент OpenAI, одни лимиты шлюза на всех.
+    """
+    global _process_pool
+    try:
+        return await extract_cached(
+            file_path, partial(extract_text, executor=_get_process_pool()), EXTRACTOR_VERSION
+        )
+    except BrokenProcessPool:
+        # Дочерний процесс упал (OOM на огромном PDF) — пересоздадим пул, файл парсим здесь
+        print(f"[INGEST] Process pool broken, extracting in-process: {file_path}")
+        _process_pool = None
+        return await extract_cached(file_path, extract_text, EXTRACTOR_VERSION)
+
+
+async def _extract_image_deduped(pf, property_id: int, in_flight: ImagesInFlight) -> str:
+    """
+    Картинка → Vision, если ЖК ещё не видел почти такую же
+
+    Риэлторы часто присылают одну планировку несколько раз (пересжатую, с другим
+    кадрированием). Для дубликата Vision не вызываем, а текст помечаем как служебный —
+    оригинал уже проиндексирован, второй раз в RAG и инвентарь он не попадёт.
+    """
+    # Регистрируемся до первого await: картинка, пришедшая следом, увидит нас ещё
+    # до того, как посчитан хэш, и дождётся его, а не пойдёт в Vision параллельно.
+    # Ждём только тех, кто зарегистрирован раньше, — встречного ожидания не бывает
+    loop = asyncio.get_running_loop()
+    earlier = list(in_flight.values())
+    hash_future, result_future = loop.create_future(), loop.create_future()
+    in_flight[pf.id] = (hash_future, result_future)
+    text = ""
+    try:
+        image_hash = await image_phash_async(pf.file_path)
+        hash_future.set_result(image_hash)
+
+        for other_hash, original_id in get_image_hashes(property_id):
+            if hamming(image_hash, other_hash) <= IMAGE_PHASH_MAX_DISTANCE:
+                print(f"[INGEST] {pf.file_name}: дубликат картинки #{original_id}, Vision пропущен")
+                text = f"[Дубликат изображения #{original_id}]"
+                return text
+        for other_hash_future, other_result in earlier:
+            other_hash = await asyncio.shield(other_hash_future)
+            if other_hash is None or hamming(image_hash, other_hash) > IMAGE_PHASH_MAX_DISTANCE:
+                continue
+            # Оригинал ещё распознаётся в этой же задаче — дождёмся, чтобы знать его судьбу
+            original_id, original_text = await asyncio.shield(other_result)
+            if _is_text(original_text):
+                print(f"[INGEST] {pf.file_name}: дубликат картинки #{original_id}, Vision пропущен")
+                text = f"[Дубликат изображения #{original_id}]"
+                return text
+
+        try:
+            text = await _extract_file(pf.file_path)
+        except Exception as e:
+            text = f"[Ошибка извлечения: {e}]"
+        if _is_text(text):
+            save_image_hash(property_id, pf.id, image_hash)
+        return text
+    finally:
+        # Ждущие не должны повиснуть, что бы ни случилось с этой картинкой
+        if not hash_future.done():
+            hash_future.set_result(None)
+        result_future.set_result((pf.id, text))
+        in_flight.pop(pf.id, None)
+
+
+async def _extract_job_file(pf, property_id: int, images_in_flight: ImagesInFlight) -> str:
+    """Текст файла задачи: уже сохранённый (повтор после падения) или свежеизвлечённый"""
+    if pf.extracted_text:
+        return pf.extracted_text
+    try:
+        if Path(pf.file_path).suffix.lower() in SUPPORTED_EXTENSIONS["images"]:
+            text = await _extract_image_deduped(pf, property_id, images_in_flight)
+        else:
+            text = await _extract_file(pf.file_path)
+    except Exception as e:
+        print(f"[INGEST] Error extracting {pf.file_name}: {e}")
+        text = f"[Ошибка извлечения: {e}]"
+    update_file_extracted_text(pf.id, text)
+    return text
+
+
+async def process_job(job: IngestJob):
+    """Выполнить задачу; повторный запуск после падения безопасен"""
+    if job.kind == "update":
+        return await process_update_job(job)
+
+    files = get_job_files(job.id)
+    started = time.perf_counter()
+    busy: Dict[str, float] = defaultdict(float)  # суммарное время работы этапа
+    counts: Dict[str, int] = defaultdict(int)
+
+    # ЖК создаём сразу — чанкам нужен property_id ещё до анализа
+    property_id = job.property_id
+    if property_id:
+        # Индексация могла оборваться на середине — начинаем с чистого листа
+        await run_chroma(delete_property_chunks, job.user_id, property_id)
+    else:
+        property_id = create_property(job.user_id, job.property_name)
+        update_ingest_job(job.id, property_id=property_id)
+        job.property_id = property_id
+    attach_job_files(job.id, property_id)
+
+    update_ingest_job(job.id, stage="extract")
+    texts: Dict[int, str] = {}
+    text_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    embed_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+    store_queue: asyncio.Queue = asyncio.Queue(maxsize=INGEST_QUEUE_SIZE)
+
+    async def extract_stage():
+        slots = asyncio.Semaphore(max(INGEST_EXTRACT_PROCESSES, 1))
+        images_in_flight: ImagesInFlight = {}
+
+        async def extract_one(pf):
+            async with slots:
+                t0 = time.perf_counter()
+                text = await _extract_job_file(pf, property_id, images_in_flight)
+                busy["extract"] += time.perf_counter() - t0
+            texts[pf.id] = text
+            counts["extract"] += 1
+            update_ingest_job(job.id, files_done=counts["extract"])
+            await text_queue.put((pf, text))
+
+        await asyncio.gather(*(extract_one(pf) for pf in files))
+        await text_queue.put(None)
+
+    async def chunk_stage():
+        while (item := await text_queue.get()) is not None:
+            pf, text = item
+            if not _is_text(text):
+                continue
+            t0 = time.perf_counter()
+            chunks = build_chunks(property_id, job.property_name, pf.file_name, text)
+            apartments = await asyncio.to_thread(extract_apartments, pf.file_path, text)
+            save_apartments(property_id, pf.id, apartments)
+            busy["chunk"] += time.perf_counter() - t0
+            counts["chunk"] += len(chunks)
+            for i in range(0, len(chunks), INGEST_EMBED_BATCH):
+                await embed_queue.put(chunks[i:i + INGEST_EMBED_BATCH])
+        await embed_queue.put(None)
+
+    async def embed_stage():
+        # Несколько пачек в полёте одновременно; общий лимит запросов — внутри rag.embed_texts
+        slots = asyncio.Semaphore(EMBED_CONCURRENCY)
+        in_flight = set()
+
+        async def embed_one(batch):
+            try:
+                t0 = time.perf_counter()
+                embeddings = await embed_texts([c["text"] for c in batch])
+                busy["embed"] += time.perf_counter() - t0
+                counts["embed_failed"] += sum(1 for e in embeddings if not e)
+                # Чанки без эмбеддинга тоже идут в запись — их найдёт лексический индекс
+                await store_queue.put((batch, embeddings))
+            finally:
+                slots.release()
+
+        try:
+            while (batch := await embed_queue.get()) is not None:
+                await slots.acquire()
+                counts["embed"] += 1
+                in_flight.add(asyncio.create_task(embed_one(batch)))
+            await asyncio.gather(*in_flight)
+        finally:
+            for task in in_flight:
+                task.cancel()
+        await store_queue.put(None)
+
+    async def store_stage():
+        while (item := await store_queue.get()) is not None:
+            t0 = time.perf_counter()
+            counts["store"] += await run_chroma(store_chunks, job.user_id, *item)
+            busy["store"] += time.perf_counter() - t0
+
+    async def analyze_stage():
+        await extract_task
+        parts = [f"=== Файл: {pf.file_name} ===\n{texts[pf.id]}" for pf in files if _is_text(texts[pf.id])]
+        if not parts:
+            raise IngestError("no_text")
+        update_ingest_job(job.id, stage="analyze")
+        t0 = time.perf_counter()
+        extracted_data = await extract_property_data("\n\n".join(parts), job.property_name)
+        busy["analyze"] += time.perf_counter() - t0
+        if not extracted_data:
+            raise IngestError("analyze")
+        update_ingest_job(job.id, stage="index")
+        return extracted_data
+
+    extract_task = asyncio.create_task(extract_stage())
+    tasks = [
+        extract_task,
+        asyncio.create_task(chunk_stage()),
+        asyncio.create_task(embed_stage()),
+        asyncio.create_task(store_stage()),
+        asyncio.create_task(analyze_stage())
+    ]
+    try:
+        # Первая же ошибка любого этапа обрывает конвейер — иначе соседи повиснут на очередях
+        extracted_data = (await asyncio.gather(*tasks))[-1]
+    finally:
+        for task in tasks:
+            task.cancel()
+
+    print(
+        f"[INGEST] Job {job.id} stages: "
+        f"extract {busy['extract']:.1f}s ({counts['extract']} files), "
+        f"chunk {busy['chunk']:.1f}s ({counts['chunk']} chunks), "
+        f"embed {busy['embed']:.1f}s ({counts['embed']} batches, {counts['embed_failed']} failed), "
+        f"store {busy['store']:.1f}s ({counts['store']} chunks), "
+        f"analyze {busy['analyze']:.1f}s; wall {time.perf_counter() - started:.1f}s"
+    )
+
+    # Сохраняем все данные включая условия рассрочки
+    update_property(
+        property_id,
+        name=extracted_data.get("name") or job.property_name,
+        address=extracted_data.get("address", ""),
+        developer=extracted_data.get("developer", ""),
+        completion_date=extracted_data.get("completion_date", ""),
+        price_min=extracted_data.get("price_min"),
+        price_max=extracted_data.get("price_max"),
+        price_per_sqm_min=extracted_data.get("price_per_sqm_min"),
+        price_per_sqm_max=extracted_data.get("price_per_sqm_max"),
+        apartment_types=extracted_data.get("apartment_types", ""),
+        area_min=extracted_data.get("area_min"),
+        area_max=extracted_data.get("area_max"),
+        payment_options=extracted_data.get("payment_options", ""),
+        installment_terms=extracted_data.get("installment_terms", ""),
+        mortgage_info=extracted_data.get("mortgage_info", ""),
+        installment_min_pv=extracted_data.get("installment_min_pv"),
+        installment_max_months=extracted_data.get("installment_max_months"),
+        installment_markup=extracted_data.get("installment_markup"),
+        commission=extracted_data.get("commission", ""),
+        distance_to_sea=extracted_data.get("distance_to_sea", ""),
+        territory_area=extracted_data.get("territory_area", ""),
+        hotel_operator=extracted_data.get("hotel_operator", ""),
+        description=extracted_data.get("description", ""),
+        features=extracted_data.get("features", ""),
+        raw_data=json.dumps(extracted_data, ensure_ascii=False)
+    )
+
+
+def _match_stored_file(file_name: str, stored: list):
+    """
+    Прежняя версия файла среди материалов ЖК
+
+    Сначала точное совпадение имени, затем без цифр — «Прайс 12.05.pdf» → «Прайс 19.05.pdf».
+    Для картинок только точное: фото из Telegram называются photo_<id>.jpg и версиями друг
+    друга не являются.
+    """
+    for f in stored:
+        if f.file_name == file_name:
+            return f
+    if Path(file_name).suffix.lower() in SUPPORTED_EXTENSIONS["images"]:
+        return None
+    key = _name_key(file_name)
+    candidates = [f for f in stored if _name_key(f.file_name) == key]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def _name_key(file_name: str) -> str:
+    path = Path(file_name.lower())
+    return "".join(ch for ch in path.stem if ch.isalpha()) + path.suffix
+
+
+def _diff_chunks(old_chunks: list, new_chunks: list) -> tuple:
+    """
+    (сохраняемые старые, новые к записи, ID к удалению) — сравнение по тексту чанка
+
+    Одинаковые тексты сопоставляются один к одному: дубли внутри файла не теряются.
+    """
+    old_by_text: Dict[str, list] = defaultdict(list)
+    for chunk in old_chunks:
+        old_by_text[chunk["text"]].append(chunk)
+
+    kept, added = [], []
+    for chunk in new_chunks:
+        if old_by_text.get(chunk["text"]):
+            kept.append(old_by_text[chunk["text"]].pop())
+        else:
+            added.append(chunk)
+    removed = [chunk["id"] for same_text in old_by_text.values() for chunk in same_text]
+    return kept, added, removed
+
+
+async def process_update_job(job: IngestJob):
+    """
+    Обновление материалов ЖК: новая версия файла сравнивается с сохранённой
+
+    Эмбеддинги считаются только для изменившихся чанков, исчезнувшие удаляются,
+    цены ЖК пересчитываются по инвентарю квартир — без повторного анализа LLM.
+    """
+    property_id = job.property_id
+    prop = get_property(property_id)
+    if not prop:
+        raise IngestError("no_property")
+
+    stored = [f for f in get_property_files(property_id) if f.job_id != job.id]
+    # После падения уже применённые файлы привязаны к ЖК — их пропускаем
+    files = [f for f in get_job_files(job.id) if f.property_id is None]
+    stats: Dict[str, int] = defaultdict(int, json.loads(job.result) if job.result else {})
+    images_in_flight: ImagesInFlight = {}
+
+    update_ingest_job(job.id, stage="extract")
+    slots = asyncio.Semaphore(max(INGEST_EXTRACT_PROCESSES, 1))
+
+    async def extract_one(pf):
+        async with slots:
+            return await _extract_job_file(pf, property_id, images_in_flight)
+
+    texts = await asyncio.gather(*(extract_one(pf) for pf in files))
+
+    update_ingest_job(job.id, stage="index")
+    files_done = job.files_total - len(files)
+    for pf, text in zip(files, texts):
+        files_done += 1
+        old = _match_stored_file(pf.file_name, stored)
+
+        if not _is_text(text) or (old and old.extracted_text == text):
+            # Не изменился, дубликат картинки или не распознан — прежняя версия остаётся как есть
+            delete_property_file(pf.id)
+            stats["unchanged_files" if _is_text(text) else "skipped_files"] += 1
+            update_ingest_job(job.id, files_done=files_done, result=json.dumps(stats))
+            print(f"[INGEST] Update {prop.name}: {pf.file_name} без изменений")
+            continue
+
+        old_chunks = await run_chroma(get_file_chunks, job.user_id, property_id, old.file_name) if old else []
+        new_chunks = build_chunks(property_id, prop.name, pf.file_name, text)
+        kept, added, removed = _diff_chunks(old_chunks, new_chunks)
+
+        # ID новых чанков содержат хэш новой версии файла — со старыми не пересекаются
+        embeddings = await embed_texts([c["text"] for c in added])
+        ready = [(c, e) for c, e in zip(added, embeddings) if e]
+        await run_chroma(store_chunks, job.user_id, [c for c, _ in ready], [e for _, e in ready])
+        stats["chunks_embedded"] += len(ready)
+        if len(ready) < len(added):
+            # Повтор задачи досчитает недостающие: записанные уже совпадут по тексту
+            raise IngestError("embed")
+        await run_chroma(delete_chunks, job.user_id, removed)
+        if old and old.file_name != pf.file_name:
+            await run_chroma(
+                update_chunks_metadata, job.user_id, [c["id"] for c in kept],
+                [{**c["metadata"], "file_name": pf.file_name} for c in kept]
+            )
+
+        apartments = await asyncio.to_thread(extract_apartments, pf.file_path, text)
+        save_apartments(property_id, pf.id, apartments)
+        if old:
+            delete_property_file(old.id)
+            stored.remove(old)
+        set_file_property(pf.id, property_id)
+
+        stats["changed_files" if old else "new_files"] += 1
+        stats["chunks_kept"] += len(kept)
+        stats["chunks_added"] += len(added)
+        stats["chunks_removed"] += len(removed)
+        update_ingest_job(job.id, files_done=files_done, result=json.dumps(stats))
+        print(f"[INGEST] Update {prop.name}: {pf.file_name} — "
+              f"+{len(added)} −{len(removed)} чанков, {len(kept)} без изменений")
+
+    # Цены и площади ЖК — по актуальному инвентарю
+    summary = get_apartments_summary(property_id)
+    if summary["count"]:
+        update_property(property_id, **{k: v for k, v in summary.items() if k != "count" and v is not None})
+    stats["apartments"] = summary["count"]
+    update_ingest_job(job.id, result=json.dumps(stats))
+
+
+async def _heartbeat(job_id: int):
+    """Отметка «воркер жив» — иначе задачу заберут как зависшую"""
+    while True:
+        await asyncio.sleep(max(INGEST_STALE_SECONDS / 3, 1))
+        update_ingest_job(job_id)
+
+
+async def _fail_job(job: IngestJob, error: str):
+    """Откат недоделанной задачи и статус failed"""
+    if job.kind == "update":
+        # Применённые файлы остаются, необработанные возвращаем в ожидающие
+        release_job_files(job.id, keep_attached=True)
+        update_ingest_job(job.id, status="failed", error=error, finished_at=datetime.now().isoformat())
+    else:
+        # Откатываем недособранный ЖК, файлы возвращаем в ожидающие
+        release_job_files(job.id)
+        if job.property_id:
+            await run_chroma(delete_property_chunks, job.user_id, job.property_id)
+            delete_property(job.property_id)
+        update_ingest_job(job.id, status="failed", property_id=None, error=error,
+                          finished_at=datetime.now().isoformat())
+
+
+async def _notify(job_id: int):
+    if _completion_callback:
+        try:
+            await _completion_callback(get_ingest_job(job_id))
+        except Exception as e:
+            print(f"[INGEST] Completion callback error for job {job_id}: {e}")
+
+
+async def run_job(job: IngestJob):
+    started = datetime.now()
+    print(f"[INGEST] Job {job.id} started (attempt {job.attempts}): {job.property_name}")
+    heartbeat = asyncio.create_task(_heartbeat(job.id))
+    try:
+        await process_job(job)
+        update_ingest_job(job.id, status="done", stage="", error=None, finished_at=datetime.now().isoformat())
+        print(f"[INGEST] Job {job.id} done in {(datetime.now() - started).total_seconds():.1f}s")
+    except Exception as e:
+        error = str(e) if isinstance(e, IngestError) else f"{type(e).__name__}: {e}"
+        print(f"[INGEST] Job {job.id} failed: {error}")
+        if isinstance(e, EmbeddingMismatchError):
+            # Коллекцию строил другой провайдер — повтор не поможет, нужна переиндексация
+            error = "embedding_mismatch"
+        await _fail_job(job, error)
+    finally:
+        heartbeat.cancel()
+
+    await _notify(job.id)
+
+
+async def _fail_crashed_job(job_id: int):
+    """Задача исчерпала перезапуски после падений процесса — тот же откат и уведомление, что в run_job"""
+    job = get_ingest_job(job_id)
+    if not job:
+        return
+    print(f"[INGEST] Job {job.id} failed: crashed {job.attempts} times")
+    await _fail_job(job, "crashed")
+    await _notify(job.id)
+
+
+async def worker_loop(worker_id: int):
+    global _wake_event
+    if _wake_event is None:
+        _wake_event = asyncio.Event()
+    print(f"[INGEST] Worker {worker_id} started")
+    while True:
+        try:
+            requeued, crashed = requeue_stale_jobs(INGEST_STALE_SECONDS, INGEST_MAX_ATTEMPTS)
+            if requeued:
+                print(f"[INGEST] Requeued {requeued} stale jobs")
+            for job_id in crashed:
+                await _fail_crashed_job(job_id)
+            job = claim_ingest_job()
+            if job:
+                await run_job(job)
+                continue
+        except Exception as e:
+            print(f"[INGEST] Worker {worker_id} error: {e}")
+
+        _wake_event.clear()
+        try:
+            await asyncio.wait_for(_wake_event.wait(), timeout=INGEST_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+
+def start_workers(count: int = INGEST_WORKERS) -> list:
+    """Запустить воркеры в текущем event loop"""
+    return [asyncio.create_task(worker_loop(i)) for i in range(count)]
+
+
+async def _main():
+    from bot.handlers.add_property import handle_ingest_finished
+    set_completion_callback(handle_ingest_finished)
+    await asyncio.gather(*start_workers(max(INGEST_WORKERS, 1)))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,306 @@
+"""
+Инвентарь квартир — разбор прайс-листов в структурированные строки
+"""
+import re
+from pathlib import Path
+from typing import List, Optional, Dict, Iterable
+
+import pandas as pd
+
+from db.models import Apartment
+
+# Разумные границы — отсекаем итоги, телефоны, годы и прочие числа из прайса
+PRICE_MIN = 500_000
+PRICE_MAX = 5_000_000_000
+AREA_MIN = 8
+AREA_MAX = 2000
+
+# Строка "Ключ – значение" / "Ключ: значение" (дефис только с пробелами — "Кол-во комнат")
+CARD_LINE_RE = re.compile(r"^\s*[-•*]?\s*(?P<key>[^|:–—]{2,50}?)\s*(?:[–—]|\s-\s|:)\s*(?P<value>.+?)\s*$")
+
+PAGE_BREAK_RE = re.compile(r"^(===|---)\s*(СТРАНИЦА|Страница|ЛИСТ|Лист|Файл)")
+
+
+def classify_column(header: str) -> Optional[str]:
+    """Какое поле квартиры описывает заголовок колонки или ключ карточки"""
+    h = " ".join(str(header).lower().replace("\n", " ").split())
+    if not h:
+        return None
+
+    is_money = "цен" in h or "стоим" in h
+    if is_money and ("м2" in h or "м²" in h or "метр" in h or "/м" in h or "кв.м" in h or "кв. м" in h):
+        return "price_per_sqm"
+    if "скидк" in h and not is_money:
+        return None
+    if "площад" in h:
+        return "area"
+    if is_money:
+        return "price"
+    if "этаж" in h and "этажн" not in h:
+        return "floor"
+    if "комнат" in h or h in ("тип", "тип квартиры", "планировка"):
+        return "rooms"
+    if any(w in h for w in ("номер помещ", "номер кв", "№ кв", "квартира", "лот", "помещени")) or h in ("№", "номер", "№ п/п"):
+        return "unit_number"
+    return None
+
+
+def _is_generic_number(header) -> bool:
+    return str(header).lower().strip() in ("№", "номер", "№ п/п", "n")
+
+
+def parse_number(value) -> Optional[float]:
+    """'15 600 000 ₽' → 15600000.0, '42,96 м²' → 42.96, '15.6 млн' → 15600000.0"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return None if pd.isna(value) else float(value)
+
+    text = str(value).lower().replace("\xa0", " ").strip()
+    match = re.search(r"\d[\d ]*(?:[.,]\d+)?", text)
+    if not match:
+        return None
+
+    number = match.group(0).replace(" ", "").replace(",", ".")
+    try:
+        result = float(number)
+    except ValueError:
+        return None
+
+    if "млн" in text:
+        result *= 1_000_000
+    return result
+
+
+def parse_rooms(value) -> Optional[int]:
+    """'студия' → 0, '2к' / '2-комнатная' → 2, 'евро-3' → 2"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return None if pd.isna(value) else int(value)
+
+    text = str(value).lower()
+    if "студ" in text:
+        return 0
+    match = re.search(r"евро\s*-?\s*(\d)", text)
+    if match:
+        # Евро-N — это N-1 комната плюс кухня-гостиная
+        return max(int(match.group(1)) - 1, 0)
+    match = re.search(r"(\d)\s*-?\s*(?:к|комн|кк|ккв)", text)
+    if match:
+        return int(match.group(1))
+    match = re.fullmatch(r"\s*(\d)\s*", text)
+    return int(match.group(1)) if match else None
+
+
+def _build_apartment(fields: Dict[str, object]) -> Optional[Apartment]:
+    """Квартира из сырых значений полей — или None, если это не квартира"""
+    price = parse_number(fields.get("price"))
+    area = parse_number(fields.get("area"))
+    unit_number = str(fields.get("unit_number") or "").strip()
+    if unit_number.endswith(".0"):
+        unit_number = unit_number[:-2]
+
+    if price is None or not PRICE_MIN <= price <= PRICE_MAX:
+        return None
+    if area is not None and not AREA_MIN <= area <= AREA_MAX:
+        area = None
+    if area is None and not unit_number:
+        return None
+
+    floor = parse_number(fields.get("floor"))
+    price_per_sqm = parse_number(fields.get("price_per_sqm"))
+    if not price_per_sqm and area:
+        price_per_sqm = price / area
+
+    return Apartment(
+        unit_number=unit_number[:30],
+        rooms=parse_rooms(fields.get("rooms")),
+        area=round(area, 2) if area else None,
+        floor=int(floor) if floor is not None and -5 <= floor <= 200 else None,
+        price=int(price),
+        price_per_sqm=int(price_per_sqm) if price_per_sqm else None
+    )
+
+
+def parse_table(rows: List[List[str]]) -> List[Apartment]:
+    """
+    Таблица прайса: ищем строку заголовков, дальше — по строке на квартиру
+
+    Если заголовка нет, пробуем читать таблицу как карточку "ключ | значение".
+    """
+    header_idx, columns = None, {}
+    for idx, row in enumerate(rows[:30]):
+        found = {}
+        for col, cell in enumerate(row):
+            field = classify_column(cell)
+            if not field:
+                continue
+            # «№» часто просто порядковый номер строки — конкретная колонка «Номер кв.» важнее
+            if field not in found or (field == "unit_number" and _is_generic_number(row[found[field]])):
+                found[field] = col
+        if "price" in found and ("area" in found or "unit_number" in found):
+            header_idx, columns = idx, found
+            break
+
+    if header_idx is None:
+        pairs = []
+        for row in rows:
+            cells = [c for c in row if str(c).strip()]
+            if len(cells) >= 2:
+                pairs.append((cells[0], cells[1]))
+            else:
+                pairs.append(None)
+        return parse_cards(pairs)
+
+    apartments = []
+    for row in rows[header_idx + 1:]:
+        fields = {field: row[col] for field, col in columns.items() if col < len(row)}
+        apartment = _build_apartment(fields)
+        if apartment:
+            apartments.append(apartment)
+    return apartments
+
+
+def parse_cards(pairs: Iterable[Optional[tuple]]) -> List[Apartment]:
+    """
+    Карточки квартир: подряд идущие пары (ключ, значение)
+
+    Новая карточка начинается, когда ключ повторяется или встречается None (граница страницы).
+    """
+    apartments = []
+    current: Dict[str, object] = {}
+
+    def flush():
+        if current:
+            apartment = _build_apartment(current)
+            if apartment:
+                apartments.append(apartment)
+            current.clear()
+
+    for pair in pairs:
+        if pair is None:
+            flush()
+            continue
+        field = classify_column(pair[0])
+        if not field:
+            continue
+        if field in current:
+            flush()
+        current[field] = pair[1]
+    flush()
+
+    return apartments
+
+
+def parse_text(text: str) -> List[Apartment]:
+    """Текст парсеров/Vision: таблицы через « | » и карточки «Ключ – значение»"""
+    apartments = []
+    table: List[List[str]] = []
+    pairs: List[Optional[tuple]] = []
+
+    def flush_table():
+        if len(table) > 1:
+            apartments.extend(parse_table(table))
+        table.clear()
+
+    for line in text.splitlines():
+        stripped = line.strip()
+
+        if "|" in stripped:
+            cells = [c.strip() for c in stripped.strip("|").split("|")]
+            # Разделитель markdown-таблицы: |---|---|
+            if not all(re.fullmatch(r":?-{2,}:?", c) for c in cells if c):
+                table.append(cells)
+            continue
+        flush_table()
+
+        if PAGE_BREAK_RE.match(stripped):
+            pairs.append(None)
+            continue
+        match = CARD_LINE_RE.match(stripped)
+        if match:
+            pairs.append((match.group("key"), match.group("value")))
+
+    flush_table()
+    apartments.extend(parse_cards(pairs))
+    return apartments
+
+
+def _spreadsheet_tables(file_path: str) -> List[List[List[str]]]:
+    suffix = Path(file_path).suffix.lower()
+    if suffix == ".csv":
+        try:
+            frames = {"csv": pd.read_csv(file_path, header=None, dtype=str, encoding="utf-8")}
+        except UnicodeDecodeError:
+            frames = {"csv": pd.read_csv(file_path, header=None, dtype=str, encoding="cp1251")}
+    else:
+        frames = pd.read_excel(file_path, sheet_name=None, header=None)
+
+    tables = []
+    for df in frames.values():
+        df = df.dropna(how="all").dropna(axis=1, how="all").fillna("")
+        if not df.empty:
+            tables.append([[v if isinstance(v, (int, float)) else str(v).strip() for v in row]
+                           for row in df.values.tolist()])
+    return tables
+
+
+def _docx_tables(file_path: str) -> List[List[List[str]]]:
+    from docx import Document
+    doc = Document(file_path)
+    return [[[cell.text.strip() for cell in row.cells] for row in table.rows] for table in doc.tables]
+
+
+def extract_apartments(file_path: str, text: str = "") -> List[Apartment]:
+    """
+    Квартиры из файла прайса
+
+    Excel/CSV/DOCX читаем напрямую (заголовки колонок теряются в текстовом представлении),
+    остальное — из извлечённого текста (PDF, Vision).
+    """
+    suffix = Path(file_path).suffix.lower()
+    apartments: List[Apartment] = []
+
+    try:
+        if suffix in (".xlsx", ".xls", ".csv"):
+            for rows in _spreadsheet_tables(file_path):
+                apartments.extend(parse_table(rows))
+        elif suffix == ".docx":
+            for rows in _docx_tables(file_path):
+                apartments.extend(parse_table(rows))
+    except Exception as e:
+        print(f"[INVENTORY] Table read error {Path(file_path).name}: {e}")
+
+    if not apartments and text and not text.startswith("["):
+        apartments = parse_text(text)
+
+    # Одна и та же квартира может попасть в прайс дважды (карточка + итоговая таблица)
+    unique, seen = [], set()
+    for a in apartments:
+        key = (a.unit_number, a.price) if a.unit_number else (a.area, a.floor, a.price)
+        if key not in seen:
+            seen.add(key)
+            unique.append(a)
+
+    if unique:
+        print(f"[INVENTORY] {Path(file_path).name}: {len(unique)} квартир")
+    return unique
+
+
+def backfill_apartments():
+    """Заполнить инвентарь для ЖК, загруженных до появления таблицы apartments"""
+    from db.database import get_all_properties, get_property_files, save_apartments, count_apartments
+
+    for prop in get_all_properties():
+        if count_apartments(prop.user_id, prop.id):
+            continue
+        total = 0
+        for f in get_property_files(prop.id):
+            if f.extracted_text and not f.extracted_text.startswith("["):
+                total += save_apartments(prop.id, f.id, extract_apartments(f.file_path, f.extracted_text))
+        print(f"[INVENTORY] {prop.name}: {total} квартир")
+
+
+if __name__ == "__main__":
+    backfill_apartments()
@@ -0,0 +1,140 @@
+"""
+Лексический индекс чанков — SQLite FTS5 рядом с векторным поиском Chroma
+
+Риелторы ищут точные токены: номер квартиры, «2к», название застройщика, цену.
+Косинусная близость их часто теряет, а полнотекстовый индекс находит сразу.
+Русская морфология — лёгкий стеммер (отрезаем окончания), цены из групп
+разрядов «15 600 000» склеиваются в одно число, «2-комнатная» → «2к».
+"""
+import re
+import json
+from typing import Dict, List, Optional
+
+from db.database import (
+    save_lexical_chunks,
+    delete_lexical_chunks,
+    delete_property_lexical_chunks,
+    delete_user_lexical_chunks,
+    update_lexical_metadata,
+    search_lexical_chunks,
+    count_lexical_chunks
+)
+
+# Окончания от длинных к коротким — отрезаем первое подошедшее
+ENDINGS = sorted("""
+    ешься ется ются ться ящих ующих ующий ующая ующее
+    иями ями ами ого его ому ему ыми ими ей ий ый ой ая яя ое ее ые ие ую юю
+    ам ям ах ях ов ев ом ем ью ия ие ии ию ть ся ет ит ут ют ат ят
+    а я о е ы и у ю ь й
+""".split(), key=len, reverse=True)
+
+MIN_STEM = 3  # короче — слово не трогаем: «дом», «этаж» и так узнаваемы
+
+# Служебные слова запроса — по ним совпадает почти любой чанк
+STOP_WORDS = {
+    "в", "во", "на", "до", "от", "и", "или", "с", "со", "по", "для", "из", "к", "о", "об",
+    "а", "но", "не", "что", "как", "какие", "какая", "какой", "есть", "ли", "мне", "нужна",
+    "нужно", "нужен", "покажи", "подбери", "найди", "все", "это", "у", "за", "при", "без",
+    # Единицы: «до 15 млн» — диапазон цен обрабатывает инвентарь, а «млн» есть везде
+    "млн", "тыс", "руб", "р", "м", "м2", "кв"
+}
+
+ROOMS_RE = re.compile(r"(\d)\s*-?\s*(?:комн\w*|кк\b|к\b)")
+DIGIT_GROUPS_RE = re.compile(r"(?<=\d)[ \xa0](?=\d{3}(?!\d))")
+DECIMAL_RE = re.compile(r"(?<=\d),(?=\d)")
+TOKEN_RE = re.compile(r"[0-9a-zа-я]+(?:\.[0-9]+)?")
+
+
+def stem(word: str) -> str:
+    if word[0].isdigit():
+        return word
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Текст → нормализованные термы в порядке появления"""
+    text = text.lower().replace("ё", "е")
+    text = DIGIT_GROUPS_RE.sub("", text)
+    text = DECIMAL_RE.sub(".", text)
+    text = ROOMS_RE.sub(r"\1к", text)
+    return [stem(token) for token in TOKEN_RE.findall(text)]
+
+
+def match_query(query: str) -> str:
+    """Запрос → выражение MATCH: любой из термов, ранжирование — bm25"""
+    terms = []
+    for term in tokenize(query):
+        if term not in STOP_WORDS and term not in terms:
+            terms.append(term)
+    return " OR ".join(f'"{term}"' for term in terms)
+
+
+def index_chunks(user_id: int, chunks: List[Dict]):
+    """Записать чанки (id, text, metadata) — повторная запись заменяет прежнюю"""
+    save_lexical_chunks(user_id, [
+        (c["id"], c["metadata"].get("property_id"), " ".join(tokenize(c["text"])),
+         c["text"], json.dumps(c["metadata"], ensure_ascii=False))
+        for c in chunks
+    ])
+
+
+def remove_chunks(user_id: int, ids: List[str]):
+    delete_lexical_chunks(user_id, ids)
+
+
+def remove_property(user_id: int, property_id: int):
+    delete_property_lexical_chunks(user_id, property_id)
+
+
+def remove_user(user_id: int):
+    delete_user_lexical_chunks(user_id)
+
+
+def update_metadata(user_id: int, ids: List[str], metadatas: List[Dict]):
+    update_lexical_metadata(user_id, [
+        (json.dumps(m, ensure_ascii=False), chunk_id) for chunk_id, m in zip(ids, metadatas)
+    ])
+
+
+def search(user_id: int, query: str, property_id: Optional[int] = None, limit: int = 20) -> List[Dict]:
+    """Чанки по совпадению термов, лучшие по bm25 первыми"""
+    expression = match_query(query)
+    if not expression:
+        return []
+    try:
+        rows = search_lexical_chunks(user_id, expression, property_id, limit)
+    except Exception as e:
+        print(f"[LEXICAL] Search error: {e}")
+        return []
+    return [
+        {"id": chunk_id, "text": document, "metadata": json.loads(metadata)}
+        for chunk_id, document, metadata in rows
+    ]
+
+
+def backfill_lexical_index():
+    """Проиндексировать чанки, записанные в Chroma до появления лексического индекса"""
+    from services.rag import chroma_client
+
+    for collection in chroma_client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        if not name.startswith("user_"):
+            continue
+        user_id = int(name[len("user_"):])
+        collection = chroma_client.get_collection(name)
+        total = collection.count()
+        if not total or count_lexical_chunks(user_id) >= total:
+            continue
+        results = collection.get(include=["documents", "metadatas"])
+        index_chunks(user_id, [
+            {"id": chunk_id, "text": document, "metadata": metadata or {}}
+            for chunk_id, document, metadata in zip(results["ids"], results["documents"], results["metadatas"])
+        ])
+        print(f"[LEXICAL] {name}: {len(results['ids'])} чанков проиндексировано")
+
+
+if __name__ == "__main__":
+    backfill_lexical_index()
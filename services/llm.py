@@ -2,12 +2,11 @@
 Сервис для работы с LLM (OpenAI GPT-4)
 """
 import json
-from typing import Optional, Dict, Any
-from openai import AsyncOpenAI
+from typing import Optional, Dict, Any, Callable, Awaitable
 
-from config import OPENAI_API_KEY, OPENAI_MODEL
-
-client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+from config import OPENAI_MODEL, CONTEXT_MAX_TOKENS, CONTEXT_KP_MAX_TOKENS
+from services import llm_gateway
+from services.context_packer import pack_chunks
 
 
 EXTRACT_PROPERTY_PROMPT = """Ты — помощник риэлтора. Проанализируй материалы о жилом комплексе и извлеки структурированную информацию.
@@ -76,7 +75,7 @@ EXTRACT_PROPERTY_PROMPT = """Ты — помощник риэлтора. Про
 
 
 async def extract_property_data(text: str, property_name: str = "") -> Optional[Dict[str, Any]]:
-    if not client:
+    if not llm_gateway.available():
         print("[LLM] OpenAI client not initialized")
         return None
     
@@ -84,7 +83,7 @@ async def extract_property_data(text: str, property_name: str = "") -> Optional[
     user_prompt += f"Материалы:\n\n{text[:15000]}"
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": EXTRACT_PROPERTY_PROMPT},
@@ -114,11 +113,11 @@ async def extract_property_data(text: str, property_name: str = "") -> Optional[
 
 
 async def extract_text_from_image(image_base64: str) -> Optional[str]:
-    if not client:
+    if not llm_gateway.available():
         return None
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model="gpt-4o-mini",
             messages=[
                 {
@@ -179,11 +178,11 @@ QUERY_PROMPT = """Ты — помощник риэлтора. Анализиру
 
 
 async def answer_query(query: str, properties_context: str) -> str:
-    if not client:
+    if not llm_gateway.available():
         return "❌ Сервис временно недоступен"
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": QUERY_PROMPT.format(properties_context=properties_context)},
@@ -201,7 +200,7 @@ async def answer_query(query: str, properties_context: str) -> str:
 
 
 async def quick_chat(message: str, context: str = "") -> str:
-    if not client:
+    if not llm_gateway.available():
         return "❌ Сервис временно недоступен"
     
     system = "Ты — дружелюбный помощник риэлтора. Отвечай кратко и по делу."
@@ -209,7 +208,7 @@ async def quick_chat(message: str, context: str = "") -> str:
         system += f"\n\nКонтекст: {context}"
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": system},
@@ -260,24 +259,20 @@ UNIVERSAL_PROMPT = """Ты — ассистент риэлтора. Твоя з
 ВАЖНО: Проверь КАЖДЫЙ блок данных. Не пропускай квартиры!"""
 
 
-async def universal_respond(query: str, chunks: list, history: list = None) -> dict:
-    """Универсальный ответ на любой запрос"""
-    if not client:
-        return {"action": "text", "content": "❌ Сервис временно недоступен"}
-    
-    # Формируем контекст из чанков
-    chunks_text = ""
-    if chunks:
-        for chunk in chunks:
-            meta = chunk.get("metadata", {})
-            prop_name = meta.get("property_name", "")
-            chunks_text += f"[{prop_name}] {chunk['text']}\n\n"
-    else:
-        chunks_text = "(нет данных)"
+def property_label(chunk: dict) -> str:
+    """Префикс блока контекста — из какого ЖК данные"""
+    prop_name = (chunk.get("metadata") or {}).get("property_name", "")
+    return f"[{prop_name}] " if prop_name else ""
+
+
+def _universal_messages(query: str, chunks: list, history: list = None) -> list:
+    """Сообщения для универсального ответа: промпт с контекстом, история, запрос"""
+    # Формируем контекст из чанков — без повторов, целыми блоками под бюджет токенов
+    chunks_text = pack_chunks(chunks, CONTEXT_MAX_TOKENS, label=property_label) or "(нет данных)"
     
     # Собираем сообщения
     messages = [
-        {"role": "system", "content": UNIVERSAL_PROMPT.format(chunks=chunks_text[:12000])}
+        {"role": "system", "content": UNIVERSAL_PROMPT.format(chunks=chunks_text)}
     ]
     
     # Добавляем историю
@@ -286,11 +281,18 @@ async def universal_respond(query: str, chunks: list, history: list = None) -> d
             messages.append({"role": msg["role"], "content": msg["content"]})
     
     messages.append({"role": "user", "content": query})
+    return messages
+
+
+async def universal_respond(query: str, chunks: list, history: list = None) -> dict:
+    """Универсальный ответ на любой запрос"""
+    if not llm_gateway.available():
+        return {"action": "text", "content": "❌ Сервис временно недоступен"}
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
-            messages=messages,
+            messages=_universal_messages(query, chunks, history),
             temperature=0.3,
             max_tokens=1500
         )
@@ -303,6 +305,60 @@ async def universal_respond(query: str, chunks: list, history: list = None) -> d
         return {"action": "text", "content": "❌ Произошла ошибка"}
 
 
+def visible_text(text: str) -> str:
+    """
+    Часть недописанного ответа, которую можно показывать
+    
+    Всё с первой «{» или «```» придерживается: там может начинаться JSON действия,
+    его пользователь видеть не должен. Что это было — решит parse_llm_response
+    по полному тексту.
+    """
+    cut = len(text)
+    for marker in ("{", "```"):
+        position = text.find(marker)
+        if position != -1:
+            cut = min(cut, position)
+    return text[:cut].rstrip()
+
+
+async def universal_respond_stream(
+    query: str,
+    chunks: list,
+    history: list = None,
+    on_text: Optional[Callable[[str], Awaitable[None]]] = None
+) -> dict:
+    """
+    universal_respond с потоковой генерацией
+    
+    on_text получает видимую часть ответа каждый раз, когда она растёт. Результат —
+    как у universal_respond: действие распознаётся по полному тексту.
+    """
+    if not llm_gateway.available():
+        return {"action": "text", "content": "❌ Сервис временно недоступен"}
+    
+    text = ""
+    shown = ""
+    try:
+        async for delta in llm_gateway.chat_stream(
+            model=OPENAI_MODEL,
+            messages=_universal_messages(query, chunks, history),
+            temperature=0.3,
+            max_tokens=1500
+        ):
+            text += delta
+            if on_text:
+                visible = visible_text(text)
+                if len(visible) > len(shown):
+                    shown = visible
+                    await on_text(visible)
+        
+        return parse_llm_response(text.strip())
+        
+    except Exception as e:
+        print(f"[LLM] universal_respond_stream error: {e}")
+        return {"action": "text", "content": "❌ Произошла ошибка"}
+
+
 def parse_llm_response(text: str) -> dict:
     """Парсим ответ LLM — текст или JSON с action"""
     
@@ -358,21 +414,18 @@ HTML должен быть самодостаточным (inline styles)."""
 
 async def generate_html_document(property_data: str, chunks: list, query: str = "") -> Optional[str]:
     """Генерирует HTML документ через LLM"""
-    if not client:
+    if not llm_gateway.available():
         return None
     
-    chunks_text = ""
-    if chunks:
-        for chunk in chunks:
-            chunks_text += f"{chunk.get('text', '')}\n\n"
+    chunks_text = pack_chunks(chunks, CONTEXT_KP_MAX_TOKENS)
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": GENERATE_HTML_PROMPT.format(
                     property_data=property_data,
-                    chunks=chunks_text[:8000],
+                    chunks=chunks_text,
                     query=query or "стандартное коммерческое предложение"
                 )},
                 {"role": "user", "content": f"Создай КП. {query}" if query else "Создай коммерческое предложение"}
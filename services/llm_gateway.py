@@ -0,0 +1,353 @@
+"""
+Шлюз OpenAI — все вызовы чата, Vision и эмбеддингов идут через него
+
+- один AsyncOpenAI с общим пулом соединений httpx (LLM_MAX_CONNECTIONS);
+- таймаут на каждый вызов; встроенные повторы SDK выключены — повторяем здесь;
+- не больше N вызовов одной модели одновременно (LLM_CONCURRENCY,
+  для отдельных моделей — LLM_MODEL_CONCURRENCY);
+- бюджет токенов в минуту на модель (LLM_MODEL_TPM): вызов ждёт, пока в
+  скользящем окне освободится место под оценку его токенов;
+- 429/5xx/таймаут/обрыв — повтор с экспоненциальной паузой и джиттером,
+  не раньше Retry-After, если провайдер его прислал;
+- латентность, время до первого токена потока, ожидание в очереди, повторы
+  и ошибки — по каждой модели (/stats).
+
+Пачка загрузок больше не упирается в rate limit всем составом: лишние вызовы
+ждут своей очереди здесь, а не получают 429 и не роняют обработку.
+
+Лимиты действуют в пределах процесса. К OpenAI ходит только процесс бота:
+пул процессов ingest получает лишь CPU-работу (парсинг, рендеринг страниц),
+Vision и эмбеддинги вызываются из основного процесса. Воркер ingest, запущенный
+отдельно (python -m services.ingest), — свой процесс со своими лимитами;
+LLM_MODEL_CONCURRENCY и LLM_MODEL_TPM тогда делятся между процессами вручную.
+"""
+import time
+import random
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+from openai import (
+    AsyncOpenAI, DefaultAsyncHttpxClient,
+    RateLimitError, APITimeoutError, APIConnectionError, InternalServerError
+)
+import httpx
+
+from config import (
+    OPENAI_API_KEY, LLM_TIMEOUT, LLM_MAX_RETRIES, LLM_RETRY_DELAY, LLM_MAX_CONNECTIONS,
+    LLM_CONCURRENCY, LLM_MODEL_CONCURRENCY, LLM_MODEL_TPM, EMBED_CONCURRENCY
+)
+
+# Ошибки, после которых тот же запрос стоит повторить
+TRANSIENT_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+TPM_WINDOW = 60.0  # сек — окно бюджета токенов
+IMAGE_TOKENS = 1100  # оценка картинки detail=high (2048 px) во входе Vision
+LATENCY_SAMPLES = 500  # последних вызовов на модель для перцентилей
+
+client: Optional[AsyncOpenAI] = AsyncOpenAI(
+    api_key=OPENAI_API_KEY,
+    timeout=LLM_TIMEOUT,
+    max_retries=0,
+    http_client=DefaultAsyncHttpxClient(
+        limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    )
+) if OPENAI_API_KEY else None
+
+
+def _parse_limits(spec: str) -> Dict[str, int]:
+    """'gpt-4o=4,gpt-4o-mini=8' → {'gpt-4o': 4, 'gpt-4o-mini': 8}"""
+    limits = {}
+    for part in spec.split(","):
+        if "=" in part:
+            model, value = part.split("=", 1)
+            limits[model.strip()] = int(value)
+    return limits
+
+
+_concurrency_limits = _parse_limits(LLM_MODEL_CONCURRENCY)
+_tpm_limits = _parse_limits(LLM_MODEL_TPM)
+
+
+class _ModelLimiter:
+    """Семафор и окно токенов одной модели — привязаны к event loop, в котором созданы"""
+
+    def __init__(self, model: str, window: Optional[deque] = None):
+        if model in _concurrency_limits:
+            slots = _concurrency_limits[model]
+        elif model.startswith("text-embedding"):
+            slots = EMBED_CONCURRENCY
+        else:
+            slots = LLM_CONCURRENCY
+        self.slots = asyncio.Semaphore(slots)
+        self.tpm = _tpm_limits.get(model, 0)
+        self.window: deque = window if window is not None else deque()  # [время, токены]
+        self.window_lock = asyncio.Lock()
+        self.loop = asyncio.get_running_loop()
+
+    def release(self, entry: Optional[list]):
+        """Запрос не дошёл до модели (429, таймаут открытия) — его оценка не тратит бюджет"""
+        if entry is not None:
+            entry[1] = 0
+
+    def _used(self, now: float) -> int:
+        while self.window and now - self.window[0][0] > TPM_WINDOW:
+            self.window.popleft()
+        return sum(entry[1] for entry in self.window)
+
+    async def reserve(self, tokens: int) -> Optional[list]:
+        """Занять tokens в окне; вернуть запись, чтобы поправить её по факту"""
+        if not self.tpm:
+            return None
+        # Под замком — ждущие вызовы проходят по очереди, а не все разом
+        async with self.window_lock:
+            while True:
+                now = time.monotonic()
+                used = self._used(now)
+                # Запрос больше всего бюджета проходит в пустое окно, иначе ждал бы вечно
+                if used + tokens <= self.tpm or not self.window:
+                    entry = [now, tokens]
+                    self.window.append(entry)
+                    return entry
+                await asyncio.sleep(max(0.05, TPM_WINDOW - (now - self.window[0][0])))
+
+
+_limiters: Dict[str, _ModelLimiter] = {}
+
+# Статистика за время жизни процесса, по моделям
+_stats: Dict[str, Dict] = {}
+
+
+def _limiter(model: str) -> _ModelLimiter:
+    """Лимитер модели для текущего event loop; израсходованный бюджет токенов переходит в новый"""
+    limiter = _limiters.get(model)
+    if limiter is None or limiter.loop is not asyncio.get_running_loop():
+        limiter = _limiters[model] = _ModelLimiter(model, limiter.window if limiter else None)
+    return limiter
+
+
+def _model_stats(model: str) -> Dict:
+    if model not in _stats:
+        _stats[model] = {
+            "calls": 0, "errors": 0, "retries": 0, "tokens": 0,
+            "queued_seconds": 0.0, "latencies": deque(maxlen=LATENCY_SAMPLES),
+            "ttft": deque(maxlen=LATENCY_SAMPLES)
+        }
+    return _stats[model]
+
+
+def available() -> bool:
+    return client is not None
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка сверху: кириллица в cl100k — около 2 символов на токен"""
+    return len(text) // 2 + 1
+
+
+def _message_tokens(messages: List[Dict]) -> int:
+    tokens = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    tokens += estimate_tokens(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    tokens += IMAGE_TOKENS
+    return tokens
+
+
+def _retry_after(error: Exception) -> float:
+    """Retry-After из ответа провайдера, сек (0 — не прислал)"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return 0.0
+    try:
+        return float(response.headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _account(stats: Dict, entry: Optional[list], usage):
+    """Фактический расход токенов — в статистику и в окно вместо оценки"""
+    used = getattr(usage, "total_tokens", None) if usage else None
+    if used:
+        stats["tokens"] += used
+        if entry is not None:
+            entry[1] = used
+
+
+@asynccontextmanager
+async def _slot(model: str, tokens: int, request, retries: Optional[int], retry_delay: Optional[float], label: str):
+    """
+    request() под лимитами модели с повторами; тело блока работает, пока слот занят
+
+    Повторяется только открытие запроса: обрыв потока посреди ответа уходит вызывающему.
+    Исключение — после последней попытки.
+    """
+    if client is None:
+        raise RuntimeError("OpenAI API key не задан")
+    retries = LLM_MAX_RETRIES if retries is None else retries
+    retry_delay = LLM_RETRY_DELAY if retry_delay is None else retry_delay
+    limiter = _limiter(model)
+    stats = _model_stats(model)
+
+    for attempt in range(retries + 1):
+        queued = time.perf_counter()
+        entry = await limiter.reserve(tokens)
+        async with limiter.slots:
+            started = time.perf_counter()
+            stats["queued_seconds"] += started - queued
+            stats["calls"] += 1
+            try:
+                response = await request()
+            except TRANSIENT_ERRORS as e:
+                stats["errors"] += 1
+                # Следующая попытка займёт окно заново — прежняя оценка не должна висеть в нём
+                limiter.release(entry)
+                if attempt >= retries:
+                    print(f"[LLM_GW] {model} {label}: failed after {retries} retries: {e}")
+                    raise
+                error = e
+            except Exception:
+                stats["errors"] += 1
+                limiter.release(entry)
+                raise
+            else:
+                try:
+                    yield response, entry
+                except Exception:
+                    stats["errors"] += 1
+                    raise
+                stats["latencies"].append(time.perf_counter() - started)
+                return
+
+        # Пауза вне семафора — слот свободен для других вызовов
+        stats["retries"] += 1
+        delay = max(retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5), _retry_after(error))
+        print(f"[LLM_GW] {model} {label}: retry {attempt + 1}/{retries} in {delay:.1f}s: {error}")
+        await asyncio.sleep(delay)
+
+
+async def _call(model: str, tokens: int, request, retries: Optional[int], retry_delay: Optional[float], label: str):
+    """Выполнить request() под лимитами модели; ответ SDK как есть"""
+    async with _slot(model, tokens, request, retries, retry_delay, label) as (response, entry):
+        _account(_model_stats(model), entry, getattr(response, "usage", None))
+        return response
+
+
+async def chat(
+    model: str,
+    messages: List[Dict],
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    timeout: Optional[float] = None,
+    retries: Optional[int] = None,
+    retry_delay: Optional[float] = None,
+    **kwargs
+):
+    """chat.completions.create через лимиты шлюза; ответ SDK как есть"""
+    params = {"model": model, "messages": messages, **kwargs}
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    if temperature is not None:
+        params["temperature"] = temperature
+    if timeout is not None:
+        params["timeout"] = timeout
+    tokens = _message_tokens(messages) + (max_tokens or 0)
+    return await _call(
+        model, tokens, lambda: client.chat.completions.create(**params), retries, retry_delay, "chat"
+    )
+
+
+async def chat_stream(
+    model: str,
+    messages: List[Dict],
+    max_tokens: Optional[int] = None,
+    temperature: Optional[float] = None,
+    retries: Optional[int] = None,
+    retry_delay: Optional[float] = None,
+    **kwargs
+) -> AsyncIterator[str]:
+    """
+    Потоковый chat.completions — куски текста по мере генерации
+
+    Слот модели занят до конца потока; время до первого куска — в статистике (ttft).
+    """
+    params = {
+        "model": model, "messages": messages, "stream": True,
+        "stream_options": {"include_usage": True}, **kwargs
+    }
+    if max_tokens is not None:
+        params["max_tokens"] = max_tokens
+    if temperature is not None:
+        params["temperature"] = temperature
+    tokens = _message_tokens(messages) + (max_tokens or 0)
+    stats = _model_stats(model)
+
+    request = lambda: client.chat.completions.create(**params)
+    async with _slot(model, tokens, request, retries, retry_delay, "stream") as (stream, entry):
+        started = time.perf_counter()
+        first = True
+        try:
+            async for chunk in stream:
+                # Последний кусок потока — без choices, только usage
+                _account(stats, entry, getattr(chunk, "usage", None))
+                if not chunk.choices:
+                    continue
+                content = chunk.choices[0].delta.content
+                if content:
+                    if first:
+                        stats["ttft"].append(time.perf_counter() - started)
+                        first = False
+                    yield content
+        finally:
+            # Вызывающий мог бросить поток на середине — соединение возвращается в пул
+            await stream.close()
+
+
+async def embeddings(
+    model: str,
+    texts: List[str],
+    retries: Optional[int] = None,
+    retry_delay: Optional[float] = None
+):
+    """embeddings.create через лимиты шлюза; ответ SDK как есть"""
+    tokens = sum(estimate_tokens(t) for t in texts)
+    return await _call(
+        model, tokens, lambda: client.embeddings.create(model=model, input=texts), retries, retry_delay,
+        f"embed x{len(texts)}"
+    )
+
+
+def percentile(values: list, q: float) -> float:
+    """q-перцентиль отсортированного списка, сек (0 — данных нет)"""
+    if not values:
+        return 0.0
+    return round(values[min(len(values) - 1, int(q * len(values)))], 3)
+
+
+def get_stats() -> Dict:
+    """Латентность, очередь, повторы и ошибки по моделям"""
+    result = {}
+    for model, stats in _stats.items():
+        latencies = sorted(stats["latencies"])
+        ttft = sorted(stats["ttft"])
+        limiter = _limiters.get(model)
+        result[model] = {
+            "calls": stats["calls"],
+            "errors": stats["errors"],
+            "retries": stats["retries"],
+            "tokens": stats["tokens"],
+            "queued_seconds": round(stats["queued_seconds"], 2),
+            "latency_p50": percentile(latencies, 0.5),
+            "latency_p95": percentile(latencies, 0.95),
+            "ttft_p50": percentile(ttft, 0.5),
+            "ttft_p95": percentile(ttft, 0.95),
+            "tpm_limit": limiter.tpm if limiter else 0
+        }
+    return result
@@ -1,15 +1,16 @@
 """
 Сервис для извлечения текста из файлов
 """
-import io
-import base64
 from pathlib import Path
 from typing import Optional
 import fitz  # PyMuPDF
 import pandas as pd
-from PIL import Image
 
 from services.llm import extract_text_from_image
+from services.image_prep import prepare_image_async
+
+# Версия извлечения — входит в ключ кэша, повышать при изменении результата парсинга
+EXTRACTOR_VERSION = "parser.extract_text:2"
 
 
 async def extract_text(file_path: str) -> str:
@@ -145,19 +146,7 @@ def extract_from_docx(file_path: str) -> str:
 async def extract_from_image(file_path: str) -> str:
     """Извлечь текст из изображения через Vision API"""
     
-    with Image.open(file_path) as img:
-        if img.mode in ("RGBA", "P"):
-            img = img.convert("RGB")
-        
-        max_size = 2000
-        if max(img.size) > max_size:
-            ratio = max_size / max(img.size)
-            new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-        
-        buffer = io.BytesIO()
-        img.save(buffer, format="JPEG", quality=85)
-        image_base64 = base64.b64encode(buffer.getvalue()).decode()
+    image_base64, _ = await prepare_image_async(file_path)
     
     text = await extract_text_from_image(image_base64)
     
@@ -1,18 +1,39 @@
 """
-Vision-first парсер — все файлы через Vision API
+Vision-first парсер — сканы и картинки через Vision API,
+PDF с нормальным текстовым слоем разбираются локально
 """
-import io
+import os
 import base64
+import time
+import asyncio
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from concurrent.futures import Executor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional, List
+from typing import Optional, List, Dict, Tuple
 import fitz  # PyMuPDF
 import pandas as pd
-from PIL import Image
-from openai import AsyncOpenAI
 
-from config import OPENAI_API_KEY
+from config import (
+    VISION_CONCURRENCY, VISION_MAX_RETRIES, VISION_RETRY_DELAY,
+    PDF_TEXT_MIN_CHARS, PDF_IMAGE_COVERAGE_MAX, PDF_BAD_CHARS_MAX
+)
+from services import llm_gateway
+from services.image_prep import prepare_image_async
 
-client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Версия извлечения — входит в ключ кэша, повышать при изменении результата парсинга
+EXTRACTOR_VERSION = "parser_v2.extract_all:5"
+
+# Рендеринг страниц PDF для Vision
+RENDER_DEFAULT_DPI = 150   # когда в текстовом слое нет шрифтов (скан)
+RENDER_MIN_DPI = 72
+RENDER_MAX_DPI = 200
+RENDER_TEXT_PX = 20        # сколько пикселей должен получить самый мелкий шрифт страницы
+RENDER_MAX_SIDE_PX = 2048  # Vision (detail=high) всё равно ужимает картинку до 2048 по длинной стороне
+RENDER_GRAY_MAX_IMAGES = 0.15  # картинок меньше этой доли — страница текстовая, цвет не нужен
+RENDER_OPEN_DOCUMENTS = 2  # сколько PDF держит открытыми один процесс (поток) рендеринга
 
 # Промпт для Vision — извлечение ВСЕГО
 VISION_EXTRACT_PROMPT = """Ты анализируешь документ о жилом комплексе для риэлтора.
@@ -33,119 +54,458 @@ VISION_EXTRACT_PROMPT = """Ты анализируешь документ о ж
 - Пиши на русском"""
 
 
-async def extract_all(file_path: str) -> str:
-    """Главная функция — извлечь всё из файла"""
+@dataclass
+class Extraction:
+    """
+    Результат извлечения: текст и сколько страниц (частей) не удалось прочитать
+    
+    failed > 0 — сбой Vision, рендеринга или чтения файла: текст неполный, повторная
+    загрузка может дать больше, поэтому такой результат не кэшируется.
+    """
+    text: str
+    failed: int = 0
+
+
+# MuPDF не потокобезопасен — без пула процессов fitz работает строго по одному потоку
+_fitz_lock = threading.Lock()
+
+
+def _locked(fn, *args):
+    with _fitz_lock:
+        return fn(*args)
+
+
+async def _run_cpu(executor: Optional[Executor], fn, *args):
+    """
+    CPU-часть извлечения (fitz, pandas, docx) — в пуле процессов или в потоке
+    
+    В пул уходят только синхронные функции с простыми аргументами: event loop,
+    клиент OpenAI и лимиты шлюза живут в основном процессе, Vision вызывается отсюда.
+    """
+    if executor is not None:
+        return await asyncio.get_running_loop().run_in_executor(executor, fn, *args)
+    return await asyncio.to_thread(_locked, fn, *args)
+
+
+async def extract_all(file_path: str, executor: Optional[Executor] = None) -> Extraction:
+    """
+    Главная функция — извлечь всё из файла
+    
+    executor — пул процессов для CPU-работы (ingest); BrokenProcessPool пробрасывается,
+    чтобы вызывающий пересоздал пул.
+    """
     path = Path(file_path)
     suffix = path.suffix.lower()
     
     try:
         if suffix == ".pdf":
-            return await extract_pdf_vision(file_path)
+            return await extract_pdf_hybrid(file_path, executor=executor)
         
         elif suffix in (".jpg", ".jpeg", ".png", ".webp"):
             return await extract_image_vision(file_path)
         
         elif suffix == ".docx":
-            return extract_from_docx(file_path)
+            return Extraction(await _run_cpu(executor, extract_from_docx, file_path))
         
         elif suffix in (".xlsx", ".xls"):
-            return extract_from_excel(file_path)
+            return Extraction(await _run_cpu(executor, extract_from_excel, file_path))
         
         elif suffix == ".csv":
-            return extract_from_csv(file_path)
+            return Extraction(await _run_cpu(executor, extract_from_csv, file_path))
         
         elif suffix == ".txt":
-            return path.read_text(encoding="utf-8", errors="ignore")
+            return Extraction(path.read_text(encoding="utf-8", errors="ignore"))
         
         else:
-            return f"[Неподдерживаемый формат: {suffix}]"
+            return Extraction(f"[Неподдерживаемый формат: {suffix}]")
             
+    except BrokenProcessPool:
+        raise
     except Exception as e:
         print(f"[PARSER_V2] Error: {file_path} — {e}")
-        return f"[Ошибка: {e}]"
+        return Extraction(f"[Ошибка: {e}]", failed=1)
 
 
-async def extract_pdf_vision(file_path: str, max_pages: int = 30) -> str:
-    """PDF → изображения страниц → Vision API"""
+def plan_pdf(file_path: str, max_vision_pages: int) -> Tuple[Dict[int, str], List[int], Dict[int, str], int]:
+    """
+    Разобрать страницы PDF: текстовые — сразу в текст, остальные — в очередь на Vision
     
-    if not client:
-        return "[OpenAI не настроен]"
+    max_vision_pages=0 — Vision недоступен, со сканов берётся что есть в текстовом слое.
+    
+    Returns:
+        (текст локальных страниц, страницы для Vision, их текстовый слой про запас,
+         сколько страниц просились в Vision сверх max_vision_pages)
+    """
+    local_pages: Dict[int, str] = {}
+    vision_pages: List[int] = []
+    text_layer: Dict[int, str] = {}  # запасной вариант, если Vision не справится
+    over_limit = 0
+    
+    with fitz.open(file_path) as doc:
+        print(f"[PARSER_V2] PDF {Path(file_path).name}: {len(doc)} страниц (гибрид)")
+        
+        for page_num, page in enumerate(doc, 1):
+            info = classify_pdf_page(page)
+            print(
+                f"[PARSER_V2] Стр. {page_num} → {info['route']} "
+                f"(символов={info['text_chars']}, картинки={info['image_coverage']:.0%}, "
+                f"таблиц={info['tables']}, мусор={info['bad_chars']:.0%})"
+            )
+            
+            if info["route"] == "text":
+                local_pages[page_num] = extract_pdf_page_text(page, info["found_tables"])
+            elif len(vision_pages) < max_vision_pages:
+                vision_pages.append(page_num)
+                text_layer[page_num] = page.get_text().strip()
+            else:
+                # Без Vision берём хотя бы то, что есть в текстовом слое
+                over_limit += 1
+                text = page.get_text().strip()
+                if text:
+                    local_pages[page_num] = text
+    
+    return local_pages, vision_pages, text_layer, over_limit
+
+
+async def extract_pdf_hybrid(
+    file_path: str,
+    max_vision_pages: int = 30,
+    concurrency: int = VISION_CONCURRENCY,
+    executor: Optional[Executor] = None
+) -> Extraction:
+    """
+    PDF — страницы с текстовым слоем локально, сканы и картинки через Vision API
+    
+    failed — страницы, где Vision не сработал (ни ответа, ни рендеринга) или недоступен
+    вовсе: для них в тексте текстовый слой или пометка об ошибке.
+    """
+    
+    start = time.perf_counter()
+    vision_ready = llm_gateway.available()
+    try:
+        local_pages, vision_pages, text_layer, over_limit = await _run_cpu(
+            executor, plan_pdf, file_path, max_vision_pages if vision_ready else 0
+        )
+    except BrokenProcessPool:
+        raise
+    except Exception as e:
+        print(f"[PARSER_V2] PDF open error: {e}")
+        return Extraction(f"[Ошибка чтения PDF: {e}]", failed=1)
+    
+    vision_results = await _vision_pages(file_path, vision_pages, concurrency, executor) if vision_pages else {}
+    # Сверх лимита страниц — всегда одинаково, а без ключа повтор с ключом прочтёт больше
+    failed = 0 if vision_ready else over_limit
+    
+    all_text = []
+    for page_num in sorted(set(local_pages) | set(vision_results)):
+        # Текстовая страница может дать "" — это результат, а не повод смотреть в Vision
+        if page_num in local_pages:
+            text = local_pages[page_num]
+        else:
+            text = vision_results[page_num]
+            if text is None:
+                failed += 1
+                text = text_layer.get(page_num) or "[Ошибка распознавания]"
+        all_text.append(f"=== СТРАНИЦА {page_num} ===\n{text}")
+    
+    print(
+        f"[PARSER_V2] PDF {Path(file_path).name}: {len(local_pages)} стр. локально, "
+        f"{len(vision_pages)} через Vision, не распознано {failed}, {time.perf_counter() - start:.1f}s"
+    )
+    
+    if not all_text:
+        return Extraction("[PDF пустой]", failed)
     
-    images_base64 = []
+    return Extraction("\n\n".join(all_text), failed)
+
+
+def classify_pdf_page(page) -> dict:
+    """
+    Решить, как извлекать страницу PDF
+    
+    Returns:
+        {"route": "text" | "vision", "text_chars", "image_coverage", "tables", "bad_chars",
+         "found_tables": найденные таблицы — extract_pdf_page_text не ищет их второй раз}
+    """
+    text = page.get_text().strip()
+    text_chars = len(text)
+    
+    # Доля нечитаемых символов — у PDF с битыми шрифтами текстовый слой есть, но это мусор
+    bad = sum(1 for ch in text if ch == "\ufffd" or (ord(ch) < 32 and ch not in "\n\t"))
+    bad_chars = bad / text_chars if text_chars else 0.0
+    
+    image_coverage = _image_coverage(page)
+    
+    # find_tables — самый дорогой шаг разбора; скану и мусорному слою он не нужен
+    found_tables = []
+    scanned = text_chars < PDF_TEXT_MIN_CHARS or bad_chars > PDF_BAD_CHARS_MAX
+    if not scanned:
+        try:
+            found_tables = page.find_tables().tables
+        except Exception:
+            pass
+    tables = len(found_tables)
+    
+    if scanned:
+        route = "vision"
+    elif image_coverage > PDF_IMAGE_COVERAGE_MAX and not tables:
+        # Буклет: текст есть, но главное (планировки, инфографика) — в картинках
+        route = "vision"
+    else:
+        route = "text"
+    
+    return {
+        "route": route,
+        "text_chars": text_chars,
+        "image_coverage": image_coverage,
+        "tables": tables,
+        "bad_chars": bad_chars,
+        "found_tables": found_tables
+    }
+
+
+def _image_coverage(page) -> float:
+    """Какую долю площади страницы занимают картинки"""
+    page_rect = page.rect
+    page_area = page_rect.width * page_rect.height or 1
+    image_area = 0.0
+    for img in page.get_image_info():
+        bbox = fitz.Rect(img["bbox"]) & page_rect
+        if not bbox.is_empty:
+            image_area += bbox.width * bbox.height
+    return min(image_area / page_area, 1.0)
+
+
+def choose_render_params(page) -> Tuple[int, bool]:
+    """
+    DPI и режим цвета для рендеринга страницы
+    
+    DPI подбирается так, чтобы самый мелкий шрифт страницы получил RENDER_TEXT_PX пикселей,
+    но длинная сторона картинки не превышала RENDER_MAX_SIDE_PX.
+    
+    Returns:
+        (dpi, grayscale)
+    """
+    min_font = None
+    try:
+        for block in page.get_text("dict")["blocks"]:
+            for line in block.get("lines", []):
+                for span in line["spans"]:
+                    # Совсем мелкие «шрифты» — невидимые OCR-слои и артефакты вёрстки
+                    if span["text"].strip() and span["size"] >= 3:
+                        min_font = span["size"] if min_font is None else min(min_font, span["size"])
+    except Exception:
+        pass
+    
+    dpi = 72 * RENDER_TEXT_PX / min_font if min_font else RENDER_DEFAULT_DPI
+    
+    long_side_pt = max(page.rect.width, page.rect.height) or 1
+    dpi = min(dpi, RENDER_MAX_DPI, 72 * RENDER_MAX_SIDE_PX / long_side_pt)
+    dpi = int(max(dpi, RENDER_MIN_DPI))
+    
+    grayscale = _image_coverage(page) < RENDER_GRAY_MAX_IMAGES
+    return dpi, grayscale
+
+
+# Открытые PDF этого процесса: страницы файла идут подряд, и документ
+# (разбор xref, шрифты) открывается один раз, а не на каждую страницу.
+# Доступ — из одного потока: в пуле каждый процесс рендерит по странице,
+# без пула fitz работает под _fitz_lock.
+_documents: "OrderedDict[tuple, fitz.Document]" = OrderedDict()
+
+
+def _open_document(file_path: str):
+    stat = os.stat(file_path)
+    key = (file_path, stat.st_mtime_ns, stat.st_size)  # файл заменили — открываем заново
+    doc = _documents.get(key)
+    if doc is None:
+        doc = _documents[key] = fitz.open(file_path)
+        while len(_documents) > RENDER_OPEN_DOCUMENTS:
+            _, oldest = _documents.popitem(last=False)
+            oldest.close()
+    else:
+        _documents.move_to_end(key)
+    return doc
+
+
+def close_document(file_path: str):
+    """
+    Закрыть PDF, открытый для рендеринга в этом процессе
+
+    MuPDF кэширует декодированные картинки страниц (до 256 МБ на процесс). Кэш
+    сбрасывается, только когда рендерить в процессе больше нечего, — чужой файл
+    посреди рендеринга свои страницы не теряет.
+    """
+    for key in [key for key in _documents if key[0] == file_path]:
+        _documents.pop(key).close()
+    if not _documents:
+        fitz.TOOLS.store_shrink(100)
+
+
+def render_page(file_path: str, page_num: int) -> str:
+    """Отрендерить одну страницу в base64 JPEG для Vision"""
+    page = _open_document(file_path)[page_num - 1]
+    dpi, grayscale = choose_render_params(page)
+    pix = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY if grayscale else fitz.csRGB)
+    img_bytes = pix.tobytes("jpeg", jpg_quality=85)
+    print(f"[PARSER_V2] Стр. {page_num}: {dpi} DPI, {'ч/б' if grayscale else 'цвет'}, "
+          f"{pix.width}x{pix.height}, {len(img_bytes) // 1024} KB")
+    del pix, page
+    return base64.b64encode(img_bytes).decode()
+
+
+def extract_pdf_page_text(page, tables: Optional[list] = None) -> str:
+    """
+    Текст страницы из текстового слоя, таблицы — построчно через « | »
+
+    tables — уже найденные на странице (classify_pdf_page); None — искать здесь.
+    """
+    if tables is None:
+        try:
+            tables = page.find_tables().tables
+        except Exception:
+            tables = []
+    
+    if not tables:
+        return page.get_text().strip()
+    
+    table_rects = [fitz.Rect(t.bbox) for t in tables]
+    text_parts = []
+    
+    # Текстовые блоки вне таблиц — как есть
+    for block in page.get_text("blocks"):
+        x0, y0, x1, y1, block_text, _, block_type = block[:7]
+        if block_type != 0 or not block_text.strip():
+            continue
+        if any(fitz.Rect(x0, y0, x1, y1).intersects(r) for r in table_rects):
+            continue
+        text_parts.append(block_text.strip())
+    
+    for table in tables:
+        table_rows = []
+        for row in table.extract():
+            cells = [(cell or "").replace("\n", " ").strip() for cell in row]
+            if any(cells):
+                table_rows.append(" | ".join(cells))
+        if table_rows:
+            text_parts.append("[ТАБЛИЦА]\n" + "\n".join(table_rows))
+    
+    return "\n".join(text_parts)
+
+
+async def extract_pdf_vision(
+    file_path: str,
+    max_pages: int = 30,
+    concurrency: int = VISION_CONCURRENCY
+) -> str:
+    """PDF → изображения страниц → Vision API (до concurrency страниц параллельно)"""
+    
+    if not llm_gateway.available():
+        return "[OpenAI не настроен]"
     
     try:
         with fitz.open(file_path) as doc:
             num_pages = min(len(doc), max_pages)
             print(f"[PARSER_V2] PDF {Path(file_path).name}: {num_pages} страниц")
-            
-            for page_num in range(num_pages):
-                page = doc[page_num]
-                # Рендерим страницу в изображение (150 DPI для баланса качество/размер)
-                pix = page.get_pixmap(dpi=150)
-                img_bytes = pix.tobytes("jpeg")
-                img_base64 = base64.b64encode(img_bytes).decode()
-                images_base64.append((page_num + 1, img_base64))
-                
     except Exception as e:
-        print(f"[PARSER_V2] PDF render error: {e}")
-        return f"[Ошибка рендеринга PDF: {e}]"
+        print(f"[PARSER_V2] PDF open error: {e}")
+        return f"[Ошибка чтения PDF: {e}]"
     
-    if not images_base64:
+    if not num_pages:
         return "[PDF пустой]"
     
-    # Отправляем все страницы в Vision API
-    all_text = []
+    results = await _vision_pages(file_path, list(range(1, num_pages + 1)), concurrency)
     
-    for page_num, img_base64 in images_base64:
-        try:
+    return "\n\n".join(
+        f"=== СТРАНИЦА {page_num} ===\n{text or '[Ошибка распознавания]'}"
+        for page_num, text in sorted(results.items())
+    )
+
+
+async def _vision_pages(
+    file_path: str,
+    page_numbers: List[int],
+    concurrency: int,
+    executor: Optional[Executor] = None
+) -> Dict[int, Optional[str]]:
+    """
+    Распознать выбранные страницы PDF через Vision — {номер страницы: текст или None}
+    
+    None — страницу не удалось отрендерить или распознать.
+    
+    concurrency воркеров берут страницы по одной: рендеринг (в пуле процессов или
+    в потоке), затем Vision. Каждый держит не больше одной закодированной страницы,
+    так что в памяти одновременно живёт не больше concurrency картинок, а не весь документ.
+    Документ открыт в процессе рендеринга на всё время файла; без пула закрывается
+    в конце, в пуле — вытесняется следующими файлами (RENDER_OPEN_DOCUMENTS).
+    """
+    
+    queue = iter(page_numbers)
+    pages: Dict[int, Optional[str]] = {}
+    
+    async def worker():
+        for page_num in queue:
+            try:
+                img_base64 = await _run_cpu(executor, render_page, file_path, page_num)
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                print(f"[PARSER_V2] PDF render error page {page_num}: {e}")
+                continue
+            
             text = await _call_vision_api(img_base64)
-            if text and not text.startswith("["):
-                all_text.append(f"=== СТРАНИЦА {page_num} ===\n{text}")
+            
+            if text:
+                pages[page_num] = text
                 print(f"[PARSER_V2] Страница {page_num}: {len(text)} символов")
-        except Exception as e:
-            print(f"[PARSER_V2] Vision error page {page_num}: {e}")
-            all_text.append(f"=== СТРАНИЦА {page_num} ===\n[Ошибка распознавания]")
+            else:
+                print(f"[PARSER_V2] Vision error page {page_num}")
+                pages[page_num] = None
+    
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, min(concurrency, len(page_numbers))))))
+    finally:
+        if executor is None:
+            await asyncio.to_thread(_locked, close_document, file_path)
+    
+    # Страницы, которые не удалось отрендерить
+    for page_num in page_numbers:
+        pages.setdefault(page_num, None)
     
-    return "\n\n".join(all_text)
+    return pages
 
 
-async def extract_image_vision(file_path: str) -> str:
+async def extract_image_vision(file_path: str) -> Extraction:
     """Изображение → Vision API"""
     
-    if not client:
-        return "[OpenAI не настроен]"
+    if not llm_gateway.available():
+        return Extraction("[OpenAI не настроен]", failed=1)
     
     try:
-        with Image.open(file_path) as img:
-            # Конвертируем в RGB если нужно
-            if img.mode in ("RGBA", "P"):
-                img = img.convert("RGB")
-            
-            # Уменьшаем если слишком большое
-            max_size = 2000
-            if max(img.size) > max_size:
-                ratio = max_size / max(img.size)
-                new_size = (int(img.size[0] * ratio), int(img.size[1] * ratio))
-                img = img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            buffer = io.BytesIO()
-            img.save(buffer, format="JPEG", quality=85)
-            img_base64 = base64.b64encode(buffer.getvalue()).decode()
+        # Декодирование/ресайз/JPEG — в пуле потоков, event loop не блокируется
+        img_base64, _ = await prepare_image_async(file_path)
         
         text = await _call_vision_api(img_base64)
+        if text is None:
+            return Extraction("[Ошибка распознавания]", failed=1)
         print(f"[PARSER_V2] Image {Path(file_path).name}: {len(text)} символов")
-        return text
+        return Extraction(text)
         
     except Exception as e:
         print(f"[PARSER_V2] Image error: {e}")
-        return f"[Ошибка изображения: {e}]"
+        return Extraction(f"[Ошибка изображения: {e}]", failed=1)
 
 
-async def _call_vision_api(image_base64: str) -> str:
-    """Вызов Vision API для одного изображения"""
+async def _call_vision_api(image_base64: str) -> Optional[str]:
+    """
+    Вызов Vision API для одного изображения; None — не удалось
+    
+    429/5xx/таймауты повторяет шлюз — с паузой VISION_RETRY_DELAY и в общем
+    лимите gpt-4o, так что сбой страницы не перезапускает весь документ.
+    """
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model="gpt-4o",  # Используем gpt-4o для лучшего качества Vision
             messages=[
                 {
@@ -163,86 +523,76 @@ async def _call_vision_api(image_base64: str) -> str:
                 }
             ],
             max_tokens=2000,
-            temperature=0.1
+            temperature=0.1,
+            retries=VISION_MAX_RETRIES,
+            retry_delay=VISION_RETRY_DELAY
         )
         
-        return response.choices[0].message.content
+        return response.choices[0].message.content or None
         
     except Exception as e:
         print(f"[PARSER_V2] Vision API error: {e}")
-        return f"[Ошибка Vision API: {e}]"
+        return None
 
 
 def extract_from_docx(file_path: str) -> str:
-    """DOCX — текст + таблицы"""
-    try:
-        from docx import Document
-        doc = Document(file_path)
-        
-        text_parts = []
-        
-        for para in doc.paragraphs:
-            if para.text.strip():
-                text_parts.append(para.text)
-        
-        for table in doc.tables:
-            table_rows = []
-            for row in table.rows:
-                cells = [cell.text.strip() for cell in row.cells]
-                if any(cells):
-                    table_rows.append(" | ".join(cells))
-            if table_rows:
-                text_parts.append("\n[ТАБЛИЦА]\n" + "\n".join(table_rows))
-        
-        return "\n".join(text_parts) if text_parts else "[DOCX пустой]"
-        
-    except Exception as e:
-        return f"[Ошибка DOCX: {e}]"
+    """DOCX — текст + таблицы; ошибка чтения пробрасывается в extract_all"""
+    from docx import Document
+    doc = Document(file_path)
+    
+    text_parts = []
+    
+    for para in doc.paragraphs:
+        if para.text.strip():
+            text_parts.append(para.text)
+    
+    for table in doc.tables:
+        table_rows = []
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells]
+            if any(cells):
+                table_rows.append(" | ".join(cells))
+        if table_rows:
+            text_parts.append("\n[ТАБЛИЦА]\n" + "\n".join(table_rows))
+    
+    return "\n".join(text_parts) if text_parts else "[DOCX пустой]"
 
 
 def extract_from_excel(file_path: str) -> str:
-    """Excel — все листы"""
+    """Excel — все листы; ошибка чтения пробрасывается в extract_all"""
     text_parts = []
     
-    try:
-        xlsx = pd.ExcelFile(file_path)
+    xlsx = pd.ExcelFile(file_path)
+    
+    for sheet_name in xlsx.sheet_names:
+        df = pd.read_excel(xlsx, sheet_name=sheet_name)
+        df = df.dropna(how='all').dropna(axis=1, how='all')
         
-        for sheet_name in xlsx.sheet_names:
-            df = pd.read_excel(xlsx, sheet_name=sheet_name)
-            df = df.dropna(how='all').dropna(axis=1, how='all')
-            
-            if df.empty:
-                continue
-            
-            df = df.fillna('')
-            text_parts.append(f"=== ЛИСТ: {sheet_name} ===")
-            
-            for idx, row in df.iterrows():
-                row_values = [str(v).strip() for v in row.values if str(v).strip()]
-                if row_values:
-                    text_parts.append(" | ".join(row_values))
+        if df.empty:
+            continue
         
-    except Exception as e:
-        return f"[Ошибка Excel: {e}]"
+        df = df.fillna('')
+        text_parts.append(f"=== ЛИСТ: {sheet_name} ===")
+        
+        for idx, row in df.iterrows():
+            row_values = [str(v).strip() for v in row.values if str(v).strip()]
+            if row_values:
+                text_parts.append(" | ".join(row_values))
     
     return "\n".join(text_parts) if text_parts else "[Excel пустой]"
 
 
 def extract_from_csv(file_path: str) -> str:
-    """CSV"""
+    """CSV; ошибка чтения пробрасывается в extract_all"""
     try:
-        try:
-            df = pd.read_csv(file_path, encoding="utf-8")
-        except:
-            df = pd.read_csv(file_path, encoding="cp1251")
-        
-        if df.empty:
-            return "[CSV пустой]"
-        
-        return df.to_string(index=False)
-        
-    except Exception as e:
-        return f"[Ошибка CSV: {e}]"
+        df = pd.read_csv(file_path, encoding="utf-8")
+    except:
+        df = pd.read_csv(file_path, encoding="cp1251")
+    
+    if df.empty:
+        return "[CSV пустой]"
+    
+    return df.to_string(index=False)
 
 
 def get_file_info(file_path: str) -> dict:
@@ -1,20 +1,41 @@
 """
-RAG Engine — ChromaDB + OpenAI Embeddings
+RAG Engine — ChromaDB + эмбеддинги (services/embeddings.py)
 """
 import chromadb
 from chromadb.config import Settings
-from typing import List, Dict, Optional
-from pathlib import Path
-from openai import OpenAI
+import hashlib
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Dict, Optional
 
-from config import OPENAI_API_KEY, DATA_DIR
+import numpy as np
+
+from config import DATA_DIR, EMBEDDING_MODEL, CHROMA_WORKERS, EMBEDDING_RESCORE, EMBEDDING_RESCORE_FACTOR
+from services.embedding_cache import embed_cached
+from services.embeddings import (
+    get_provider, check_signature, EmbeddingMismatchError, OPENAI_DIMENSIONS,
+    quantize_int8, dequantize_int8
+)
+from services import lexical, search_cache
+from db.database import (
+    get_rag_version, bump_rag_version,
+    save_chunk_vectors, get_chunk_vectors,
+    delete_chunk_vectors, delete_property_chunk_vectors, delete_user_chunk_vectors
+)
+from services.chunker import chunk_document, price_filter, matches_price
 
 # Директория для ChromaDB
 CHROMA_DIR = DATA_DIR / "chroma"
 CHROMA_DIR.mkdir(parents=True, exist_ok=True)
 
-# OpenAI client для эмбеддингов
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+# Коллекции, созданные до выбора провайдера, строились OpenAI
+LEGACY_SIGNATURE = {
+    "embedding_provider": "openai",
+    "embedding_model": EMBEDDING_MODEL,
+    "embedding_dim": OPENAI_DIMENSIONS.get(EMBEDDING_MODEL, 1536)
+}
 
 # ChromaDB client
 chroma_client = chromadb.PersistentClient(
@@ -22,64 +43,194 @@ chroma_client = chromadb.PersistentClient(
     settings=Settings(anonymized_telemetry=False)
 )
 
+# Chroma синхронная (SQLite + HNSW) — из корутин вызываем только через этот пул,
+# отдельный от дефолтного, чтобы поиск не ждал за парсингом и наоборот
+_chroma_executor = ThreadPoolExecutor(max_workers=CHROMA_WORKERS, thread_name_prefix="chroma")
+
+
+async def run_chroma(fn: Callable, *args, **kwargs) -> Any:
+    """Выполнить синхронный вызов Chroma в пуле, не блокируя event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_chroma_executor, functools.partial(fn, *args, **kwargs))
+
+
+# user_id → (версия, коллекция, число чанков, несовместимость с провайдером)
+#
+# get_or_create_collection и count() — по запросу к SQLite Chroma каждый. Запись
+# действительна, пока версия коллекции в rag_versions не сменилась: любая запись
+# или удаление чанков (в том числе соседним процессом) её поднимает.
+_collections: Dict[int, tuple] = {}
+_collections_lock = threading.Lock()
+
+
+def _remember_collection(user_id: int, version: int, collection, count: int, mismatch: Optional[str]) -> tuple:
+    """Запомнить состояние, если оно не старше уже запомненного"""
+    entry = (version, collection, count, mismatch)
+    with _collections_lock:
+        current = _collections.get(user_id)
+        if current is None or current[0] <= version:
+            _collections[user_id] = entry
+    return entry
+
+
+def forget_collection(user_id: int):
+    with _collections_lock:
+        _collections.pop(user_id, None)
+
+
+def _collection_changed(user_id: int, collection=None):
+    """
+    Чанки пользователя изменились — кэш поиска по ним больше недействителен
+
+    Число чанков пересчитывается здесь, на пути записи, а не перед каждым поиском.
+    """
+    version = bump_rag_version(user_id)
+    search_cache.invalidate(user_id)
+    if collection is None:
+        forget_collection(user_id)
+        return
+    try:
+        count, mismatch = _collection_state(collection)
+    except Exception as e:
+        print(f"[RAG] Collection state error: {e}")
+        forget_collection(user_id)
+        return
+    _remember_collection(user_id, version, collection, count, mismatch)
+
+
+def _resolve_collection(user_id: int, version: int) -> tuple:
+    """Состояние коллекции для версии: из кэша процесса или заново из Chroma"""
+    with _collections_lock:
+        entry = _collections.get(user_id)
+    if entry and entry[0] == version:
+        return entry
+    # Версия сменилась — коллекцию могли пересоздать, старый объект не годится
+    collection = chroma_client.get_or_create_collection(
+        name=f"user_{user_id}",
+        metadata={"hnsw:space": "cosine", **get_provider().signature}
+    )
+    count, mismatch = _collection_state(collection)
+    return _remember_collection(user_id, version, collection, count, mismatch)
+
 
 def get_collection(user_id: int):
     """Получить или создать коллекцию для пользователя"""
-    collection_name = f"user_{user_id}"
-    return chroma_client.get_or_create_collection(
-        name=collection_name,
-        metadata={"hnsw:space": "cosine"}
-    )
+    return _resolve_collection(user_id, get_rag_version(user_id))[1]
 
 
-def get_embedding(text: str) -> List[float]:
-    """Получить эмбеддинг через OpenAI"""
-    if not openai_client:
-        return []
-    
+def delete_collection(user_id: int):
+    """Удалить коллекцию пользователя целиком вместе с лексическим индексом"""
     try:
-        response = openai_client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text[:8000]  # Лимит токенов
-        )
-        return response.data[0].embedding
+        chroma_client.delete_collection(f"user_{user_id}")
     except Exception as e:
-        print(f"[RAG] Embedding error: {e}")
-        return []
+        print(f"[RAG] Delete collection error: {e}")
+    lexical.remove_user(user_id)
+    delete_user_chunk_vectors(user_id)
+    _collection_changed(user_id)
+
+
+def rescoring(provider=None) -> bool:
+    """В Chroma усечённые векторы, а полные в int8 лежат рядом для пересчёта"""
+    provider = provider or get_provider()
+    return provider.reduced and EMBEDDING_RESCORE == "int8"
+
+
+def check_collection(collection):
+    """
+    Коллекция построена текущим провайдером эмбеддингов — иначе EmbeddingMismatchError
 
+    Пустая коллекция принимает текущий провайдер, старая без подписи считается OpenAI.
+    """
+    provider = get_provider()
+    stored = collection.metadata or {}
+    if "embedding_provider" not in stored:
+        stored = LEGACY_SIGNATURE if collection.count() else provider.signature
+        collection.modify(metadata=stored)
+    problem = check_signature(stored, provider)
+    if problem and collection.count() == 0:
+        collection.modify(metadata=provider.signature)
+        problem = None
+    if problem:
+        raise EmbeddingMismatchError(f"{collection.name}: {problem}")
 
-def chunk_text(text: str, chunk_size: int = 800, overlap: int = 100) -> List[str]:
-    """Разбить текст на чанки"""
-    if not text or len(text) < 100:
-        return [text] if text else []
+
+async def embed_texts(texts: List[str]) -> List[Optional[List[float]]]:
+    """
+    Эмбеддинги для списка текстов; порядок совпадает со входом, None — не удалось
+
+    Уже встречавшиеся тексты берутся из кэша (services/embedding_cache.py).
+    """
+    provider = get_provider()
+    return await embed_cached(provider.cache_model, texts, provider.embed)
+
+
+def build_chunks(
+    property_id: int,
+    property_name: str,
+    file_name: str,
+    text: str
+) -> List[Dict]:
+    """
+    Чанки документа с ID и метаданными — без эмбеддингов
+
+    ID детерминирован: ЖК + хэш содержимого файла + номер чанка. Повторная
+    индексация того же текста (рестарт, повтор задачи, тот же файл под другим
+    именем) перезаписывает те же записи, а не плодит копии.
+    """
+    if not text or len(text) < 50:
+        return []
     
-    chunks = []
-    start = 0
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+    return [
+        {
+            "id": f"p{property_id}_{content_hash}_{i}",
+            "text": chunk,
+            "metadata": {
+                "property_id": property_id,
+                "property_name": property_name,
+                "file_name": file_name,
+                "chunk_index": i,
+                **structure
+            }
+        }
+        for i, (chunk, structure) in enumerate(chunk_document(text))
+    ]
+
+
+def store_chunks(user_id: int, chunks: List[Dict], embeddings: List[Optional[List[float]]]) -> int:
+    """
+    Записать чанки с эмбеддингами в коллекцию пользователя; вернуть число векторов
+
+    Чанк без эмбеддинга (нет ключа, сбой API) попадает только в лексический
+    индекс — поиск по нему работает и без векторов. Эмбеддинги — полные:
+    в Chroma уходит усечённый вектор, полный в int8 — в chunk_vectors.
+    """
+    if not chunks:
+        return 0
     
-    while start < len(text):
-        end = start + chunk_size
-        
-        # Ищем конец предложения или абзаца
-        if end < len(text):
-            # Ищем точку, перенос строки или конец абзаца
-            for sep in ['\n\n', '\n', '. ', '! ', '? ']:
-                pos = text.rfind(sep, start + chunk_size // 2, end + 100)
-                if pos > start:
-                    end = pos + len(sep)
-                    break
-        
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
+    provider = get_provider()
+    ready = [(c, e) for c, e in zip(chunks, embeddings) if e]
+    if ready:
+        collection = get_collection(user_id)
+        check_collection(collection)
         
-        start = end - overlap
-        if start < 0:
-            start = 0
-    
-    return chunks
+        # upsert — ID стабильны, повторная запись того же чанка идемпотентна
+        collection.upsert(
+            ids=[c["id"] for c, _ in ready],
+            embeddings=[provider.reduce(e) for _, e in ready],
+            documents=[c["text"] for c, _ in ready],
+            metadatas=[c["metadata"] for c, _ in ready]
+        )
+        if rescoring(provider):
+            save_chunk_vectors(user_id, [
+                (c["id"], c["metadata"].get("property_id"), *quantize_int8(e)) for c, e in ready
+            ])
+    lexical.index_chunks(user_id, chunks)
+    _collection_changed(user_id, collection if ready else None)
+    return len(ready)
 
 
-def add_document(
+async def add_document(
     user_id: int,
     property_id: int,
     property_name: str,
@@ -88,97 +239,224 @@ def add_document(
 ) -> int:
     """Добавить документ в RAG"""
     
-    if not text or len(text) < 50:
-        print(f"[RAG] Skip empty document: {file_name}")
-        return 0
-    
-    collection = get_collection(user_id)
-    chunks = chunk_text(text)
-    
+    chunks = build_chunks(property_id, property_name, file_name, text)
     if not chunks:
+        print(f"[RAG] Skip empty document: {file_name}")
         return 0
     
     print(f"[RAG] Adding {len(chunks)} chunks from {file_name}")
     
-    ids = []
-    embeddings = []
-    documents = []
-    metadatas = []
-    
-    for i, chunk in enumerate(chunks):
-        embedding = get_embedding(chunk)
-        if not embedding:
-            continue
-        
-        chunk_id = f"p{property_id}_f{hash(file_name) % 10000}_{i}"
-        
-        ids.append(chunk_id)
-        embeddings.append(embedding)
-        documents.append(chunk)
-        metadatas.append({
-            "property_id": property_id,
-            "property_name": property_name,
-            "file_name": file_name,
-            "chunk_index": i
-        })
-    
-    if ids:
-        collection.add(
-            ids=ids,
-            embeddings=embeddings,
-            documents=documents,
-            metadatas=metadatas
-        )
-        print(f"[RAG] Added {len(ids)} chunks to collection user_{user_id}")
-    
-    return len(ids)
+    embeddings = await embed_texts([c["text"] for c in chunks])
+    added = await run_chroma(store_chunks, user_id, chunks, embeddings)
+    print(f"[RAG] Added {added} chunks to collection user_{user_id}")
+    return added
+
 
+RRF_K = 60  # константа reciprocal rank fusion — сглаживает вес первых мест
 
-def search(
+
+async def search(
     user_id: int,
     query: str,
     property_id: Optional[int] = None,
-    limit: int = 10
+    limit: int = 10,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None
 ) -> List[Dict]:
-    """Поиск релевантных чанков"""
-    
-    collection = get_collection(user_id)
-    
-    # Проверяем есть ли документы
-    if collection.count() == 0:
+    """
+    Поиск релевантных чанков: векторный (Chroma) + лексический (FTS5)
+
+    Списки сливаются reciprocal rank fusion: score = Σ 1 / (RRF_K + место).
+    Точные токены («2к», номер квартиры, застройщик) находит лексический индекс,
+    перефразировки — векторный; чанк из обоих списков поднимается выше.
+    Диапазон цен уходит в where — только чанки с квартирами в этом диапазоне.
+    Повтор того же поиска до изменения коллекции отдаётся из services/search_cache.py.
+    """
+    return (await search_many(user_id, [query], property_id, limit, min_price, max_price))[0]
+
+
+async def search_many(
+    user_id: int,
+    queries: List[str],
+    property_id: Optional[int] = None,
+    limit: int = 10,
+    min_price: Optional[int] = None,
+    max_price: Optional[int] = None
+) -> List[List[Dict]]:
+    """
+    Несколько запросов с общими фильтрами → список чанков на каждый запрос
+
+    Запросы, которых нет в кэше поиска, эмбеддятся одним вызовом и уходят
+    в Chroma одним query с несколькими query_embeddings.
+    """
+    if not queries:
         return []
     
-    query_embedding = get_embedding(query)
-    if not query_embedding:
-        return []
+    keys = [
+        search_cache.make_key(user_id, query, property_id=property_id, limit=limit,
+                              min_price=min_price, max_price=max_price)
+        for query in queries
+    ]
+    version = await asyncio.to_thread(get_rag_version, user_id)
+    results = [search_cache.get(key, version) for key in keys]
     
-    # Фильтр по property_id если указан
-    where_filter = None
-    if property_id:
-        where_filter = {"property_id": property_id}
+    pending = [i for i, chunks in enumerate(results) if chunks is None]
+    if pending:
+        found = await _search(user_id, version, [queries[i] for i in pending],
+                              property_id, limit, min_price, max_price)
+        for i, chunks in zip(pending, found):
+            search_cache.put(keys[i], version, chunks)
+            results[i] = chunks
+    return results
+
+
+def fuse_results(hit_lists: List[List[Dict]], limit: int) -> List[Dict]:
+    """
+    Слить ранжированные списки чанков reciprocal rank fusion
+
+    Одинаковые тексты одного ЖК (копии в старых коллекциях, один чанк из обоих
+    индексов или из нескольких запросов) — один чанк с суммой очков.
+    """
+    fused: Dict[tuple, Dict] = {}
+    for hits in hit_lists:
+        for rank, hit in enumerate(hits):
+            key = (hit["metadata"].get("property_id"), " ".join(hit["text"].split()))
+            entry = fused.setdefault(key, {
+                "text": hit["text"],
+                "metadata": hit["metadata"],
+                "distance": None,
+                "score": 0.0
+            })
+            if entry["distance"] is None:
+                entry["distance"] = hit.get("distance")
+            entry["score"] += 1 / (RRF_K + rank + 1)
     
+    chunks = sorted(fused.values(), key=lambda e: e["score"], reverse=True)[:limit]
+    for chunk in chunks:
+        chunk["score"] = round(chunk["score"], 5)
+    return chunks
+
+
+def _rescore(user_id: int, hits: List[List[Dict]], query_vectors: List[Optional[List[float]]],
+             depth: int) -> List[List[Dict]]:
+    """
+    Кандидаты из HNSW по усечённым векторам → заново по полным (int8) → лучшие depth
+
+    Кандидату без полного вектора остаётся расстояние из HNSW.
+    """
+    stored = get_chunk_vectors(user_id, list({hit["id"] for found in hits for hit in found}))
+    rescored = []
+    for found, query_vector in zip(hits, query_vectors):
+        if query_vector is not None:
+            query = np.asarray(query_vector, dtype=np.float32)
+            query /= np.linalg.norm(query) or 1.0
+            for hit in found:
+                if hit["id"] in stored:
+                    vector = dequantize_int8(*stored[hit["id"]])
+                    hit["distance"] = 1 - float(vector @ query) / (float(np.linalg.norm(vector)) or 1.0)
+        rescored.append(sorted(found, key=lambda hit: hit["distance"])[:depth])
+    return rescored
+
+
+def _collection_state(collection) -> tuple:
+    """(число чанков, описание несовместимости с провайдером или None)"""
     try:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=limit,
-            where=where_filter,
-            include=["documents", "metadatas", "distances"]
+        check_collection(collection)
+    except EmbeddingMismatchError as e:
+        return collection.count(), str(e)
+    return collection.count(), None
+
+
+async def _search(
+    user_id: int,
+    version: int,
+    queries: List[str],
+    property_id: Optional[int],
+    limit: int,
+    min_price: Optional[int],
+    max_price: Optional[int]
+) -> List[List[Dict]]:
+    with _collections_lock:
+        entry = _collections.get(user_id)
+    if entry and entry[0] == version:
+        # Горячий путь: коллекция и число чанков уже известны — к Chroma один запрос
+        _, collection, count, mismatch = entry
+        # Пустая коллекция: векторам искать нечего, эмбеддинги запросов не нужны
+        query_embeddings = await embed_texts(queries) if count else [None] * len(queries)
+    else:
+        # Разрешение коллекции и эмбеддинги запросов — параллельно
+        (_, collection, count, mismatch), query_embeddings = await asyncio.gather(
+            run_chroma(_resolve_collection, user_id, version),
+            embed_texts(queries)
         )
-    except Exception as e:
-        print(f"[RAG] Search error: {e}")
-        return []
+    if mismatch:
+        # Векторы другой модели несравнимы — остаётся только лексический поиск
+        print(f"[RAG] Vector search refused: {mismatch}")
+        query_embeddings = [None] * len(queries)
     
-    # Форматируем результаты
-    chunks = []
-    if results and results['documents'] and results['documents'][0]:
-        for i, doc in enumerate(results['documents'][0]):
-            chunks.append({
-                "text": doc,
-                "metadata": results['metadatas'][0][i] if results['metadatas'] else {},
-                "distance": results['distances'][0][i] if results['distances'] else 0
-            })
+    # Фильтр по property_id и цене — на стороне Chroma
+    conditions = price_filter(min_price, max_price)
+    if property_id:
+        conditions.insert(0, {"property_id": property_id})
+    where_filter = None
+    if len(conditions) == 1:
+        where_filter = conditions[0]
+    elif conditions:
+        where_filter = {"$and": conditions}
+    price_range = min_price is not None or max_price is not None
     
-    return chunks
+    # С запасом: в старых коллекциях встречаются копии одного чанка.
+    # count — число векторов в Chroma, лексический индекс им не ограничен:
+    # чанки без эмбеддингов (нет ключа, ошибка API) есть только в FTS
+    depth = limit * 2
+    provider = get_provider()
+    rescore = rescoring(provider)
+    
+    async def vector_search() -> List[List[Dict]]:
+        hits: List[List[Dict]] = [[] for _ in queries]
+        embedded = [i for i, embedding in enumerate(query_embeddings) if embedding]
+        if not embedded or count == 0:
+            return hits
+        try:
+            results = await run_chroma(
+                collection.query,
+                query_embeddings=[provider.reduce(query_embeddings[i]) for i in embedded],
+                n_results=min(depth * EMBEDDING_RESCORE_FACTOR if rescore else depth, count),
+                where=where_filter,
+                include=["documents", "metadatas", "distances"]
+            )
+        except Exception as e:
+            # Коллекцию могли удалить в обход версии — следующий поиск разрешит её заново
+            print(f"[RAG] Search error: {e}")
+            forget_collection(user_id)
+            return hits
+        if not results or not results['documents']:
+            return hits
+        for row, i in enumerate(embedded):
+            hits[i] = [
+                {
+                    "id": chunk_id,
+                    "text": results['documents'][row][j],
+                    "metadata": results['metadatas'][row][j] if results['metadatas'] else {},
+                    "distance": results['distances'][row][j] if results['distances'] else 0
+                }
+                for j, chunk_id in enumerate(results['ids'][row])
+            ]
+        if rescore:
+            hits = await asyncio.to_thread(_rescore, user_id, hits, query_embeddings, depth)
+        return hits
+    
+    def lexical_search() -> List[List[Dict]]:
+        return [lexical.search(user_id, query, property_id, depth) for query in queries]
+    
+    vector_hits, lexical_hits = await asyncio.gather(vector_search(), asyncio.to_thread(lexical_search))
+    
+    found = []
+    for vector, lexical_found in zip(vector_hits, lexical_hits):
+        if price_range:
+            lexical_found = [h for h in lexical_found if matches_price(h["metadata"], min_price, max_price)]
+        found.append(fuse_results([vector, lexical_found], limit))
+    return found
 
 
 def delete_property_chunks(user_id: int, property_id: int):
@@ -197,12 +475,51 @@ def delete_property_chunks(user_id: int, property_id: int):
             print(f"[RAG] Deleted {len(results['ids'])} chunks for property {property_id}")
     except Exception as e:
         print(f"[RAG] Delete error: {e}")
+    lexical.remove_property(user_id, property_id)
+    delete_property_chunk_vectors(user_id, property_id)
+    _collection_changed(user_id, collection)
+
+
+def get_file_chunks(user_id: int, property_id: int, file_name: str) -> List[Dict]:
+    """Уже проиндексированные чанки файла ЖК: id, text, metadata"""
+    try:
+        results = get_collection(user_id).get(
+            where={"$and": [{"property_id": property_id}, {"file_name": file_name}]},
+            include=["documents", "metadatas"]
+        )
+    except Exception as e:
+        print(f"[RAG] Get file chunks error: {e}")
+        return []
+    
+    return [
+        {"id": chunk_id, "text": doc, "metadata": meta}
+        for chunk_id, doc, meta in zip(results["ids"], results["documents"], results["metadatas"])
+    ]
+
+
+def delete_chunks(user_id: int, ids: List[str]):
+    if ids:
+        collection = get_collection(user_id)
+        collection.delete(ids=ids)
+        lexical.remove_chunks(user_id, ids)
+        delete_chunk_vectors(user_id, ids)
+        _collection_changed(user_id, collection)
+
+
+def update_chunks_metadata(user_id: int, ids: List[str], metadatas: List[Dict]):
+    if ids:
+        collection = get_collection(user_id)
+        collection.update(ids=ids, metadatas=metadatas)
+        lexical.update_metadata(user_id, ids, metadatas)
+        _collection_changed(user_id, collection)
 
 
 def get_stats(user_id: int) -> Dict:
     """Статистика коллекции пользователя"""
-    collection = get_collection(user_id)
+    _, collection, count, _ = _resolve_collection(user_id, get_rag_version(user_id))
     return {
-        "total_chunks": collection.count(),
-        "collection_name": f"user_{user_id}"
+        "total_chunks": count,
+        "collection_name": f"user_{user_id}",
+        "embedding": {key: value for key, value in (collection.metadata or {}).items() if key.startswith("embedding_")},
+        "rescore": EMBEDDING_RESCORE if rescoring() else "none"
     }
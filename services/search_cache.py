@@ -0,0 +1,96 @@
+"""
+Кэш результатов rag.search
+
+В разговоре один и тот же поиск повторяется постоянно: КП, уточняющие вопросы,
+повторные нажатия кнопок. Каждый повтор — эмбеддинг запроса и запрос к HNSW.
+Ключ — нормализованный запрос + фильтры, к записи приложена версия коллекции
+пользователя (rag_versions в SQLite). Любая запись или удаление чанков поднимает
+версию, и старые результаты больше не отдаются — даже если индексировал
+соседний процесс. Поверх версии — TTL и ограничения по числу записей и памяти.
+"""
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from config import SEARCH_CACHE_TTL, SEARCH_CACHE_MAX_ITEMS, SEARCH_CACHE_MAX_MB
+from services.embedding_cache import normalize
+
+# key → (user_id, версия, время записи, размер, чанки)
+_entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+_size = 0
+# Инвалидация приходит из потоков Chroma, чтение — из event loop
+_lock = threading.Lock()
+
+_stats = {"hits": 0, "misses": 0, "stale": 0}
+
+
+def make_key(user_id: int, query: str, **filters) -> tuple:
+    return (user_id, normalize(query).lower(), tuple(sorted(filters.items())))
+
+
+def _estimate_size(chunks: List[Dict]) -> int:
+    # Кириллица в str — 2 байта на символ, плюс метаданные и накладные расходы
+    return sum(len(c["text"]) * 2 + 500 for c in chunks) + 200
+
+
+def _copy(chunks: List[Dict]) -> List[Dict]:
+    """Вызывающий может дописать в чанк — кэш от этого не должен меняться"""
+    return [{**c, "metadata": dict(c["metadata"])} for c in chunks]
+
+
+def _drop(key: tuple):
+    global _size
+    entry = _entries.pop(key, None)
+    if entry:
+        _size -= entry[3]
+
+
+def get(key: tuple, version: int) -> Optional[List[Dict]]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            _stats["misses"] += 1
+            return None
+        _, entry_version, stored_at, _, chunks = entry
+        if entry_version != version or time.monotonic() - stored_at > SEARCH_CACHE_TTL:
+            _drop(key)
+            _stats["stale"] += 1
+            _stats["misses"] += 1
+            return None
+        _entries.move_to_end(key)
+        _stats["hits"] += 1
+        return _copy(chunks)
+
+
+def put(key: tuple, version: int, chunks: List[Dict]):
+    global _size
+    size = _estimate_size(chunks)
+    max_bytes = SEARCH_CACHE_MAX_MB * 1024 * 1024
+    if size > max_bytes:
+        return
+    with _lock:
+        _drop(key)
+        _entries[key] = (key[0], version, time.monotonic(), size, _copy(chunks))
+        _size += size
+        while _entries and (len(_entries) > SEARCH_CACHE_MAX_ITEMS or _size > max_bytes):
+            _drop(next(iter(_entries)))
+
+
+def invalidate(user_id: int):
+    """Сразу освободить память от результатов пользователя — версия уже поднята"""
+    with _lock:
+        for key in [k for k, entry in _entries.items() if entry[0] == user_id]:
+            _drop(key)
+
+
+def get_stats() -> Dict:
+    """Статистика кэша поиска"""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {
+        **_stats,
+        "hit_rate": round(_stats["hits"] / lookups, 3) if lookups else 0.0,
+        "entries": len(_entries),
+        "size_mb": round(_size / 1024 / 1024, 2),
+        "max_size_mb": SEARCH_CACHE_MAX_MB
+    }
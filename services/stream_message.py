@@ -0,0 +1,159 @@
+"""
+Потоковый ответ в Telegram — одно сообщение, которое правится по мере генерации
+
+Без потока риэлтор 10–20 секунд смотрит на пустой чат, пока LLM дописывает
+длинный список квартир. Здесь сразу уходит заглушка, а текст подставляется
+в неё через editMessageText:
+
+- правки не чаще STREAM_EDIT_INTERVAL — лимит Telegram на правки в чате;
+  между правками копится сколько угодно токенов, ответ LLM не ждёт Telegram;
+- промежуточные правки — без разметки: недописанный HTML Telegram отвергает;
+- финальный текст — с HTML (без него, если разметка битая), хвост длиннее
+  4096 символов уходит отдельными сообщениями.
+
+Время от начала обработки запроса до первого видимого текста (TTFT) — в /stats.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Dict, List, Optional
+
+from config import STREAM_EDIT_INTERVAL
+from services.llm_gateway import percentile
+from services.telegram import send_message, send_message_get_id, edit_message_text, delete_message
+
+MAX_MESSAGE_CHARS = 4096  # лимит Telegram на текст сообщения
+PLACEHOLDER = "⏳ Ищу в материалах..."
+CURSOR = " ▌"
+SAMPLES = 500  # последних ответов для перцентилей
+
+# Статистика за время жизни процесса
+_ttft: deque = deque(maxlen=SAMPLES)
+_total: deque = deque(maxlen=SAMPLES)
+_stats = {"answers": 0, "edits": 0, "failed_edits": 0, "cancelled": 0}
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_CHARS) -> List[str]:
+    """Текст → части до limit символов, по границам строк где возможно"""
+    parts = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        parts.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not parts:
+        parts.append(text)
+    return parts
+
+
+class StreamingMessage:
+    """
+    Сообщение-заглушка, которое обновляется update() и закрывается finish() или cancel()
+
+    started — момент начала обработки запроса (time.perf_counter), от него считается TTFT.
+    """
+
+    def __init__(self, chat_id: int, started: Optional[float] = None):
+        self.chat_id = chat_id
+        self.started = started or time.perf_counter()
+        self.message_id: Optional[int] = None
+        self._text = ""
+        self._shown = ""
+        self._first_visible: Optional[float] = None
+        self._changed = asyncio.Event()
+        self._closed = asyncio.Event()
+        self._placeholder: Optional[asyncio.Task] = None
+        self._editor: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Отправить заглушку и запустить правки — не ждёт Telegram"""
+        self._placeholder = asyncio.create_task(send_message_get_id(self.chat_id, PLACEHOLDER))
+        self._editor = asyncio.create_task(self._edit_loop())
+
+    async def update(self, text: str):
+        """Текущий видимый текст ответа; в сообщение попадёт на ближайшей правке"""
+        self._text = text
+        self._changed.set()
+
+    def _visible(self):
+        if self._first_visible is None:
+            self._first_visible = time.perf_counter() - self.started
+            _ttft.append(self._first_visible)
+
+    async def _edit_loop(self):
+        self.message_id = await self._placeholder
+        if not self.message_id:
+            return
+        while not self._closed.is_set():
+            await self._changed.wait()
+            self._changed.clear()
+            if self._closed.is_set():
+                return
+            text = self._text
+            if not text.strip() or text == self._shown:
+                continue
+            limit = MAX_MESSAGE_CHARS - len(CURSOR)
+            preview = text if len(text) <= limit else text[:limit - 1] + "…"
+            if await edit_message_text(self.chat_id, self.message_id, preview + CURSOR, parse_mode=None):
+                self._shown = text
+                _stats["edits"] += 1
+                self._visible()
+            else:
+                _stats["failed_edits"] += 1
+            # Пауза до следующей правки; close() прерывает её сразу
+            try:
+                await asyncio.wait_for(self._closed.wait(), STREAM_EDIT_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _close(self) -> Optional[int]:
+        """Остановить правки (текущая доходит до конца) и вернуть message_id заглушки"""
+        if self._placeholder is None:
+            return None
+        self._closed.set()
+        self._changed.set()
+        await self._editor
+        return await self._placeholder
+
+    async def finish(self, text: str) -> bool:
+        """Поставить окончательный текст; False — заглушки нет или правка не прошла"""
+        message_id = await self._close()
+        if not message_id:
+            return False
+        parts = split_message(text)
+        ok = (
+            await edit_message_text(self.chat_id, message_id, parts[0])
+            or await edit_message_text(self.chat_id, message_id, parts[0], parse_mode=None)
+        )
+        if not ok:
+            _stats["failed_edits"] += 1
+            return False
+        for part in parts[1:]:
+            await send_message(self.chat_id, part)
+        self._visible()
+        _stats["answers"] += 1
+        _total.append(time.perf_counter() - self.started)
+        print(f"[STREAM] chat {self.chat_id}: первый текст через {self._first_visible:.2f}s, "
+              f"ответ целиком через {_total[-1]:.2f}s")
+        return True
+
+    async def cancel(self):
+        """Убрать заглушку — ответ уйдёт обычным путём (действие, калькулятор, ошибка)"""
+        message_id = await self._close()
+        if message_id:
+            await delete_message(self.chat_id, message_id)
+        _stats["cancelled"] += 1
+
+
+def get_stats() -> Dict:
+    """TTFT и время полного ответа потоковых сообщений"""
+    ttft, total = sorted(_ttft), sorted(_total)
+    return {
+        **_stats,
+        "ttft_p50": percentile(ttft, 0.5),
+        "ttft_p95": percentile(ttft, 0.95),
+        "total_p50": percentile(total, 0.5),
+        "total_p95": percentile(total, 0.95),
+        "edit_interval": STREAM_EDIT_INTERVAL
+    }
@@ -3,7 +3,7 @@ Style Advisor — LLM определяет оптимальный стиль д
 """
 import json
 from typing import Dict, Any, Optional
-from services.llm import client
+from services import llm_gateway
 from config import OPENAI_MODEL
 
 
@@ -67,7 +67,7 @@ async def get_style_recommendation(
         "reasoning": "Стиль по умолчанию"
     }
     
-    if not client:
+    if not llm_gateway.available():
         return default
     
     # Определяем класс ЖК по цене если не указан
@@ -98,7 +98,7 @@ async def get_style_recommendation(
     )
     
     try:
-        response = await client.chat.completions.create(
+        response = await llm_gateway.chat(
             model=OPENAI_MODEL,
             messages=[
                 {"role": "system", "content": "Ты дизайн-консультант. Отвечай только JSON."},
@@ -51,6 +51,95 @@ async def send_message(
         return False
 
 
+async def send_message_get_id(chat_id: int, text: str, parse_mode: Optional[str] = None) -> Optional[int]:
+    """Отправить сообщение и вернуть его message_id — для последующих правок"""
+    token = get_token()
+    if not token:
+        print("[TG] Token not set")
+        return None
+    
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    
+    payload = {"chat_id": chat_id, "text": text, "disable_web_page_preview": True}
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=payload) as resp:
+                result = await resp.json()
+                if not result.get("ok"):
+                    print(f"[TG] Error: {result}")
+                    return None
+                return result["result"]["message_id"]
+    except Exception as e:
+        print(f"[TG] send_message_get_id error: {e}")
+        return None
+
+
+async def edit_message_text(
+    chat_id: int,
+    message_id: int,
+    text: str,
+    parse_mode: Optional[str] = "HTML"
+) -> bool:
+    """
+    Заменить текст отправленного сообщения
+    
+    На 429 ждёт retry_after и пробует ещё раз. «message is not modified» —
+    не ошибка: в сообщении уже этот текст.
+    """
+    token = get_token()
+    if not token:
+        return False
+    
+    url = f"https://api.telegram.org/bot{token}/editMessageText"
+    
+    payload = {
+        "chat_id": chat_id,
+        "message_id": message_id,
+        "text": text,
+        "disable_web_page_preview": True
+    }
+    if parse_mode:
+        payload["parse_mode"] = parse_mode
+    
+    try:
+        async with aiohttp.ClientSession() as session:
+            for attempt in range(2):
+                async with session.post(url, json=payload) as resp:
+                    result = await resp.json()
+                if result.get("ok") or "message is not modified" in result.get("description", ""):
+                    return True
+                retry_after = (result.get("parameters") or {}).get("retry_after")
+                if retry_after and attempt == 0:
+                    await asyncio.sleep(retry_after)
+                    continue
+                print(f"[TG] edit error: {result}")
+                return False
+    except Exception as e:
+        print(f"[TG] edit_message_text error: {e}")
+        return False
+
+
+async def delete_message(chat_id: int, message_id: int) -> bool:
+    """Удалить сообщение бота"""
+    token = get_token()
+    if not token:
+        return False
+    
+    url = f"https://api.telegram.org/bot{token}/deleteMessage"
+    
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json={"chat_id": chat_id, "message_id": message_id}) as resp:
+                result = await resp.json()
+                return result.get("ok", False)
+    except Exception as e:
+        print(f"[TG] delete_message error: {e}")
+        return False
+
+
 async def send_message_with_buttons(
     chat_id: int,
     text: str,